@@ -0,0 +1,247 @@
+# attachments.py
+
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+from PyQt6.QtCore import QObject, QBuffer, QIODevice, QThreadPool, Qt, pyqtSignal
+from PyQt6.QtGui import QImage, QPixmap, QPixmapCache
+
+import metrics
+from chat_core import generate_push_id
+from storage import StorageClient, StorageError, UploadCancelled, UploadSessionLost, attachment_path
+from task_runner import run_in_background, run_in_pool
+
+# Vorschaubilder liegen zusätzlich zur Anzeige im Speicher auf der Festplatte, damit Räume mit vielen Bildern
+# auch nach einem Neustart ohne erneuten Download scrollen
+THUMBNAIL_DIR = os.path.join(os.path.expanduser('~'), '.tiwut_chat_thumbnails')
+THUMBNAIL_CACHE_BYTES = 50 * 1024 * 1024
+# Längste Kante der Vorschau in Pixeln
+THUMBNAIL_SIZE = 320
+# Gleichzeitige Vorschau-Downloads (auf dem gemeinsamen Task-Pool, der auch Senden und Login bedient)
+MAX_THUMBNAIL_DOWNLOADS = 2
+# Wartende Vorschauen; beim schnellen Scrollen fallen die ältesten (längst nicht mehr sichtbaren) heraus
+MAX_THUMBNAIL_QUEUE = 50
+PIXMAP_CACHE_KB = 64 * 1024
+# Gleichzeitige Uploads; sie laufen auf einem eigenen Pool, weil ein großer Upload minutenlang einen Thread belegt
+# und sonst Senden, Token-Erneuerung und Vorschauen auf dem gemeinsamen Task-Pool ausbremsen würde
+MAX_UPLOAD_THREADS = 2
+
+_upload_pool = None
+
+def upload_pool():
+    global _upload_pool
+    if _upload_pool is None:
+        _upload_pool = QThreadPool(); _upload_pool.setMaxThreadCount(MAX_UPLOAD_THREADS)
+    return _upload_pool
+
+def make_thumbnail(file_path):
+    """JPEG-Vorschau eines Bildes als (daten, breite, höhe); None, wenn sich die Datei nicht als Bild lesen lässt."""
+    image = QImage(file_path)
+    if image.isNull(): return None
+    if max(image.width(), image.height()) > THUMBNAIL_SIZE:
+        image = image.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+    buffer = QBuffer(); buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buffer, "JPEG", 80)
+    return bytes(buffer.data()), image.width(), image.height()
+
+class ThumbnailCache:
+    """Vorschaubilder auf der Festplatte, begrenzt auf max_bytes; verdrängt werden die am längsten nicht benutzten."""
+    def __init__(self, directory=THUMBNAIL_DIR, max_bytes=THUMBNAIL_CACHE_BYTES):
+        self.directory, self.max_bytes, self._lock = directory, max_bytes, threading.Lock()
+        # Dateiname -> (letzte Benutzung, Größe); das Verzeichnis wird erst beim ersten Zugriff eingelesen, nicht beim Start
+        self._file_index = None
+
+    @property
+    def _files(self):
+        # Nur unter self._lock benutzen
+        if self._file_index is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._file_index = {entry.name: (entry.stat().st_mtime, entry.stat().st_size) for entry in os.scandir(self.directory) if entry.is_file()}
+        return self._file_index
+
+    @staticmethod
+    def _name(path): return hashlib.sha1(path.encode('utf-8')).hexdigest()
+
+    def get(self, path):
+        name = self._name(path)
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as f: data = f.read()
+            os.utime(os.path.join(self.directory, name)) # Die Änderungszeit dient nach einem Neustart als letzte Benutzung
+        except OSError: return None
+        with self._lock: self._files[name] = (time.time(), len(data))
+        return data
+
+    def put(self, path, data):
+        name = self._name(path)
+        target = os.path.join(self.directory, name)
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(target + ".tmp", 'wb') as f: f.write(data)
+            os.replace(target + ".tmp", target)
+        except OSError as e: metrics.count('thumbnail.write_failed', error=str(e)); return
+        with self._lock:
+            self._files[name] = (time.time(), len(data))
+            total = sum(size for _, size in self._files.values())
+            for old_name, (_, size) in sorted(self._files.items(), key=lambda item: item[1][0]):
+                if total <= self.max_bytes: break
+                if old_name == name: continue
+                try: os.remove(os.path.join(self.directory, old_name))
+                except OSError: pass
+                total -= size; del self._files[old_name]
+
+    def total_bytes(self):
+        with self._lock: return sum(size for _, size in self._files.values())
+
+class ThumbnailLoader(QObject):
+    """Lädt Vorschaubilder erst, wenn sie gezeichnet werden: aus dem Speicher, sonst von der Platte, sonst vom Server."""
+    # Storage-Pfad der Vorschau, die jetzt bereitliegt
+    thumbnailReady = pyqtSignal(str)
+
+    def __init__(self, storage, cache, parent=None):
+        super().__init__(parent)
+        self.storage, self.cache = storage, cache
+        # Wartende Vorschauen (Pfad -> Beschreibung) in Anforderungsreihenfolge; die zuletzt gezeichnete kommt zuerst dran
+        self._queued, self._loading, self._failed = {}, set(), set()
+        QPixmapCache.setCacheLimit(max(QPixmapCache.cacheLimit(), PIXMAP_CACHE_KB))
+
+    def pixmap(self, thumbnail):
+        """Die Vorschau, falls schon geladen; sonst None, und das Laden wird angestoßen."""
+        path = thumbnail.get('path')
+        if not isinstance(path, str): return None
+        pixmap = QPixmapCache.find(path)
+        if pixmap is not None: return pixmap
+        if path not in self._loading and path not in self._failed:
+            self._queued.pop(path, None); self._queued[path] = thumbnail
+            while len(self._queued) > MAX_THUMBNAIL_QUEUE: self._queued.pop(next(iter(self._queued)))
+            self._start_next()
+        return None
+
+    def _start_next(self):
+        while self._queued and len(self._loading) < MAX_THUMBNAIL_DOWNLOADS:
+            path, thumbnail = self._queued.popitem()
+            self._loading.add(path)
+            task = run_in_background(self._fetch, path, thumbnail.get('token'))
+            task.succeeded.connect(lambda data, path=path: self._on_loaded(path, data))
+            task.failed.connect(lambda error, path=path: self._on_failed(path, error))
+
+    def _fetch(self, path, token):
+        # Läuft im Worker-Thread
+        data = self.cache.get(path)
+        if data is None:
+            with metrics.timer('storage.thumbnail_download'): data = self.storage.download(path, token)
+            self.cache.put(path, data)
+        else: metrics.count('thumbnail.disk_hit')
+        return data
+
+    def _on_loaded(self, path, data):
+        self._loading.discard(path)
+        pixmap = QPixmap()
+        if pixmap.loadFromData(data): QPixmapCache.insert(path, pixmap); self.thumbnailReady.emit(path)
+        else: self._failed.add(path)
+        self._start_next()
+
+    def _on_failed(self, path, error):
+        # Nicht bei jedem Neuzeichnen erneut versuchen
+        metrics.count('thumbnail.failed', path=path, error=error)
+        self._loading.discard(path); self._failed.add(path); self._start_next()
+
+class AttachmentUploader(QObject):
+    """Lädt Anhänge im Hintergrund hoch (bei Bildern zuerst eine Vorschau), meldet den Fortschritt und lässt sich abbrechen.
+
+    Offene Uploads stehen mit ihrer Sitzungs-URL in der Meta-Tabelle des MessageStore und werden nach einem Neustart
+    an der vom Server bestätigten Stelle fortgesetzt."""
+    # Push-ID der künftigen Nachricht, gesendete und gesamte Bytes
+    progress = pyqtSignal(str, int, int)
+    # Raum-ID, Push-ID und Beschreibung des Anhangs für die Nachricht
+    uploaded = pyqtSignal(str, str, dict)
+    # Raum-ID, Push-ID und Fehlermeldung; abgebrochene Uploads melden nichts
+    failed = pyqtSignal(str, str, str)
+    # Push-ID; nach jedem Ende eines Uploads (fertig, fehlgeschlagen oder abgebrochen)
+    finished = pyqtSignal(str)
+    UPLOADS_KEY = 'pendingUploads'
+
+    def __init__(self, firebase_manager, thumbnail_cache=None, parent=None):
+        super().__init__(parent)
+        self.storage, self.store, self.thumbnail_cache = StorageClient(firebase_manager.tokens), firebase_manager.message_store, thumbnail_cache
+        self.active, self._cancelled, self._lock = set(), set(), threading.Lock()
+
+    def upload(self, room_id, file_path):
+        """Startet den Upload einer Datei für eine neue Nachricht in `room_id`; gibt deren Push-ID zurück."""
+        key = generate_push_id()
+        record = {'room_id': room_id, 'file': file_path, 'name': os.path.basename(file_path), 'size': os.path.getsize(file_path),
+                  'contentType': mimetypes.guess_type(file_path)[0] or 'application/octet-stream'}
+        self._save(key, record); self._start(key, record)
+        return key
+
+    def resume_all(self):
+        """Setzt Uploads fort, die beim letzten Beenden noch liefen."""
+        for key, record in (self.store.get_meta(self.UPLOADS_KEY) or {}).items():
+            if key in self.active: continue
+            if os.path.exists(record['file']): self._start(key, record)
+            else: self._forget(key)
+
+    def cancel(self, key):
+        if key in self.active: self._cancelled.add(key)
+
+    def _save(self, key, record):
+        with self._lock:
+            uploads = self.store.get_meta(self.UPLOADS_KEY) or {}
+            uploads[key] = record; self.store.set_meta(self.UPLOADS_KEY, uploads)
+
+    def _forget(self, key):
+        with self._lock:
+            uploads = self.store.get_meta(self.UPLOADS_KEY) or {}
+            if uploads.pop(key, None) is not None: self.store.set_meta(self.UPLOADS_KEY, uploads)
+
+    def _start(self, key, record):
+        self.active.add(key)
+        task = run_in_pool(upload_pool, self._run, key, record)
+        task.succeeded.connect(lambda attachment: self._on_uploaded(key, record, attachment))
+        task.failed.connect(lambda error: self._on_failed(key, record, error))
+
+    def _run(self, key, record):
+        # Läuft im Worker-Thread; der Fortschritt wird per Signal in den GUI-Thread gemeldet
+        path = attachment_path(record['room_id'], key, record['name'])
+        if 'thumbnail' not in record and record['contentType'].startswith('image/'):
+            thumbnail = make_thumbnail(record['file'])
+            if thumbnail:
+                data, width, height = thumbnail
+                meta = self.storage.upload_bytes(data, f"{path}.thumb.jpg", 'image/jpeg')
+                record['thumbnail'] = {'path': meta['name'], 'token': meta['downloadTokens'].split(',')[0], 'width': width, 'height': height}
+                # Die eigene Vorschau nicht gleich wieder herunterladen
+                if self.thumbnail_cache: self.thumbnail_cache.put(meta['name'], data)
+                self._save(key, record)
+        def on_session(upload_url): record['uploadUrl'] = upload_url; self._save(key, record)
+        def upload_file(upload_url):
+            return self.storage.upload_file(record['file'], path, record['contentType'], upload_url, on_session,
+                                            lambda sent, total: self.progress.emit(key, sent, total), lambda: key in self._cancelled)
+        try:
+            with metrics.timer('storage.upload', bytes=record['size']):
+                try: meta = upload_file(record.get('uploadUrl'))
+                except UploadSessionLost:
+                    # Sitzung abgelaufen oder verworfen: einmal mit neuer Sitzung von vorn
+                    metrics.count('storage.session_restart'); record.pop('uploadUrl', None); self._save(key, record)
+                    meta = upload_file(None)
+        except StorageError as e:
+            # Endgültig abgelehnt: ohne Sitzung vergisst _on_failed() den Upload, statt ihn bei jedem Start erneut zu versuchen
+            if not e.retryable: record.pop('uploadUrl', None)
+            raise
+        attachment = {'path': path, 'name': record['name'], 'size': record['size'], 'contentType': record['contentType'],
+                      'token': meta['downloadTokens'].split(',')[0]}
+        if 'thumbnail' in record: attachment['thumbnail'] = record['thumbnail']
+        return attachment
+
+    def _on_uploaded(self, key, record, attachment):
+        self.active.discard(key); self._cancelled.discard(key); self._forget(key)
+        self.uploaded.emit(record['room_id'], key, attachment); self.finished.emit(key)
+
+    def _on_failed(self, key, record, error):
+        self.active.discard(key)
+        if key in self._cancelled or error == UploadCancelled.__name__: self._cancelled.discard(key); self._forget(key)
+        else:
+            # Mit Sitzung bleibt der Upload für resume_all() stehen; ohne (z. B. vom Server abgelehnt) gibt es nichts fortzusetzen
+            if 'uploadUrl' not in record: self._forget(key)
+            self.failed.emit(record['room_id'], key, error)
+        self.finished.emit(key)
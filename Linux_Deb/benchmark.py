@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# benchmark.py
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# Reproduzierbare Leistungsmessung gegen den lokalen Ersatzserver (fake_firebase.py).
+# Jede Raumgröße läuft in einem eigenen Prozess mit leerem HOME, damit Spitzen-RSS und Cache unabhängig sind.
+# python3 benchmark.py --sizes 1000 10000 100000 --output results.json [--baseline old.json]
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+BENCH_ROOM, BENCH_USER, BENCH_PASSWORD = "bench", "bench", "benchpass"
+# Kennzahlen, bei denen größere Werte besser sind; bei allen anderen ist kleiner besser
+HIGHER_IS_BETTER = {"stream_msgs_per_s"}
+
+def run_size(size, args):
+    """Startet Ersatzserver und Messprozess für eine Raumgröße und gibt deren Ergebnis zurück."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    server = subprocess.Popen([sys.executable, os.path.join(here, 'fake_firebase.py'), '--port', '0', '--room', f"{BENCH_ROOM}={size}",
+                               '--user', f"{BENCH_USER}:{BENCH_PASSWORD}", '--keepalive', '5'], stdout=subprocess.PIPE, text=True)
+    try:
+        url = server.stdout.readline().strip()
+        with tempfile.TemporaryDirectory() as home:
+            env = {**os.environ, 'HOME': home, 'TIWUT_FIREBASE_EMULATOR': url, 'QT_QPA_PLATFORM': os.environ.get('QT_QPA_PLATFORM', 'offscreen')}
+            child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', '--size', str(size), '--url', url,
+                                    '--stream-count', str(args.stream_count), '--sends', str(args.sends)],
+                                   env=env, stdout=subprocess.PIPE, text=True, timeout=args.timeout)
+        if child.returncode != 0: return {"size": size, "error": f"benchmark process exited with {child.returncode}"}
+        return json.loads(child.stdout.strip().splitlines()[-1])
+    finally:
+        server.terminate(); server.wait()
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] if ordered else None
+
+def measure(size, url, stream_count, sends):
+    """Läuft im Messprozess: öffnet den Raum wie die echte Anwendung und misst die einzelnen Pfade."""
+    import requests
+    from PyQt6.QtWidgets import QApplication
+    from PyQt6.QtCore import QEventLoop, QTimer
+    from firebase_manager import FirebaseManager
+    import main_chat_window
+
+    app = QApplication(sys.argv)
+    wake = QTimer(); wake.start(10) # Weckt processEvents() regelmäßig für die Timeout-Prüfung
+
+    def wait_until(condition, timeout=120):
+        deadline = time.perf_counter() + timeout
+        while not condition():
+            if time.perf_counter() > deadline: raise TimeoutError("benchmark step timed out")
+            app.processEvents(QEventLoop.ProcessEventsFlag.WaitForMoreEvents)
+
+    # Jede Nachricht zählen, die bei on_new_message ankommt (vor dem Erzeugen des Fensters einhängen)
+    arrivals = {}
+    original_on_new_message = main_chat_window.MainChatWindow.on_new_message
+    def counting_on_new_message(self, room_id, key, msg_data):
+        original_on_new_message(self, room_id, key, msg_data); arrivals[key] = time.perf_counter()
+    main_chat_window.MainChatWindow.on_new_message = counting_on_new_message
+
+    firebase_manager = FirebaseManager()
+    success, user_data = firebase_manager.login(BENCH_USER, BENCH_PASSWORD)
+    if not success: raise RuntimeError(f"login failed: {user_data}")
+    result = {"size": size}
+
+    # 1. Raum öffnen bis zur ersten sichtbaren Seite (Raumliste, Stream-Snapshot, Rendern)
+    start = time.perf_counter()
+    window = main_chat_window.MainChatWindow(firebase_manager, user_data); window.show()
+    wait_until(lambda: BENCH_ROOM in window.room_items) # Leeres HOME: die Raumliste kommt erst vom Server
+    window.on_room_selected(window.room_items[BENCH_ROOM])
+    wait_until(lambda: not window.awaiting_first_page)
+    app.processEvents()
+    result["open_room_s"] = time.perf_counter() - start
+
+    # 2. Kompletten Verlauf laden, speichern und anzeigen
+    loaded = {}
+    start = time.perf_counter()
+    firebase_manager.load_message_history(BENCH_ROOM, lambda room_id, messages: loaded.update(messages=messages),
+                                          lambda error: loaded.update(error=error), limit=None)
+    wait_until(lambda: loaded)
+    if 'error' in loaded: raise RuntimeError(loaded['error'])
+    firebase_manager.message_store.add_messages(BENCH_ROOM, loaded['messages'])
+    finished = []
+    window.message_model.loadingFinished.connect(lambda: finished.append(True))
+    window.message_model.set_messages(loaded['messages'].items(), incremental=True)
+    window.message_view.scroll_to_end(); app.processEvents()
+    # Ab hier ist der Raum bedienbar; ältere Blöcke folgen über die nächsten Event-Loop-Durchläufe
+    result["history_first_chunk_s"] = time.perf_counter() - start
+    wait_until(lambda: finished)
+    result["history_full_load_s"] = time.perf_counter() - start
+    # Wieder auf den normalen Zustand des Raums zurücksetzen
+    window.on_room_selected(window.room_items[BENCH_ROOM]); app.processEvents()
+
+    # 3. Stream-Durchsatz: der Server schreibt stream_count Nachrichten so schnell er kann
+    before = len(arrivals)
+    start = time.perf_counter()
+    requests.post(f"{url}/__fake__/inject", params={'room': BENCH_ROOM, 'count': stream_count}, timeout=10)
+    wait_until(lambda: len(arrivals) - before >= stream_count)
+    result["stream_msgs_per_s"] = stream_count / (time.perf_counter() - start)
+
+    # 4. Sende-Rundlauf: vom Einreihen in die Outbox bis zum Echo über den Stream
+    latencies = []
+    for i in range(sends):
+        start = time.perf_counter()
+        key = window.outbox.enqueue(BENCH_ROOM, f"Benchmark message {i}")
+        wait_until(lambda: key in arrivals)
+        latencies.append((arrivals[key] - start) * 1000)
+    result.update(send_rtt_median_ms=percentile(latencies, 0.5), send_rtt_p95_ms=percentile(latencies, 0.95), send_rtt_max_ms=max(latencies, default=None))
+
+    # ru_maxrss ist unter Linux in KiB, unter macOS in Byte
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_mb"] = peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    window.close()
+    return result
+
+def compare(results, baseline, tolerance):
+    """Vergleicht mit einer früheren Ergebnisdatei; gibt die Liste der Verschlechterungen zurück."""
+    previous = {entry['size']: entry for entry in baseline.get('results', [])}
+    regressions = []
+    for entry in results:
+        old = previous.get(entry['size'], {})
+        for metric, value in entry.items():
+            if metric == 'size' or not isinstance(value, (int, float)) or not isinstance(old.get(metric), (int, float)) or not old[metric]: continue
+            change = (value - old[metric]) / old[metric]
+            if metric in HIGHER_IS_BETTER: change = -change
+            if change > tolerance: regressions.append({"size": entry['size'], "metric": metric, "baseline": old[metric], "value": value, "change": change})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiwut Chat performance benchmark against the local Firebase stand-in.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="messages per room")
+    parser.add_argument('--stream-count', type=int, default=2000, help="messages injected for the stream throughput test")
+    parser.add_argument('--sends', type=int, default=50, help="messages sent for the round-trip test")
+    parser.add_argument('--timeout', type=int, default=900, help="seconds per room size")
+    parser.add_argument('--output', help="write results as JSON to this file (default: stdout)")
+    parser.add_argument('--baseline', help="earlier results file; exit with status 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative slowdown against the baseline")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.size, args.url, args.stream_count, args.sends))); return
+
+    report = {"created": time.strftime('%Y-%m-%dT%H:%M:%S%z'), "python": platform.python_version(), "platform": platform.platform(),
+              "stream_count": args.stream_count, "sends": args.sends, "results": []}
+    for size in args.sizes:
+        print(f"DEBUG: Benchmark mit {size} Nachrichten...", file=sys.stderr)
+        report["results"].append(run_size(size, args))
+    if args.baseline:
+        with open(args.baseline) as f: report["regressions"] = compare(report["results"], json.load(f), args.tolerance)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f: f.write(output + "\n")
+    else: print(output)
+    if report.get("regressions") or any('error' in entry for entry in report["results"]): sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+# chat_client.py
+
+import asyncio
+import base64
+import concurrent.futures
+import json
+import ssl
+import threading
+from contextlib import asynccontextmanager
+from urllib.parse import unquote, urljoin, urlsplit, urlencode
+from urllib.request import getproxies, proxy_bypass
+
+from chat_core import (HISTORY_PAGE_SIZE, STREAM_READ_TIMEOUT, SseParser, TokenState, auth_endpoints, backoff_delay, email_for, error_message,
+                       generate_push_id, history_query, message_payload, multi_path_update, stream_query, token_refresh_result)
+from config import firebaseConfig
+
+# asyncio-Client auf dem Protokollkern von chat_core, nur mit der Standardbibliothek. Die Qt-Anwendung hält damit alle
+# Raum-Streams auf einer Event-Loop (stream_manager.py), load_generator.py treibt viele Benutzer gleichzeitig ohne GUI.
+# Liegt getrennt, damit die Qt-Anwendung beim Start nicht asyncio importiert.
+
+# Weiterleitungen wie bei requests; Firebase leitet Streams z. B. per 307 auf den Server des Namespaces um
+REDIRECT_STATUSES, MAX_REDIRECTS = (301, 302, 303, 307, 308), 5
+
+# --- asyncio-Transport ---
+class HttpError(OSError):
+    """Transportfehler des asyncio-Clients (Verbindung, Timeout, kaputte Antwort)."""
+
+async def _within(timeout, awaitable):
+    """Wie asyncio.wait_for; verliert aber kein cancel(), wenn awaitable im selben Moment fertig wird (wait_for vor Python 3.12)."""
+    if not hasattr(asyncio, 'timeout'): return await asyncio.wait_for(awaitable, timeout) # Vor 3.11 gibt es nur wait_for
+    async with asyncio.timeout(timeout): return await awaitable
+
+class AsyncResponse:
+    def __init__(self, status, headers, body=b"", url=None):
+        self.status, self.headers, self.body, self.url = status, headers, body, url
+    @property
+    def text(self): return self.body.decode('utf-8', 'replace')
+    def json(self): return json.loads(self.body) if self.body else None
+
+class AsyncHttp:
+    """Minimaler HTTP/1.1-Client auf asyncio-Streams mit Keep-Alive-Pool pro Host, nur mit der Standardbibliothek.
+
+    Viele ChatClients können sich eine Instanz teilen; Streams (SSE) belegen jeweils eine eigene Verbindung.
+    Weiterleitungen werden verfolgt, Proxys kommen wie bei requests aus HTTP_PROXY/HTTPS_PROXY/NO_PROXY."""
+    TIMEOUT = 15
+    MAX_IDLE_PER_HOST = 32
+
+    def __init__(self):
+        self._idle, self._ssl, self._proxies = {}, None, getproxies()
+
+    def _proxy(self, origin):
+        """(Host, Port, Proxy-Authorization oder None) des Proxys für origin, None ohne Proxy."""
+        scheme, host, _ = origin
+        url = self._proxies.get(scheme)
+        if not url or proxy_bypass(host): return None
+        parts = urlsplit(url if '://' in url else f"http://{url}")
+        auth = f"{unquote(parts.username)}:{unquote(parts.password or '')}" if parts.username else None
+        return parts.hostname, parts.port or 80, auth and "Basic " + base64.b64encode(auth.encode()).decode()
+
+    async def _connect(self, origin):
+        scheme, host, port = origin
+        if scheme == 'https' and self._ssl is None: self._ssl = ssl.create_default_context()
+        proxy = self._proxy(origin)
+        if not proxy: return await asyncio.open_connection(host, port, ssl=self._ssl if scheme == 'https' else None, limit=1 << 20)
+        reader, writer = await asyncio.open_connection(proxy[0], proxy[1], limit=1 << 20)
+        if scheme == 'https':
+            try: await self._tunnel(reader, writer, host, port, proxy[2])
+            except BaseException: writer.close(); raise
+        return reader, writer
+
+    async def _tunnel(self, reader, writer, host, port, proxy_auth):
+        # HTTPS über einen Proxy: CONNECT, danach TLS mit dem Zielserver durch den Tunnel
+        lines = [f"CONNECT {host}:{port} HTTP/1.1", f"Host: {host}:{port}"] + ([f"Proxy-Authorization: {proxy_auth}"] if proxy_auth else [])
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')); await writer.drain()
+        status, _ = await self._read_head(reader)
+        if status != 200: raise HttpError(f"proxy CONNECT to {host}:{port} failed: HTTP {status}")
+        if not hasattr(writer, 'start_tls'): raise HttpError("HTTPS through a proxy needs Python 3.11 or newer")
+        await writer.start_tls(self._ssl, server_hostname=host)
+
+    def _via_proxy(self, origin, host, target, headers):
+        """http über einen Proxy geht mit absoluter URL und ggf. Proxy-Authorization an den Proxy; sonst bleibt alles, wie es ist."""
+        proxy = self._proxy(origin) if origin[0] == 'http' else None
+        if not proxy: return target, headers
+        return f"http://{host}{target}", {**(headers or {}), **({'Proxy-Authorization': proxy[2]} if proxy[2] else {})}
+
+    @staticmethod
+    def _split(url, params):
+        parts = urlsplit(url)
+        origin = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        query = "&".join(q for q in (parts.query, urlencode(params or {})) if q)
+        return origin, parts.netloc, (parts.path or "/") + (f"?{query}" if query else "")
+
+    @staticmethod
+    async def _send(writer, method, host, target, body, headers):
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {host}", "Connection: keep-alive", f"Content-Length: {len(body)}"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    @staticmethod
+    async def _read_head(reader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head.decode('latin-1').split("\r\n")
+        headers = {}
+        for line in header_lines:
+            if ':' in line: name, _, value = line.partition(':'); headers[name.strip().lower()] = value.strip()
+        return int(status_line.split()[1]), headers
+
+    @staticmethod
+    async def _iter_body(reader, status, headers):
+        """Liefert den Rumpf stückweise (chunked, Content-Length oder bis zum Verbindungsende)."""
+        if status in (204, 304) or 100 <= status < 200: return
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0: await reader.readuntil(b"\r\n"); return
+                yield await reader.readexactly(size); await reader.readexactly(2)
+        elif 'content-length' in headers:
+            remaining = int(headers['content-length'])
+            while remaining:
+                chunk = await reader.read(min(remaining, 65536))
+                if not chunk: raise HttpError("connection closed before end of body")
+                remaining -= len(chunk); yield chunk
+        else:
+            while chunk := await reader.read(65536): yield chunk
+
+    @staticmethod
+    def _reusable(headers):
+        return headers.get('connection', '').lower() != 'close' and ('content-length' in headers or headers.get('transfer-encoding', '').lower() == 'chunked')
+
+    async def request(self, method, url, params=None, body=None, headers=None, timeout=None):
+        """Einfache Anfrage; body darf bytes, str oder ein JSON-Wert sein."""
+        if body is not None and not isinstance(body, (bytes, str)): body = json.dumps(body)
+        data = body.encode() if isinstance(body, str) else (body or b"")
+        try: return await _within(timeout or self.TIMEOUT, self._follow(method, url, params, data, headers))
+        except asyncio.TimeoutError: raise HttpError(f"timeout: {method} {url}") from None
+
+    async def _follow(self, method, url, params, data, headers):
+        for _ in range(MAX_REDIRECTS + 1):
+            origin, host, target = self._split(url, params)
+            response = await self._request(method, origin, host, target, data, headers)
+            location = response.headers.get('location')
+            if response.status not in REDIRECT_STATUSES or not location: return response
+            # Die Abfrage steckt schon in Location; wie bei requests behalten nur 307/308 Methode und Body
+            url, params = urljoin(url, location), None
+            if response.status not in (307, 308) and method != 'HEAD': method, data = 'GET', b""
+        raise HttpError(f"too many redirects: {url}")
+
+    async def _request(self, method, origin, host, target, data, headers):
+        idle = self._idle.setdefault(origin, [])
+        target, headers = self._via_proxy(origin, host, target, headers)
+        while True:
+            reused = bool(idle)
+            reader, writer = idle.pop() if reused else await self._connect(origin)
+            try:
+                await self._send(writer, method, host, target, data, headers)
+                status, response_headers = await self._read_head(reader)
+            except (ConnectionError, asyncio.IncompleteReadError, OSError) as e:
+                writer.close()
+                # Der Server hat eine ruhende Keep-Alive-Verbindung geschlossen: auf einer neuen wiederholen
+                if reused: continue
+                raise HttpError(str(e) or e.__class__.__name__) from e
+            try: body = b"".join([chunk async for chunk in self._iter_body(reader, status, response_headers)])
+            except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+                writer.close(); raise HttpError(str(e) or e.__class__.__name__) from e
+            if self._reusable(response_headers) and len(idle) < self.MAX_IDLE_PER_HOST: idle.append((reader, writer))
+            else: writer.close()
+            return AsyncResponse(status, response_headers, body)
+
+    @asynccontextmanager
+    async def stream(self, url, params=None, headers=None, connect_timeout=5):
+        """Öffnet eine Streaming-Antwort auf eigener Verbindung; liefert (AsyncResponse ohne Body, Zeilen-Iterator).
+
+        Weiterleitungen werden verfolgt; response.url ist das Ziel (ohne Abfrage), damit der Aufrufer beim nächsten Mal direkt dorthin geht."""
+        for _ in range(MAX_REDIRECTS + 1):
+            reader, writer, status, response_headers = await self._open_stream(url, params, headers, connect_timeout)
+            location = response_headers.get('location')
+            if status not in REDIRECT_STATUSES or not location: break
+            writer.close(); url, params = urljoin(url, location), None
+        else: raise HttpError(f"too many redirects: {url}")
+        try: yield AsyncResponse(status, response_headers, url=urlsplit(url)._replace(query='').geturl()), self._iter_lines(reader, status, response_headers)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError) as e:
+            raise HttpError(str(e) or e.__class__.__name__) from e
+        finally: writer.close()
+
+    async def _open_stream(self, url, params, headers, connect_timeout):
+        origin, host, target = self._split(url, params)
+        try: reader, writer = await _within(connect_timeout, self._connect(origin))
+        except asyncio.TimeoutError: raise HttpError(f"timeout connecting to {host}") from None
+        target, headers = self._via_proxy(origin, host, target, headers)
+        try:
+            await self._send(writer, 'GET', host, target, b"", headers)
+            status, response_headers = await _within(connect_timeout, self._read_head(reader))
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError) as e:
+            writer.close(); raise HttpError(str(e) or e.__class__.__name__) from e
+        except BaseException: writer.close(); raise
+        return reader, writer, status, response_headers
+
+    async def _iter_lines(self, reader, status, headers):
+        buffer = b""
+        async for chunk in self._iter_body(reader, status, headers):
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines: yield line.rstrip(b"\r").decode('utf-8')
+        if buffer: yield buffer.decode('utf-8')
+
+    def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections: writer.close()
+        self._idle.clear()
+
+# --- asyncio-Client ---
+class ChatClient:
+    """asyncio-Gegenstück zu FirebaseManager ohne Qt: Anmeldung, Räume, Verlauf, Stream und Senden für einen Benutzer.
+
+    Die Tokens liegen in einem TokenState; die Qt-Anwendung übergibt ihren TokenManager, damit Streams und REST-Aufrufe
+    dasselbe Token teilen und es nur an einer Stelle erneuert wird."""
+    def __init__(self, http=None, api_key=None, db_url=None, tokens=None):
+        self.http, self.db_url = http or AsyncHttp(), db_url or firebaseConfig['databaseURL']
+        self.auth_url, self.signup_url, self.update_profile_url, self.refresh_url = auth_endpoints(api_key or firebaseConfig['apiKey'])
+        self.user_data, self.tokens, self._loop = None, tokens or TokenState(self._exchange_refresh_token), None
+        # Stream-URL -> Ziel ihrer letzten Weiterleitung; Reconnects gehen direkt dorthin
+        self._stream_urls = {}
+
+    @property
+    def id_token(self): return self.tokens.id_token
+
+    async def login(self, username, password):
+        response = await self.http.request('POST', self.auth_url, body={"email": email_for(username), "password": password, "returnSecureToken": True})
+        if response.status != 200: return False, error_message(response.json())
+        self.user_data = response.json()
+        self.tokens.set_tokens(self.user_data['idToken'], self.user_data.get('refreshToken'), self.user_data.get('expiresIn'))
+        return True, self.user_data
+
+    async def register(self, display_name, username, password):
+        taken = await self.http.request('GET', f"{self.db_url}/usernames/{username.lower()}.json")
+        if taken.json() is not None: return False, "Username is already taken."
+        signup = await self.http.request('POST', self.signup_url, body={"email": email_for(username), "password": password, "returnSecureToken": True})
+        if signup.status != 200: return False, error_message(signup.json())
+        user_id, id_token = signup.json()['localId'], signup.json()['idToken']
+        await self.http.request('POST', self.update_profile_url, body={"idToken": id_token, "displayName": display_name})
+        db_payload = {f"usernames/{username.lower()}": user_id, f"users/{user_id}/profile": {"displayName": display_name}}
+        await self.http.request('PATCH', f"{self.db_url}/.json", params={'auth': id_token}, body=db_payload)
+        return True, "Registration successful."
+
+    async def refresh_if_stale(self, stale_token):
+        """TokenState.refresh_if_stale in einem Worker-Thread (es sperrt synchron); None = Sitzung abgelaufen."""
+        self._loop = asyncio.get_running_loop()
+        return await asyncio.to_thread(self.tokens.refresh_if_stale, stale_token)
+
+    def _exchange_refresh_token(self, refresh_token):
+        # Läuft im Worker-Thread von refresh_if_stale(); der Abruf selbst geht über die Event-Loop und deren Verbindungen
+        request = self.http.request('POST', self.refresh_url, body={"grant_type": "refresh_token", "refresh_token": refresh_token})
+        response = asyncio.run_coroutine_threadsafe(request, self._loop).result()
+        result = token_refresh_result(response.status, response.json() if response.status in (200, 400) else None)
+        if result is None: raise HttpError(f"HTTP {response.status}")
+        return result
+
+    async def request(self, method, url, params=None, body=None):
+        """REST-Aufruf mit ?auth=<token>; vor Ablauf und bei 401 wird das Token einmal erneuert."""
+        token = self.id_token
+        if self.tokens.expiring(): token = await self.refresh_if_stale(token) or token
+        # Ohne Anmeldung (z. B. Raumliste vor dem Login) ganz ohne auth-Parameter, wie requests mit None
+        response = await self.http.request(method, url, params={**(params or {}), **({'auth': token} if token else {})}, body=body)
+        if response.status == 401 and token:
+            new_token = await self.refresh_if_stale(token)
+            if new_token: response = await self.http.request(method, url, params={**(params or {}), 'auth': new_token}, body=body)
+        return response
+
+    async def get_chat_rooms(self):
+        response = await self.request('GET', f"{self.db_url}/chatrooms.json")
+        return (response.json() or {}) if response.status == 200 else {}
+
+    async def load_history(self, room_id, limit=HISTORY_PAGE_SIZE, end_at=None, start_at=None):
+        response = await self.request('GET', f"{self.db_url}/chats/{room_id}/messages.json", params=history_query(limit, end_at, start_at))
+        if response.status != 200: raise HttpError(f"Error loading history: {response.text}")
+        return response.json() or {}
+
+    async def write_messages(self, messages_by_room):
+        """Schreibt Nachrichten ({room_id: {push_id: nachricht}}) mit einem einzigen Multi-Path-PATCH."""
+        # print=silent: Firebase antwortet ohne Body (204), wir brauchen nur den Status
+        response = await self.request('PATCH', f"{self.db_url}/.json", params={'print': 'silent'}, body=multi_path_update(messages_by_room))
+        return response.status in (200, 204), response.status
+
+    async def send_message(self, room_id, text, key=None):
+        """Sendet eine Nachricht mit Client-Push-ID (vorab vergeben, falls der Aufrufer das Echo erkennen will); gibt (erfolgreich, push_id) zurück."""
+        key = key or generate_push_id()
+        success, _ = await self.write_messages({room_id: {key: message_payload((self.user_data or {}).get('displayName'), text)}})
+        return success, key
+
+    async def stream(self, room_id, state, start_limit=None, on_error=None, count=None):
+        """Hält den Raum-Stream offen, bis die Aufgabe abgebrochen wird oder der Stream endgültig endet.
+
+        state ist ein StreamState (mit dessen last_timestamp als Startpunkt); Verbindungsfehler
+        gehen an on_error(meldung) und führen zu einem Reconnect mit Backoff, count(name) zählt sie mit.
+        Gibt (grund, meldung) zurück: 'cancelled' (cancel vom Server), 'rejected' (4xx) oder 'expired' (Sitzung abgelaufen)."""
+        url, attempt, count = f"{self.db_url}/chats/{room_id}/messages.json", 0, count or (lambda name: None)
+        while True:
+            try:
+                ended = await self._listen(url, state, start_limit, count)
+                if ended: return ended
+                attempt = 0
+            except (HttpError, OSError, ValueError) as e:
+                count('stream.connection_lost')
+                if on_error: on_error(f"Connection lost, reconnecting: {e}")
+            count('stream.reconnects')
+            await asyncio.sleep(backoff_delay(attempt)); attempt += 1
+
+    async def _listen(self, url, state, start_limit, count):
+        """Hält eine Verbindung offen; None = neu verbinden, sonst (grund, meldung) wie bei stream()."""
+        token = self.id_token
+        params = {**({'auth': token} if token else {}), **stream_query(state.last_timestamp, start_limit)}
+        async with self.http.stream(self._stream_urls.get(url, url), params, {'Accept': 'text/event-stream'}) as (response, lines):
+            if response.url != url: self._stream_urls[url] = response.url
+            if response.status == 401: return await self._reauthenticate(token, count)
+            if 400 <= response.status < 500: return 'rejected', f"Error connecting to stream: {''.join([line async for line in lines])}"
+            if response.status != 200: raise HttpError(f"HTTP {response.status}")
+            events = _aiter_sse_events(lines)
+            while True:
+                try: event, data = await _within(STREAM_READ_TIMEOUT, events.__anext__())
+                except StopAsyncIteration: return None # Server hat die Verbindung beendet: neu verbinden
+                except asyncio.TimeoutError: raise HttpError("stream read timeout") from None
+                if event == 'cancel': return 'cancelled', f"Stream cancelled by server: {data}"
+                if event == 'auth_revoked': return await self._reauthenticate(token, count)
+                state.feed(event, data)
+
+    async def _reauthenticate(self, token, count):
+        # Token abgelaufen oder widerrufen: erneuern (bzw. das schon erneuerte übernehmen) und neu verbinden
+        count('stream.reauthenticate')
+        if await self.refresh_if_stale(token): return None
+        return 'expired', "Session expired, please log in again."
+
+    def close(self): self.http.close()
+
+class LoopThread:
+    """Eigene Event-Loop in einem Hintergrund-Thread, damit Aufrufer ohne asyncio (die Qt-Anwendung) Coroutinen starten können."""
+    def __init__(self, name='asyncio'):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def _run(self): self.loop.run_forever(); self.loop.close()
+
+    def submit(self, coro):
+        """Startet coro auf der Loop; gibt ein concurrent.futures.Future zurück, dessen cancel() die Aufgabe abbricht."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, fn, *args): self.loop.call_soon_threadsafe(fn, *args)
+
+    def stop(self, timeout=3):
+        """Bricht alle Aufgaben ab, wartet bis zu timeout Sekunden, bis sie ihre Verbindungen geschlossen haben, und beendet den Thread."""
+        try: self.submit(self._cancel_all()).result(timeout)
+        except concurrent.futures.TimeoutError: pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    @staticmethod
+    async def _cancel_all():
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def _aiter_sse_events(lines):
+    # SSE-Ereignisse (event, data) aus einem asynchronen Zeilen-Iterator
+    parser = SseParser()
+    async for line in lines:
+        event = parser.feed(line)
+        if event: yield event
@@ -0,0 +1,211 @@
+# chat_core.py
+
+import json
+import random
+import threading
+import time
+
+from config import DUMMY_EMAIL_DOMAIN, IDENTITY_TOOLKIT_URL, SECURE_TOKEN_URL
+from message_index import sort_timestamp
+
+# Qt-freier Kern des Clients: das Firebase-Protokoll (Abfragen, Nutzdaten, SSE, Stream-Zustand).
+# Die Qt-Anwendung nutzt ihn für REST-Aufrufe über ihren requests-Pool (firebase_manager.py, outbox.py) und für die
+# Raum-Streams über den asyncio-Client in chat_client.py (stream_manager.py); load_generator.py treibt denselben Client ohne GUI.
+
+# Anzahl der Nachrichten, die pro Verlaufsseite geladen werden
+HISTORY_PAGE_SIZE = 50
+# Firebase sendet alle 30 s ein keep-alive; erst deutlich danach gilt die Verbindung als tot
+STREAM_READ_TIMEOUT = 45
+BACKOFF_BASE, BACKOFF_MAX = 1.0, 60.0
+# ID-Tokens laufen nach einer Stunde ab; fünf Minuten vorher erneuern
+TOKEN_LIFETIME, TOKEN_REFRESH_MARGIN = 3600, 300
+
+class TokenRefreshError(Exception):
+    """Das Refresh-Token wurde abgelehnt; der Benutzer muss sich neu anmelden."""
+
+# --- Push-IDs ---
+# Zeichenvorrat und Aufbau wie bei Firebase-Push-IDs: 8 Zeichen Zeitstempel + 12 Zufallszeichen
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+_push_lock, _last_push_time, _last_rand_chars = threading.Lock(), 0, [0] * 12
+
+def generate_push_id():
+    """Erzeugt eine chronologisch sortierbare Push-ID auf dem Client, wie es das Firebase-SDK tut."""
+    global _last_push_time
+    with _push_lock:
+        now = int(time.time() * 1000)
+        if now == _last_push_time:
+            # Gleiche Millisekunde: Zufallsteil hochzählen, damit die Reihenfolge erhalten bleibt
+            i = 11
+            while i >= 0 and _last_rand_chars[i] == 63: _last_rand_chars[i] = 0; i -= 1
+            if i >= 0: _last_rand_chars[i] += 1
+        else:
+            _last_push_time = now
+            for i in range(12): _last_rand_chars[i] = random.randrange(64)
+        time_chars, t = [], now
+        for _ in range(8): time_chars.append(PUSH_CHARS[t % 64]); t //= 64
+        return "".join(reversed(time_chars)) + "".join(PUSH_CHARS[c] for c in _last_rand_chars)
+
+# --- Protokoll ---
+def auth_endpoints(api_key):
+    """URLs für Anmelden, Registrieren, Profil ändern und Token erneuern."""
+    return (f"{IDENTITY_TOOLKIT_URL}/v1/accounts:signInWithPassword?key={api_key}", f"{IDENTITY_TOOLKIT_URL}/v1/accounts:signUp?key={api_key}",
+            f"{IDENTITY_TOOLKIT_URL}/v1/accounts:update?key={api_key}", f"{SECURE_TOKEN_URL}/v1/token?key={api_key}")
+
+def email_for(username): return f"{username.lower()}{DUMMY_EMAIL_DOMAIN}"
+
+def error_message(body, default='Unknown error'):
+    error = body.get('error') if isinstance(body, dict) else None
+    return error.get('message', default) if isinstance(error, dict) else (error or default)
+
+def token_refresh_result(status, body):
+    """(id_token, refresh_token, expires_in) aus der securetoken-Antwort; None bei vorübergehenden Fehlern."""
+    if status == 200: return body['id_token'], body['refresh_token'], body.get('expires_in')
+    # 400 = Token abgelaufen/widerrufen/ungültig; alles andere ist ein vorübergehendes Problem
+    if status == 400: raise TokenRefreshError(error_message(body, 'Session expired'))
+    return None
+
+def message_payload(display_name, text, attachment=None):
+    payload = {"username": display_name or 'Unknown', "text": text, "timestamp": {".sv": "timestamp"}}
+    # Anhänge liegen in Storage; die Nachricht trägt nur Pfad, Download-Token und ggf. die Vorschau
+    if attachment: payload["attachment"] = attachment
+    return payload
+
+def multi_path_update(messages_by_room):
+    """Ein PATCH-Body für /.json, der Nachrichten ({room_id: {push_id: nachricht}}) in mehrere Räume schreibt."""
+    return {f"chats/{room_id}/messages/{key}": msg for room_id, messages in messages_by_room.items() for key, msg in messages.items()}
+
+def history_query(limit=HISTORY_PAGE_SIZE, end_at=None, start_at=None):
+    """Nur die neuesten `limit` Nachrichten (optional ab/bis einschließlich `start_at`/`end_at`)."""
+    params = {'orderBy': '"timestamp"'}
+    if limit is not None: params['limitToLast'] = limit
+    if start_at is not None: params['startAt'] = start_at
+    if end_at is not None: params['endAt'] = end_at
+    return params
+
+def stream_query(last_timestamp=None, limit=None):
+    # startAt ist inklusiv: nach einem Reconnect fehlt nichts, Doppelte filtert StreamState
+    if last_timestamp is not None: return {'orderBy': '"timestamp"', 'startAt': last_timestamp}
+    return {'orderBy': '"timestamp"', **({'limitToLast': limit} if limit else {})}
+
+def backoff_delay(attempt):
+    # Exponentieller Backoff mit vollem Jitter, damit nicht alle Clients gleichzeitig zurückkommen
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+class SseParser:
+    """Setzt Server-Sent-Events zeilenweise zusammen, unabhängig davon, woher die Zeilen kommen."""
+    def __init__(self): self.event, self.data = None, []
+
+    def feed(self, line):
+        """Nimmt eine Zeile (str) an; gibt bei der abschließenden Leerzeile (event, data) zurück, sonst None."""
+        if not line:
+            event, data, self.event, self.data = self.event, self.data, None, []
+            return (event or 'message', "\n".join(data)) if event or data else None
+        if line.startswith('event:'): self.event = line[len('event:'):].strip()
+        elif line.startswith('data:'): self.data.append(line[len('data:'):].lstrip())
+        return None
+
+class TokenState:
+    """ID- und Refresh-Token mit Ablaufzeit; erneuert threadsicher und nur einmal, wenn mehrere Aufrufer gleichzeitig in ein 401 laufen.
+
+    refresh_fn(refresh_token) -> (id_token, refresh_token, expires_in) macht den Netzwerkaufruf und wirft TokenRefreshError
+    bei Ablehnung. TokenManager (Qt) und ChatClient (asyncio) bauen beide darauf auf; on_refreshed/on_expired sind ihre Haken."""
+    def __init__(self, refresh_fn=None, **kwargs):
+        super().__init__(**kwargs) # Kooperativ, damit TokenManager zusätzlich von QObject erben kann
+        self.refresh_fn = refresh_fn
+        self.id_token, self.refresh_token, self.expires_at = None, None, 0
+        self._refresh_lock = threading.Lock()
+
+    def set_tokens(self, id_token, refresh_token=None, expires_in=None):
+        self.id_token = id_token
+        if refresh_token: self.refresh_token = refresh_token
+        self.expires_at = time.time() + float(expires_in or TOKEN_LIFETIME)
+
+    def clear(self): self.id_token, self.refresh_token, self.expires_at = None, None, 0
+
+    def expiring(self):
+        """True, wenn das Token in weniger als TOKEN_REFRESH_MARGIN abläuft und sich erneuern ließe."""
+        return bool(self.id_token and self.refresh_token) and time.time() > self.expires_at - TOKEN_REFRESH_MARGIN
+
+    def refresh_if_stale(self, stale_token):
+        """Gibt ein gültiges Token zurück; erneuert nur, wenn noch niemand `stale_token` ersetzt hat.
+
+        Liefert None, wenn die Sitzung endgültig abgelaufen ist; Netzwerkfehler werden weitergereicht."""
+        with self._refresh_lock:
+            if self.id_token and self.id_token != stale_token: return self.id_token
+            if not self.refresh_token: return None
+            try: id_token, refresh_token, expires_in = self.refresh_fn(self.refresh_token)
+            except TokenRefreshError as e: self.on_expired(str(e)); return None
+            self.set_tokens(id_token, refresh_token, expires_in)
+            self.on_refreshed(id_token, self.refresh_token)
+            return id_token
+
+    def on_refreshed(self, id_token, refresh_token): pass
+    def on_expired(self, reason): pass
+
+class StreamState:
+    """Wertet die put/patch-Ereignisse eines Raum-Streams aus und überlebt Reconnects.
+
+    Der erste Snapshot geht an on_snapshot(nachrichten), danach nur wirklich Neues an on_new(push_id, nachricht)
+    und Feldänderungen an on_update(push_id, felder), auch wenn sie als patch auf Raumebene kommen. Live-Nachrichten
+    werden per Push-ID entdoppelt, damit auch verspätete (mit älterem Zeitstempel) ankommen; nur der nach einem
+    Reconnect wiederholte Snapshot wird zusätzlich per Zeitstempel gefiltert.
+    last_timestamp ist der Startpunkt (startAt) für die nächste Verbindung."""
+    def __init__(self, last_timestamp=None, on_snapshot=None, on_new=None, on_update=None):
+        self.last_timestamp, self._keys_at_last, self._snapshot_sent = last_timestamp, set(), False
+        # Alle Push-IDs, die dieser Stream schon gemeldet hat
+        self._known = set()
+        noop = lambda *args: None
+        self.on_snapshot, self.on_new, self.on_update = on_snapshot or noop, on_new or noop, on_update or noop
+
+    def feed(self, event, data):
+        """Verarbeitet ein SSE-Ereignis; keep-alive, cancel und auth_revoked behandelt der Aufrufer."""
+        if event not in ('put', 'patch'): return
+        try: payload = json.loads(data)
+        except json.JSONDecodeError: return
+        if isinstance(payload, dict): self.apply(event, payload.get('path', '/'), payload.get('data'))
+
+    def apply(self, event, path, data):
+        parts = [p for p in path.split('/') if p]
+        if not parts:
+            children = data if isinstance(data, dict) else {}
+            if event == 'put' and not self._snapshot_sent:
+                self._snapshot_sent = True
+                for key, msg in children.items():
+                    if isinstance(msg, dict): self._remember(key, msg)
+                self.on_snapshot({k: m for k, m in children.items() if isinstance(m, dict)})
+                return
+            # Snapshot nach einem Reconnect oder patch auf Raumebene: nur Neues weitergeben
+            for key, msg in sorted(children.items(), key=lambda item: sort_timestamp(item[1])):
+                if not isinstance(msg, dict): continue
+                if event == 'put': self._deliver(key, msg)
+                # Ein patch-Kind für eine bekannte (oder nur im Cache liegende) Nachricht enthält nur die geänderten Felder;
+                # eine vollständige neue Nachricht (z. B. aus dem Multi-Path-PATCH eines anderen Clients) trägt ihren Zeitstempel
+                elif key in self._known or 'timestamp' not in msg: self.on_update(key, msg)
+                else: self._deliver_live(key, msg)
+        elif len(parts) == 1:
+            key = parts[0]
+            # null-Puts stammen vom limitToLast-Fenster (Nachrichten werden nie gelöscht)
+            if not isinstance(data, dict): return
+            if event == 'put': self._deliver_live(key, data)
+            else: self.on_update(key, data)
+        elif len(parts) == 2:
+            self.on_update(parts[0], {parts[1]: data})
+
+    def _deliver(self, key, msg):
+        # Wiederholter Snapshot nach einem Reconnect (startAt ist inklusiv): nur, was nach dem letzten Stand liegt
+        if self._is_new(key, msg): self._remember(key, msg); self.on_new(key, msg)
+
+    def _deliver_live(self, key, msg):
+        # Eine Nachricht eines langsamen Clients kann einen älteren Zeitstempel tragen; das Modell sortiert sie ein
+        if key not in self._known: self._remember(key, msg); self.on_new(key, msg)
+
+    def _is_new(self, key, msg):
+        ts = sort_timestamp(msg)
+        if self.last_timestamp is None or ts > self.last_timestamp: return True
+        return ts == self.last_timestamp and key not in self._keys_at_last
+
+    def _remember(self, key, msg):
+        self._known.add(key)
+        ts = sort_timestamp(msg)
+        if self.last_timestamp is None or ts > self.last_timestamp: self.last_timestamp, self._keys_at_last = ts, {key}
+        elif ts == self.last_timestamp: self._keys_at_last.add(key)
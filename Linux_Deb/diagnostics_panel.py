@@ -0,0 +1,43 @@
+# diagnostics_panel.py
+
+from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QCheckBox, QPushButton,
+                             QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView, QLabel)
+from PyQt6.QtCore import QTimer
+
+import metrics
+
+class DiagnosticsPanel(QWidget):
+    """Zeigt die gesammelten Messwerte (Latenzen in ms, Zähler) als Tabelle; aktualisiert sich nur, solange es sichtbar ist."""
+    COLUMNS = ("Metric", "Count", "Mean", "p50", "p95", "Max")
+    REFRESH_MS = 1000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout(); layout.setContentsMargins(0, 0, 0, 0)
+        controls = QHBoxLayout()
+        self.enable_checkbox = QCheckBox("Collect metrics"); self.enable_checkbox.setChecked(metrics.enabled())
+        self.enable_checkbox.toggled.connect(metrics.set_enabled)
+        reset_button = QPushButton("Reset"); reset_button.clicked.connect(lambda: (metrics.reset(), self.refresh()))
+        controls.addWidget(self.enable_checkbox); controls.addStretch()
+        controls.addWidget(QLabel(f"Log: {metrics.METRICS_LOG_FILE}")); controls.addWidget(reset_button)
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        layout.addLayout(controls); layout.addWidget(self.table); self.setLayout(layout)
+        self._timer = QTimer(self); self._timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.enable_checkbox.setChecked(metrics.enabled()); self.refresh(); self._timer.start(self.REFRESH_MS)
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self._timer.stop(); super().hideEvent(event)
+
+    def refresh(self):
+        stats = sorted(metrics.snapshot().items())
+        self.table.setRowCount(len(stats))
+        for row, (name, stat) in enumerate(stats):
+            values = [name, str(stat['count'])] + ["" if stat[k] is None else f"{stat[k]:.1f}" for k in ("mean", "p50", "p95", "max")]
+            for column, value in enumerate(values): self.table.setItem(row, column, QTableWidgetItem(value))
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+
+# fake_firebase.py
+
+import argparse
+import hashlib
+import json
+import queue
+import secrets
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+
+# Lokaler Ersatz für die Firebase-Dienste, die der Client nutzt: RTDB (REST + SSE), identitytoolkit, securetoken und Storage.
+# Start: python3 fake_firebase.py --port 9000 --room general=1000 --user alice:secret
+# Client: TIWUT_FIREBASE_EMULATOR=http://127.0.0.1:9000 python3 main.py
+
+KEEPALIVE_INTERVAL = 30
+# Steuerereignisse für offene Streams (interrupt_streams); 'close' trennt die Verbindung ohne Ereignis
+STREAM_INTERRUPTS = {'cancel': "Permission denied", 'auth_revoked': "credential is no longer valid", 'close': None}
+
+class AuthError(Exception):
+    pass
+
+class FakeFirebase:
+    """Datenbaum, Benutzer, Tokens und SSE-Abonnenten des Ersatzservers (threadsicher)."""
+    def __init__(self, token_lifetime=3600, keepalive_interval=KEEPALIVE_INTERVAL):
+        self.token_lifetime, self.keepalive_interval = token_lifetime, keepalive_interval
+        self.data, self.lock, self.listeners = {}, threading.RLock(), []
+        self.users, self.id_tokens, self.refresh_tokens = {}, {}, {}
+        self._push_counter, self._last_timestamp = 0, 0
+        # Storage: gespeicherte Objekte (Name -> Daten, Typ, Download-Token) und laufende resumable Uploads
+        self.objects, self.uploads, self.failing_chunks = {}, {}, 0
+        # Abgeschlossene Uploads (ID -> Objektname): eine spätere Abfrage der Sitzung meldet 'final' wie bei Storage
+        self.finished_uploads = {}
+        # Wie Firebase, das Streams per 307 auf den Server des Namespaces umleitet: URL eines zweiten Servers mit demselben Fake
+        self.stream_redirect, self.redirected_streams = None, 0
+        # Wie abweisende Regeln: Schreibzugriffe auf diese Pfade (und darunter) scheitern mit 403, Multi-Path-Updates als Ganzes
+        self.denied_paths = set()
+
+    # --- Datenbaum ---
+    def get(self, parts):
+        node = self.data
+        for part in parts:
+            if not isinstance(node, dict) or part not in node: return None
+            node = node[part]
+        return node
+
+    def set(self, parts, value, notify=True):
+        with self.lock:
+            value = self._resolve_server_values(value)
+            if not parts: self.data = value if isinstance(value, dict) else {}
+            else:
+                node, trail = self.data, []
+                for part in parts[:-1]:
+                    if not isinstance(node.get(part), dict): node[part] = {}
+                    trail.append((node, part)); node = node[part]
+                if value is None: node.pop(parts[-1], None)
+                else: node[parts[-1]] = value
+                # Leere Zwischenknoten verschwinden wie in Firebase
+                for parent, part in reversed(trail):
+                    if parent[part]: break
+                    del parent[part]
+            if notify: self._notify(parts, value, 'put')
+        return value
+
+    def update(self, parts, children):
+        with self.lock:
+            result = {path: self.set(parts + split_path(path), value, notify=False) for path, value in children.items()}
+            # Wie Firebase: Streams am oder über dem Pfad bekommen ein einziges patch, tiefere nur ihre betroffenen Kinder
+            for listener_parts, events in self.listeners:
+                if parts[:len(listener_parts)] == listener_parts:
+                    events.put(('patch', {"path": "/" + "/".join(parts[len(listener_parts):]), "data": result}))
+                elif listener_parts[:len(parts)] == parts:
+                    for path, value in result.items(): self._notify(parts + split_path(path), value, 'put', [(listener_parts, events)])
+            return result
+
+    def push(self, parts, value):
+        with self.lock:
+            self._push_counter += 1
+            key = f"-fake{int(time.time() * 1000):013d}{self._push_counter:07d}"
+            self.set(parts + [key], value)
+        return key
+
+    def server_timestamp(self):
+        # Streng monoton, damit gleichzeitige Schreibvorgänge eine eindeutige Reihenfolge haben
+        with self.lock:
+            self._last_timestamp = max(int(time.time() * 1000), self._last_timestamp + 1)
+            return self._last_timestamp
+
+    def _resolve_server_values(self, value):
+        if isinstance(value, dict):
+            if value == {".sv": "timestamp"}: return self.server_timestamp()
+            return {k: self._resolve_server_values(v) for k, v in value.items() if v is not None} or None
+        return value
+
+    # --- Abfragen wie bei der REST-API (orderBy, startAt, endAt, limitToFirst/Last, shallow) ---
+    @staticmethod
+    def query(value, params):
+        if not isinstance(value, dict): return value
+        if params.get('shallow') is True: return {k: True if isinstance(v, dict) else v for k, v in value.items()}
+        order_by = params.get('orderBy')
+        if order_by is None: return value
+        def sort_key(item):
+            if order_by == '$key': return item[0]
+            child = item[1].get(order_by) if isinstance(item[1], dict) else None
+            return child if isinstance(child, (int, float)) else float('-inf')
+        items = sorted(value.items(), key=lambda item: (sort_key(item), item[0]))
+        if 'startAt' in params: items = [i for i in items if sort_key(i) >= params['startAt']]
+        if 'endAt' in params: items = [i for i in items if sort_key(i) <= params['endAt']]
+        if 'limitToFirst' in params: items = items[:params['limitToFirst']]
+        if 'limitToLast' in params: items = items[-params['limitToLast']:] if params['limitToLast'] else []
+        return dict(items)
+
+    # --- SSE-Abonnenten ---
+    def write_denied(self, paths):
+        with self.lock: return any(path[:len(denied)] == denied for path in paths for denied in map(split_path, self.denied_paths))
+
+    def subscribe(self, parts):
+        listener = (parts, queue.SimpleQueue())
+        with self.lock: self.listeners.append(listener)
+        return listener
+
+    def unsubscribe(self, listener):
+        with self.lock:
+            if listener in self.listeners: self.listeners.remove(listener)
+
+    def interrupt_streams(self, event):
+        """Beendet alle offenen Streams wie der echte Server: mit 'cancel', mit 'auth_revoked' oder ('close') einfach so."""
+        if event not in STREAM_INTERRUPTS: raise ValueError(f"unknown stream interrupt: {event}")
+        with self.lock:
+            for _, events in self.listeners: events.put((event, STREAM_INTERRUPTS[event]))
+
+    def _notify(self, parts, value, event, listeners=None):
+        for listener_parts, events in self.listeners if listeners is None else listeners:
+            if parts[:len(listener_parts)] == listener_parts:
+                events.put((event, {"path": "/" + "/".join(parts[len(listener_parts):]), "data": value}))
+            elif listener_parts[:len(parts)] == parts:
+                events.put(('put', {"path": "/", "data": self.get(listener_parts)}))
+
+    # --- Benutzer und Tokens ---
+    def create_user(self, email, password, display_name=None):
+        with self.lock:
+            if email in self.users: raise AuthError("EMAIL_EXISTS")
+            self.users[email] = {'password': password, 'localId': secrets.token_hex(14), 'displayName': display_name or ""}
+            return self.users[email]
+
+    def sign_in(self, email, password):
+        user = self.users.get(email)
+        if not user: raise AuthError("EMAIL_NOT_FOUND")
+        if user['password'] != password: raise AuthError("INVALID_PASSWORD")
+        return self._issue_tokens(user['localId'])
+
+    def refresh(self, refresh_token):
+        local_id = self.refresh_tokens.get(refresh_token)
+        if not local_id: raise AuthError("INVALID_REFRESH_TOKEN")
+        return self._issue_tokens(local_id, refresh_token)
+
+    def _issue_tokens(self, local_id, refresh_token=None):
+        id_token, refresh_token = "fake-id-" + secrets.token_urlsafe(24), refresh_token or "fake-refresh-" + secrets.token_urlsafe(24)
+        with self.lock:
+            self.id_tokens[id_token] = (local_id, time.time() + self.token_lifetime)
+            self.refresh_tokens[refresh_token] = local_id
+        return id_token, refresh_token, local_id
+
+    def check_token(self, id_token):
+        """Gibt die localId zu einem gültigen ID-Token zurück, sonst None."""
+        local_id, expires_at = self.id_tokens.get(id_token, (None, 0))
+        return local_id if expires_at > time.time() else None
+
+    def user_by_id(self, local_id):
+        return next((user for user in self.users.values() if user['localId'] == local_id), None)
+
+    # --- Storage ---
+    def start_upload(self, name, size, content_type):
+        upload_id = secrets.token_urlsafe(12)
+        with self.lock: self.uploads[upload_id] = {'name': name, 'size': size, 'contentType': content_type, 'data': bytearray()}
+        return upload_id
+
+    def finish_upload(self, upload_id):
+        with self.lock:
+            upload = self.uploads.pop(upload_id)
+            self.finished_uploads[upload_id] = upload['name']
+            self.objects[upload['name']] = {'data': bytes(upload['data']), 'contentType': upload['contentType'], 'token': secrets.token_hex(16)}
+        return upload['name']
+
+    def lose_uploads(self):
+        """Verwirft alle laufenden Upload-Sitzungen, als wären sie abgelaufen; weitere Blöcke und Abfragen enden mit 404."""
+        with self.lock: self.uploads.clear()
+
+    def object_metadata(self, bucket, name):
+        obj = self.objects[name]
+        return {"name": name, "bucket": bucket, "size": str(len(obj['data'])), "contentType": obj['contentType'], "downloadTokens": obj['token']}
+
+    # --- Hilfen für Benchmarks ---
+    def seed_room(self, room_id, count, name=None):
+        """Legt einen Raum mit `count` Nachrichten an (eine Sekunde Abstand, die neueste liegt kurz vor jetzt)."""
+        now, messages = int(time.time() * 1000), {}
+        for i in range(count):
+            messages[f"-seed{i:015d}"] = {"username": f"user{i % 7}", "text": f"Seed message {i} in {room_id}", "timestamp": now - (count - i) * 1000}
+        with self.lock:
+            self.data.setdefault('chatrooms', {})[room_id] = {"name": name or room_id}
+            self.data.setdefault('chats', {}).setdefault(room_id, {})['messages'] = messages
+            self._last_timestamp = max(self._last_timestamp, now)
+
+    def inject(self, room_id, count):
+        """Schreibt `count` neue Nachrichten so schnell wie möglich, als kämen sie von anderen Clients."""
+        for i in range(count):
+            self.push(['chats', room_id, 'messages'], {"username": "injector", "text": f"Injected message {i}", "timestamp": {".sv": "timestamp"}})
+
+def split_path(path):
+    return [unquote(p) for p in path.split('/') if p]
+
+class FakeFirebaseHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeFirebase/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose: super().log_message(format, *args)
+
+    @property
+    def fake(self): return self.server.fake
+
+    def _parse(self):
+        url = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        return url.path, params
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b"null") if length else None
+
+    def _send_json(self, status, value, headers=None):
+        body = json.dumps(value, separators=(',', ':')).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8'); self.send_header('Content-Length', str(len(body)))
+        for name, header_value in (headers or {}).items(): self.send_header(name, header_value)
+        self.end_headers(); self.wfile.write(body)
+
+    def _send_empty(self, status, headers=None):
+        self.send_response(status); self.send_header('Content-Length', '0')
+        for name, header_value in (headers or {}).items(): self.send_header(name, str(header_value))
+        self.end_headers()
+
+    def _db_request(self, method):
+        path, params = self._parse()
+        if not path.endswith('.json'): self._body(); return self._send_json(404, {"error": "Not found"})
+        parts = split_path(path[:-len('.json')])
+        # Den Body immer lesen, sonst bleibt er bei frühen Fehlerantworten in der Keep-Alive-Verbindung hängen
+        body = self._body() if method != 'GET' else None
+        auth = params.pop('auth', None)
+        local_id = self.fake.check_token(auth) if auth else None
+        if auth and not local_id: return self._send_json(401, {"error": "Auth token is expired"})
+        # Wie die Regeln des Projekts: lesen darf jeder, schreiben nur angemeldete Benutzer
+        if method != 'GET' and not local_id: return self._send_json(401, {"error": "Permission denied"})
+        try: query = {k: json.loads(v) for k, v in params.items() if k != 'print'}
+        except json.JSONDecodeError: return self._send_json(400, {"error": "Invalid query parameter"})
+        silent = params.get('print') == 'silent'
+        if method == 'GET':
+            if 'text/event-stream' in self.headers.get('Accept', ''):
+                if self.fake.stream_redirect and self.fake.stream_redirect != self.server.url:
+                    with self.fake.lock: self.fake.redirected_streams += 1
+                    return self._send_empty(307, {'Location': self.fake.stream_redirect + self.path})
+                return self._stream(parts, query, auth)
+            with self.fake.lock:
+                data = self.fake.get(parts); value = self.fake.query(data, query)
+                # Wie die REST-API mit X-Firebase-ETag: Prüfsumme der Daten am Pfad, unabhängig von shallow und Abfrage
+                etag = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest() if self.headers.get('X-Firebase-ETag') == 'true' else None
+            if not etag: return self._send_json(200, value)
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304); self.send_header('ETag', etag); self.send_header('Content-Length', '0'); self.end_headers(); return
+            return self._send_json(200, value, {'ETag': etag})
+        written = [parts + split_path(path) for path in body] if method == 'PATCH' and isinstance(body, dict) else [parts]
+        if self.fake.write_denied(written): return self._send_json(403, {"error": "Permission denied"})
+        if method == 'PUT': result = self.fake.set(parts, body)
+        elif method == 'PATCH':
+            if not isinstance(body, dict): return self._send_json(400, {"error": "Invalid data; couldn't parse JSON object"})
+            result = self.fake.update(parts, body)
+        elif method == 'POST': result = {"name": self.fake.push(parts, body)}
+        elif method == 'DELETE': result = self.fake.set(parts, None)
+        if silent: return self._send_empty(204)
+        self._send_json(200, result)
+
+    def _storage_request(self, method):
+        # Firebase-Storage-REST wie beim JS-SDK: /v0/b/<bucket>/o?name=... (Upload) und /v0/b/<bucket>/o/<name> (Abruf)
+        path, params = self._parse()
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        parts = path.split('/')
+        if len(parts) < 5 or parts[4] != 'o': return self._send_json(404, {"error": {"code": 404, "message": "Not Found."}})
+        bucket, name = parts[3], unquote("/".join(parts[5:])) or params.get('name')
+        authorization = self.headers.get('Authorization', '')
+        local_id = self.fake.check_token(authorization[len('Firebase '):]) if authorization.startswith('Firebase ') else None
+        if method == 'GET':
+            obj = self.fake.objects.get(name)
+            if obj is None: return self._send_json(404, {"error": {"code": 404, "message": "Not Found."}})
+            if params.get('alt') != 'media': return self._send_json(200, self.fake.object_metadata(bucket, name))
+            if params.get('token') != obj['token'] and not local_id: return self._send_json(403, {"error": {"code": 403, "message": "Permission denied."}})
+            self.send_response(200)
+            self.send_header('Content-Type', obj['contentType']); self.send_header('Content-Length', str(len(obj['data']))); self.end_headers()
+            return self.wfile.write(obj['data'])
+        # Schreiben nur für angemeldete Benutzer
+        if not local_id: return self._send_json(401, {"error": {"code": 401, "message": "Permission denied."}})
+        commands = {command.strip() for command in self.headers.get('X-Goog-Upload-Command', '').split(',')}
+        upload_id = params.get('upload_id')
+        if not upload_id:
+            if 'start' not in commands: return self._send_json(400, {"error": {"code": 400, "message": "Only resumable uploads are supported."}})
+            upload_id = self.fake.start_upload(name, int(self.headers.get('X-Goog-Upload-Header-Content-Length') or 0),
+                                               self.headers.get('X-Goog-Upload-Header-Content-Type') or 'application/octet-stream')
+            upload_url = f"http://{self.headers.get('Host')}{path}?name={quote(name, safe='')}&upload_id={upload_id}&upload_protocol=resumable"
+            return self._send_empty(200, {'X-Goog-Upload-URL': upload_url, 'X-Goog-Upload-Status': 'active', 'X-Goog-Upload-Chunk-Granularity': 256 * 1024})
+        upload = self.fake.uploads.get(upload_id)
+        if upload is None and upload_id in self.fake.finished_uploads:
+            obj_name = self.fake.finished_uploads[upload_id]
+            return self._send_json(200, self.fake.object_metadata(bucket, obj_name),
+                                   {'X-Goog-Upload-Status': 'final', 'X-Goog-Upload-Size-Received': len(self.fake.objects[obj_name]['data'])})
+        if upload is None: return self._send_json(404, {"error": {"code": 404, "message": "Upload session not found."}})
+        if 'cancel' in commands: self.fake.uploads.pop(upload_id, None); return self._send_empty(200, {'X-Goog-Upload-Status': 'cancelled'})
+        if 'upload' in commands:
+            # Zum Testen der Wiederaufnahme: die nächsten N Blöcke gehen "verloren"
+            with self.fake.lock:
+                failing, self.fake.failing_chunks = self.fake.failing_chunks > 0, max(0, self.fake.failing_chunks - 1)
+            if failing: return self._send_json(503, {"error": {"code": 503, "message": "Service unavailable."}})
+            if int(self.headers.get('X-Goog-Upload-Offset', -1)) != len(upload['data']):
+                return self._send_empty(400, {'X-Goog-Upload-Status': 'active', 'X-Goog-Upload-Size-Received': len(upload['data'])})
+            upload['data'] += body
+        if 'finalize' in commands:
+            if len(upload['data']) != upload['size']: return self._send_empty(400, {'X-Goog-Upload-Status': 'active', 'X-Goog-Upload-Size-Received': len(upload['data'])})
+            return self._send_json(200, self.fake.object_metadata(bucket, self.fake.finish_upload(upload_id)), {'X-Goog-Upload-Status': 'final'})
+        self._send_empty(200, {'X-Goog-Upload-Status': 'active', 'X-Goog-Upload-Size-Received': len(upload['data'])})
+
+    def _stream(self, parts, query, auth):
+        listener = self.fake.subscribe(parts)
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream'); self.send_header('Cache-Control', 'no-cache'); self.send_header('Connection', 'close')
+            self.end_headers()
+            with self.fake.lock: snapshot = self.fake.query(self.fake.get(parts), query)
+            self._write_events([('put', {"path": "/", "data": snapshot})])
+            while True:
+                try: events = [listener[1].get(timeout=self.fake.keepalive_interval)]
+                except queue.Empty: events = [('keep-alive', None)]
+                # Alles, was sich inzwischen angesammelt hat, in einem Rutsch schreiben
+                while not listener[1].empty() and len(events) < 1000: events.append(listener[1].get_nowait())
+                if auth and not self.fake.check_token(auth):
+                    self._write_events([('auth_revoked', "credential is no longer valid")]); return
+                interrupt = next((i for i, (event, _) in enumerate(events) if event in STREAM_INTERRUPTS), None)
+                if interrupt is not None:
+                    # Was davor lag, geht noch raus; danach ist die Verbindung zu
+                    self._write_events(events[:interrupt] + ([] if events[interrupt][0] == 'close' else [events[interrupt]])); return
+                self._write_events(events)
+        except (BrokenPipeError, ConnectionResetError, OSError): pass
+        finally: self.fake.unsubscribe(listener)
+
+    def _write_events(self, events):
+        self.wfile.write(b"".join(f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode() for event, data in events))
+        self.wfile.flush()
+
+    def _auth_request(self):
+        path, params = self._parse()
+        body = self._body() or {}
+        try:
+            if path == '/v1/accounts:signInWithPassword':
+                id_token, refresh_token, local_id = self.fake.sign_in(body.get('email'), body.get('password'))
+                user = self.fake.user_by_id(local_id)
+                return self._send_json(200, {"kind": "identitytoolkit#VerifyPasswordResponse", "localId": local_id, "email": body.get('email'),
+                                             "displayName": user['displayName'], "idToken": id_token, "registered": True,
+                                             "refreshToken": refresh_token, "expiresIn": str(self.fake.token_lifetime)})
+            if path == '/v1/accounts:signUp':
+                user = self.fake.create_user(body.get('email'), body.get('password'))
+                id_token, refresh_token, local_id = self.fake.sign_in(body.get('email'), body.get('password'))
+                return self._send_json(200, {"kind": "identitytoolkit#SignupNewUserResponse", "localId": local_id, "email": body.get('email'),
+                                             "idToken": id_token, "refreshToken": refresh_token, "expiresIn": str(self.fake.token_lifetime)})
+            if path == '/v1/accounts:update':
+                local_id = self.fake.check_token(body.get('idToken'))
+                if not local_id: raise AuthError("INVALID_ID_TOKEN")
+                user = self.fake.user_by_id(local_id)
+                if 'displayName' in body: user['displayName'] = body['displayName']
+                return self._send_json(200, {"localId": local_id, "displayName": user['displayName']})
+            if path == '/v1/token':
+                id_token, refresh_token, local_id = self.fake.refresh(body.get('refresh_token'))
+                return self._send_json(200, {"id_token": id_token, "refresh_token": refresh_token, "expires_in": str(self.fake.token_lifetime),
+                                             "token_type": "Bearer", "user_id": local_id})
+        except AuthError as e: return self._send_json(400, {"error": {"code": 400, "message": str(e)}})
+        self._send_json(404, {"error": {"code": 404, "message": "NOT_FOUND"}})
+
+    def _control_request(self):
+        # Nur für Benchmarks und Tests: /__fake__/inject?room=<id>&count=<n>, /__fake__/storage-fail?count=<n>,
+        # /__fake__/stream?event=cancel|auth_revoked|close
+        path, params = self._parse()
+        if path == '/__fake__/inject':
+            count = int(params.get('count', 1))
+            threading.Thread(target=self.fake.inject, args=(params['room'], count), daemon=True).start()
+            return self._send_json(200, {"injecting": count})
+        if path == '/__fake__/storage-fail':
+            with self.fake.lock: self.fake.failing_chunks = int(params.get('count', 1))
+            return self._send_json(200, {"failing_chunks": self.fake.failing_chunks})
+        if path == '/__fake__/stream':
+            try: self.fake.interrupt_streams(params.get('event', 'close'))
+            except ValueError as e: return self._send_json(400, {"error": str(e)})
+            return self._send_json(200, {"interrupted": params.get('event', 'close')})
+        self._send_json(404, {"error": "Not found"})
+
+    def do_GET(self): self._storage_request('GET') if self.path.startswith('/v0/b/') else self._db_request('GET')
+    def do_PUT(self): self._db_request('PUT')
+    def do_PATCH(self): self._db_request('PATCH')
+    def do_DELETE(self): self._db_request('DELETE')
+    def do_POST(self):
+        if self.path.startswith('/v1/'): self._auth_request()
+        elif self.path.startswith('/__fake__/'): self._control_request()
+        elif self.path.startswith('/v0/b/'): self._storage_request('POST')
+        else: self._db_request('POST')
+
+class FakeFirebaseServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Der Lastgenerator verbindet Hunderte Clients fast gleichzeitig; der Standard-Backlog von 5 würde Verbindungen abweisen
+    request_queue_size = 256
+    def __init__(self, address=('127.0.0.1', 0), fake=None, verbose=False):
+        super().__init__(address, FakeFirebaseHandler)
+        self.fake, self.verbose = fake or FakeFirebase(), verbose
+
+    @property
+    def url(self): return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start_in_background(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Firebase services used by Tiwut Chat.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000, help="0 picks a free port")
+    parser.add_argument('--room', action='append', default=[], metavar='ID=COUNT', help="seed a room with COUNT messages")
+    parser.add_argument('--user', action='append', default=[], metavar='USERNAME:PASSWORD', help="create a user (display name = username)")
+    parser.add_argument('--token-lifetime', type=int, default=3600, help="ID token lifetime in seconds")
+    parser.add_argument('--keepalive', type=float, default=KEEPALIVE_INTERVAL, help="SSE keep-alive interval in seconds")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    from config import DUMMY_EMAIL_DOMAIN
+    fake = FakeFirebase(args.token_lifetime, args.keepalive)
+    for spec in args.room:
+        room_id, _, count = spec.partition('=')
+        fake.seed_room(room_id, int(count or 0))
+    for spec in args.user:
+        username, _, password = spec.partition(':')
+        user = fake.create_user(f"{username.lower()}{DUMMY_EMAIL_DOMAIN}", password, username)
+        fake.set(['usernames', username.lower()], user['localId'])
+        fake.set(['users', user['localId'], 'profile'], {"displayName": username})
+    server = FakeFirebaseServer((args.host, args.port), fake, args.verbose)
+    # Erste Zeile auf stdout: die Adresse (benchmark.py liest sie bei --port 0 aus)
+    print(server.url, flush=True)
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+
+if __name__ == "__main__":
+    main()
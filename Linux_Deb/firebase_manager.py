@@ -2,63 +2,103 @@
 
 import requests
 import json
-import time
 import os
-from PyQt6.QtCore import QObject, pyqtSignal, QThread
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
 
-from config import firebaseConfig, DUMMY_EMAIL_DOMAIN
+import metrics
+from chat_core import (HISTORY_PAGE_SIZE, StreamState, TokenRefreshError, auth_endpoints, email_for, error_message, history_query,
+                       message_payload, multi_path_update, token_refresh_result)
+from config import firebaseConfig
+from message_store import MessageStore
+from http_session import get_session
+from task_runner import run_in_background
+from token_manager import TokenManager
+
+# Qt-Adapter über chat_core: das Protokoll steckt dort, hier nur Transport (requests-Pool, Worker-Threads) und Signale
 
 # Der Pfad zur Datei, in der wir die Sitzungsinformationen speichern
 SESSION_FILE = os.path.join(os.path.expanduser('~'), '.tiwut_chat_session')
+# Höchstzahl gleichzeitiger Verlaufsabrufe; weitere warten, überholte werden ohne Abruf verworfen
+HISTORY_WORKERS = 2
 
-# (Die Worker-Klassen HistoryLoader und MessageStreamer bleiben unverändert)
 class HistoryLoader(QObject):
-    historyLoaded = pyqtSignal(dict)
+    # Raum-ID und Nachrichten ({push_id: nachricht})
+    historyLoaded = pyqtSignal(str, dict)
     errorOccurred = pyqtSignal(str)
-    def __init__(self, room_id, id_token):
+    finished = pyqtSignal()
+    def __init__(self, room_id, token_manager, limit=HISTORY_PAGE_SIZE, end_at=None, start_at=None):
         super().__init__()
-        self.room_id, self.id_token, self.db_url = room_id, id_token, firebaseConfig['databaseURL']
+        self.room_id, self.tokens, self.db_url = room_id, token_manager, firebaseConfig['databaseURL']
+        self.limit, self.end_at, self.start_at = limit, end_at, start_at
+        self.cancelled = False
+    def cancel(self):
+        # Ein wartender Abruf startet gar nicht mehr; ein laufender meldet sein Ergebnis nicht
+        self.cancelled = True
     def run(self):
-        url = f"{self.db_url}/chats/{self.room_id}/messages.json?auth={self.id_token}"
         try:
-            response = requests.get(url, timeout=15)
-            self.historyLoaded.emit(response.json() or {}) if response.status_code == 200 else self.errorOccurred.emit(f"Error loading history: {response.text}")
-        except requests.exceptions.RequestException as e: self.errorOccurred.emit(f"Network error: {e}")
+            if self.cancelled: metrics.count('history.cancelled'); return
+            params = history_query(self.limit, self.end_at, self.start_at)
+            with metrics.timer('firebase.history_page'):
+                response = self.tokens.request('GET', f"{self.db_url}/chats/{self.room_id}/messages.json", params=params)
+            if self.cancelled: metrics.count('history.cancelled'); return
+            if response.status_code != 200: self.errorOccurred.emit(f"Error loading history: {response.text}"); return
+            with metrics.timer('history.decode', bytes=len(response.content)): messages = response.json() or {}
+            self.historyLoaded.emit(self.room_id, messages)
+        except requests.exceptions.RequestException as e:
+            if not self.cancelled: self.errorOccurred.emit(f"Network error: {e}")
+        finally: self.finished.emit()
+
+class _HistoryRunnable(QRunnable):
+    def __init__(self, loader):
+        super().__init__()
+        self.loader = loader
+    def run(self): self.loader.run()
 
 class MessageStreamer(QObject):
-    newMessage = pyqtSignal(dict)
+    """Qt-Seite eines Raum-Streams: ChatClient.stream läuft als Aufgabe auf der Event-Loop des StreamManagers, die Signale kommen im GUI-Thread an."""
+    # Raum-ID und Anfangsbestand ({push_id: nachricht}) aus dem ersten put-Ereignis
+    snapshotReceived = pyqtSignal(str, dict)
+    # Raum-ID, Push-ID und Nachrichtendaten
+    newMessage = pyqtSignal(str, str, dict)
+    # Raum-ID, Push-ID und geänderte Felder einer bereits bekannten Nachricht
+    messageUpdated = pyqtSignal(str, str, dict)
+    authRevoked = pyqtSignal(str)
     errorOccurred = pyqtSignal(str)
-    def __init__(self, room_id, id_token, start_timestamp):
+
+    def __init__(self, room_id, start_timestamp=None, limit=None):
         super().__init__()
-        self.room_id, self.id_token, self.start_timestamp = room_id, id_token, start_timestamp
-        self._is_running, self.db_url = True, firebaseConfig['databaseURL']
-    def run(self):
-        stream_url = (f'{self.db_url}/chats/{self.room_id}/messages.json?auth={self.id_token}&orderBy="timestamp"&startAt={self.start_timestamp}')
-        headers = {'Accept': 'text/event-stream'}
-        try:
-            with requests.get(stream_url, headers=headers, stream=True, timeout=30) as r:
-                if r.status_code != 200: self.errorOccurred.emit(f"Error connecting to stream: {r.text}"); return
-                for line in r.iter_lines():
-                    if not self._is_running: break
-                    if line and line.decode('utf-8').startswith('data:'):
-                        try:
-                            data = json.loads(line.decode('utf-8')[len('data: '):])
-                            if data.get('path') != '/': self.newMessage.emit(data['data'])
-                        except (json.JSONDecodeError, TypeError): pass
-        except requests.exceptions.RequestException as e: self.errorOccurred.emit(f"Connection error: {e}")
-    def stop(self): self._is_running = False
+        self.room_id = room_id
+        # Ohne Startzeitpunkt liefert der erste Snapshot die neuesten `limit` Nachrichten
+        self.limit = limit
+        self.state = StreamState(start_timestamp, lambda messages: self.snapshotReceived.emit(self.room_id, messages),
+                                 lambda key, msg: self.newMessage.emit(self.room_id, key, msg),
+                                 lambda key, fields: self.messageUpdated.emit(self.room_id, key, fields))
+
+    async def run(self, client):
+        """Läuft, bis die Aufgabe abgebrochen wird oder der Stream endgültig endet (cancel, 4xx, Sitzung abgelaufen)."""
+        reason, message = await client.stream(self.room_id, self.state, self.limit, self.errorOccurred.emit, metrics.count)
+        if reason == 'expired': self.authRevoked.emit(self.room_id)
+        self.errorOccurred.emit(message)
 
 class FirebaseManager:
     def __init__(self):
         self.api_key = firebaseConfig['apiKey']
         self.db_url = firebaseConfig['databaseURL']
-        self.auth_url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={self.api_key}"
-        self.signup_url = f"https://identitytoolkit.googleapis.com/v1/accounts:signUp?key={self.api_key}"
-        self.update_profile_url = f"https://identitytoolkit.googleapis.com/v1/accounts:update?key={self.api_key}"
-        self.refresh_url = f"https://securetoken.googleapis.com/v1/token?key={self.api_key}"
-        self.user_token, self.user_data = None, None
-        self.history_thread, self.message_thread = None, None
-        self.history_loader, self.message_streamer = None, None
+        self.auth_url, self.signup_url, self.update_profile_url, self.refresh_url = auth_endpoints(self.api_key)
+        # Hält ID- und Refresh-Token und erneuert sie rechtzeitig im Hintergrund
+        self.tokens = TokenManager(self._exchange_refresh_token)
+        self.tokens.tokenRefreshed.connect(self._on_token_refreshed)
+        self.user_data = None
+        # Verlaufsabrufe laufen auf einem festen Pool statt auf einem neuen QThread pro Abruf
+        self.history_pool = QThreadPool(); self.history_pool.setMaxThreadCount(HISTORY_WORKERS)
+        self._history_loads = set()
+        self.message_store = MessageStore()
+        self.http = get_session() # Gemeinsamer Verbindungspool für alle Anfragen
+
+    @property
+    def user_token(self): return self.tokens.id_token
+    @user_token.setter
+    def user_token(self, value): self.tokens.id_token = value
 
     # NEUE Methoden zur Sitzungsverwaltung
     def save_session(self, user_data):
@@ -87,81 +127,128 @@ class FirebaseManager:
         if os.path.exists(SESSION_FILE):
             os.remove(SESSION_FILE)
             print("DEBUG: Sitzung gelöscht.")
+        self.tokens.clear()
+        self.message_store.clear() # Zwischengespeicherte Nachrichten gehören zum abgemeldeten Benutzer
 
-    def refresh_token(self, refresh_token):
-        """Versucht, mit dem Refresh-Token ein neues ID-Token zu erhalten."""
+    @metrics.timed('firebase.refresh_token')
+    def _exchange_refresh_token(self, refresh_token):
+        """Tauscht das Refresh-Token gegen (id_token, refresh_token, expires_in); wirft TokenRefreshError bei Ablehnung."""
         payload = json.dumps({"grant_type": "refresh_token", "refresh_token": refresh_token})
-        response = requests.post(self.refresh_url, data=payload)
-        if response.status_code == 200:
-            token_data = response.json()
-            # Wir formatieren die Antwort so, dass sie unseren user_data ähnelt
-            self.user_token = token_data['id_token']
-            return True, {'idToken': token_data['id_token'], 'refreshToken': token_data['refresh_token']}
-        return False, response.json().get('error', {}).get('message')
+        response = self.http.post(self.refresh_url, data=payload)
+        result = token_refresh_result(response.status_code, response.json() if response.status_code in (200, 400) else None)
+        if result is None: raise requests.HTTPError(f"HTTP {response.status_code}")
+        return result
+
+    def _on_token_refreshed(self, id_token, refresh_token):
+        # Rotiert das Refresh-Token, muss auch die gespeicherte Sitzung es kennen
+        session_data = self.load_session()
+        if session_data and session_data.get('refreshToken') != refresh_token:
+            session_data['refreshToken'] = refresh_token
+            with open(SESSION_FILE, 'w') as f: json.dump(session_data, f)
 
+    def refresh_token(self, refresh_token):
+        """Versucht, mit dem Refresh-Token ein neues ID-Token zu erhalten."""
+        try: id_token, new_refresh_token, expires_in = self._exchange_refresh_token(refresh_token)
+        except TokenRefreshError as e: return False, str(e)
+        self.tokens.set_tokens(id_token, new_refresh_token, expires_in)
+        self._on_token_refreshed(id_token, new_refresh_token)
+        # Wir formatieren die Antwort so, dass sie unseren user_data ähnelt
+        return True, {'idToken': id_token, 'refreshToken': new_refresh_token}
+
+    @metrics.timed('firebase.login')
     def login(self, username, password):
-        email = f"{username.lower()}{DUMMY_EMAIL_DOMAIN}"
-        payload = json.dumps({"email": email, "password": password, "returnSecureToken": True})
-        response = requests.post(self.auth_url, data=payload)
+        payload = json.dumps({"email": email_for(username), "password": password, "returnSecureToken": True})
+        response = self.http.post(self.auth_url, data=payload)
         if response.status_code == 200:
             self.user_data = response.json()
-            self.user_token = self.user_data['idToken']
+            self.tokens.set_tokens(self.user_data['idToken'], self.user_data.get('refreshToken'), self.user_data.get('expiresIn'))
             self.save_session(self.user_data) # Sitzung nach erfolgreichem Login speichern
             return True, self.user_data
-        return False, response.json().get('error', {}).get('message', 'Unknown error')
+        return False, error_message(response.json())
 
-    # (register, get_chat_rooms, etc. bleiben größtenteils unverändert)
+    @metrics.timed('firebase.register')
     def register(self, display_name, username, password):
         check_url = f"{self.db_url}/usernames/{username.lower()}.json"
-        response = requests.get(check_url)
+        response = self.http.get(check_url)
         if response.json() is not None: return False, "Username is already taken."
-        email = f"{username.lower()}{DUMMY_EMAIL_DOMAIN}"
-        payload = json.dumps({"email": email, "password": password, "returnSecureToken": True})
-        signup_response = requests.post(self.signup_url, data=payload)
-        if signup_response.status_code != 200: return False, signup_response.json().get('error',{}).get('message')
+        payload = json.dumps({"email": email_for(username), "password": password, "returnSecureToken": True})
+        signup_response = self.http.post(self.signup_url, data=payload)
+        if signup_response.status_code != 200: return False, error_message(signup_response.json())
         signup_data = signup_response.json()
         user_id, id_token = signup_data['localId'], signup_data['idToken']
-        requests.post(self.update_profile_url, data=json.dumps({"idToken": id_token, "displayName": display_name}))
+        self.http.post(self.update_profile_url, data=json.dumps({"idToken": id_token, "displayName": display_name}))
         db_payload = {f"usernames/{username.lower()}": user_id, f"users/{user_id}/profile": {"displayName": display_name}}
-        requests.patch(f"{self.db_url}/.json?auth={id_token}", data=json.dumps(db_payload))
+        self.http.patch(f"{self.db_url}/.json?auth={id_token}", data=json.dumps(db_payload))
         return True, "Registration successful."
 
     def get_chat_rooms(self):
-        url = f"{self.db_url}/chatrooms.json"
-        if self.user_token: url += f"?auth={self.user_token}"
-        try:
-            response = requests.get(url); return response.json() or {}
+        try: return self.fetch_chat_rooms()[1]
         except requests.RequestException: return {}
 
+    def _get(self, path, **kwargs):
+        url = f"{self.db_url}/{path}.json"
+        # Mit Refresh-Token über den TokenManager, auch wenn das ID-Token noch fehlt (Start offline): ein 401 erneuert es dann
+        return self.tokens.request('GET', url, **kwargs) if self.tokens.refresh_token else self.http.get(url, **kwargs)
+
+    @metrics.timed('firebase.get_chat_rooms')
+    def fetch_chat_rooms(self, etag=None):
+        """Raumliste ({room_id: {'name': ...}}) mit ETag; gibt (etag, räume) zurück, räume ist None, wenn sich seit `etag` nichts geändert hat.
+
+        Ob sich etwas geändert hat, klärt eine bedingte shallow-Abfrage (nur die Raum-IDs). Erst dann kommt die ganze Liste,
+        in einer einzigen Abfrage: an den IDs allein ist nicht zu erkennen, welcher Raum umbenannt wurde, auch nicht,
+        wenn zugleich Räume dazugekommen oder weggefallen sind."""
+        headers = {'X-Firebase-ETag': 'true', **({'If-None-Match': etag} if etag else {})}
+        response = self._get("chatrooms", params={'shallow': 'true'}, headers=headers)
+        new_etag = response.headers.get('ETag')
+        # Nicht jeder Server beantwortet If-None-Match mit 304; ein unverändertes ETag heißt dasselbe
+        if response.status_code == 304 or (etag and new_etag == etag): return etag, None
+        response.raise_for_status()
+        response = self._get("chatrooms"); response.raise_for_status()
+        # Nur die Namen behalten; weitere Metadaten der Räume braucht die Seitenleiste nicht
+        return new_etag, {room_id: ({'name': room['name']} if isinstance(room, dict) and isinstance(room.get('name'), str) else {})
+                          for room_id, room in (response.json() or {}).items()}
+
+    @metrics.timed('firebase.send_message')
     def send_message(self, room_id, message_text):
-        if not self.user_token or not self.user_data: return False, "User not logged in."
-        url = f"{self.db_url}/chats/{room_id}/messages.json?auth={self.user_token}"
-        payload = {"username": self.user_data.get('displayName', 'Unknown'), "text": message_text, "timestamp": {".sv": "timestamp"}}
-        response = requests.post(url, data=json.dumps(payload))
+        if not self.user_data: return False, "User not logged in."
+        payload = message_payload(self.user_data.get('displayName'), message_text)
+        response = self.tokens.request('POST', f"{self.db_url}/chats/{room_id}/messages.json", data=json.dumps(payload))
         return response.status_code == 200, response.text
     
-    def load_message_history(self, room_id, success_slot, error_slot):
-        self.history_thread = QThread()
-        self.history_loader = HistoryLoader(room_id, self.user_token)
-        self.history_loader.moveToThread(self.history_thread)
-        self.history_thread.started.connect(self.history_loader.run)
-        self.history_loader.historyLoaded.connect(success_slot)
-        self.history_loader.errorOccurred.connect(error_slot)
-        self.history_thread.finished.connect(self.history_thread.deleteLater)
-        self.history_loader.historyLoaded.connect(self.history_thread.quit)
-        self.history_loader.errorOccurred.connect(self.history_thread.quit)
-        self.history_thread.start()
-
-    def start_message_stream(self, room_id, start_timestamp, new_message_slot, error_slot):
-        self.stop_message_stream()
-        self.message_thread = QThread()
-        self.message_streamer = MessageStreamer(room_id, self.user_token, start_timestamp)
-        self.message_streamer.moveToThread(self.message_thread)
-        self.message_thread.started.connect(self.message_streamer.run)
-        self.message_streamer.newMessage.connect(new_message_slot)
-        self.message_streamer.errorOccurred.connect(error_slot)
-        self.message_thread.start()
-
-    def stop_message_stream(self):
-        if self.message_thread and self.message_thread.isRunning():
-            self.message_streamer.stop(); self.message_thread.quit(); self.message_thread.wait()
+    @metrics.timed('firebase.write_messages')
+    def write_messages(self, messages_by_room):
+        """Schreibt Nachrichten ({room_id: {push_id: nachricht}}) mit einem einzigen Multi-Path-PATCH; ohne gültiges Token erneuert es das 401."""
+        updates = multi_path_update(messages_by_room)
+        # print=silent: Firebase antwortet ohne Body (204), wir brauchen nur den Status
+        response = self.tokens.request('PATCH', f"{self.db_url}/.json", params={'print': 'silent'}, data=json.dumps(updates))
+        return response.status_code in (200, 204), response.status_code
+
+    @metrics.timed('firebase.latest_page')
+    def latest_page(self, room_id, limit=HISTORY_PAGE_SIZE):
+        """Neueste Seite eines Raums ohne Stream zum Vorwärmen: aus dem lokalen Cache, sonst vom Server (und dann gespeichert)."""
+        page = self.message_store.get_page(room_id, limit)
+        if page: return page
+        response = self.tokens.request('GET', f"{self.db_url}/chats/{room_id}/messages.json", params=history_query(limit))
+        response.raise_for_status()
+        # Über den Cache zurückgeben: Stream-Nachrichten, die inzwischen gespeichert wurden, sind dann schon dabei
+        self.message_store.add_messages(room_id, response.json() or {})
+        return self.message_store.get_page(room_id, limit)
+
+    # Nicht-blockierende Varianten für den GUI-Thread; sie liefern ein Task-Objekt mit succeeded/failed-Signalen
+    def login_async(self, username, password): return run_in_background(self.login, username, password)
+    def register_async(self, display_name, username, password): return run_in_background(self.register, display_name, username, password)
+    def fetch_chat_rooms_async(self, etag=None): return run_in_background(self.fetch_chat_rooms, etag)
+    def refresh_token_async(self, refresh_token): return run_in_background(self.refresh_token, refresh_token)
+    def send_message_async(self, room_id, message_text): return run_in_background(self.send_message, room_id, message_text)
+    def write_messages_async(self, messages_by_room): return run_in_background(self.write_messages, messages_by_room)
+
+    def load_message_history(self, room_id, success_slot, error_slot, end_at=None, limit=HISTORY_PAGE_SIZE, start_at=None):
+        """Lädt eine Verlaufsseite auf dem Verlaufs-Pool; gibt den HistoryLoader zurück, dessen cancel() den Abruf verwirft."""
+        loader = HistoryLoader(room_id, self.tokens, limit, end_at, start_at)
+        loader.historyLoaded.connect(success_slot)
+        loader.errorOccurred.connect(error_slot)
+        # Loader und Runnable bis zum Ende referenzieren, sonst räumt Python sie ab, während der Pool sie noch nutzt
+        runnable = _HistoryRunnable(loader); self._history_loads.add(runnable)
+        loader.finished.connect(lambda: self._history_loads.discard(runnable))
+        self.history_pool.start(runnable)
+        return loader
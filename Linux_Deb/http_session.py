@@ -0,0 +1,36 @@
+# http_session.py
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Standard-Timeout (Verbindungsaufbau, Lesen) für alle Anfragen in Sekunden
+DEFAULT_TIMEOUT = (5, 15)
+# Maximale Anzahl offener Keep-Alive-Verbindungen pro Host (RTDB, identitytoolkit, securetoken);
+# jeder offene Raum-Stream belegt dauerhaft eine davon
+POOL_MAXSIZE = 32
+
+class PooledSession(requests.Session):
+    """requests.Session mit Keep-Alive-Pool, gzip, Wiederholungen und Standard-Timeout."""
+    def __init__(self):
+        super().__init__()
+        # Nur idempotente Anfragen werden automatisch wiederholt; POST/PATCH niemals
+        retries = Retry(total=3, connect=3, read=2, backoff_factor=0.3, status_forcelist=(502, 503, 504),
+                        allowed_methods=frozenset({'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=retries)
+        self.mount('https://', adapter); self.mount('http://', adapter)
+        self.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+        return super().request(method, url, **kwargs)
+
+_session, _session_lock = None, threading.Lock()
+
+def get_session():
+    """Gibt die gemeinsame, threadsichere Sitzung zurück, die alle Worker-Threads teilen."""
+    global _session
+    with _session_lock:
+        if _session is None: _session = PooledSession()
+        return _session
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# load_generator.py
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from benchmark import percentile
+
+# Lasttest ohne GUI: viele gleichzeitige Benutzer über den asyncio-Kern (chat_client.ChatClient), jeder mit
+# Anmeldung, Verlaufsseite, offenem Raum-Stream und zufällig verteilten Nachrichten.
+# python3 load_generator.py --users 200 --rooms 10 --duration 60 --rate 0.2
+# Ohne --url startet er fake_firebase.py selbst; mit --url (z. B. einem laufenden Ersatzserver) werden fehlende Benutzer registriert.
+
+LOAD_PASSWORD = "loadpass"
+
+class Stats:
+    """Sammelt Latenzen (ms) und Zähler aller simulierten Benutzer."""
+    def __init__(self):
+        self.latencies, self.counts = {}, {}
+    def record(self, name, value): self.latencies.setdefault(name, []).append(value)
+    def count(self, name, n=1): self.counts[name] = self.counts.get(name, 0) + n
+    def summary(self):
+        result = dict(sorted(self.counts.items()))
+        for name, values in sorted(self.latencies.items()):
+            result[f"{name}_median_ms"], result[f"{name}_p95_ms"] = percentile(values, 0.5), percentile(values, 0.95)
+            result[f"{name}_max_ms"] = max(values)
+        return result
+
+async def timed(stats, name, coroutine):
+    start = time.perf_counter()
+    try: return await coroutine
+    finally: stats.record(name, (time.perf_counter() - start) * 1000)
+
+async def simulate_user(index, room_id, args, stats, deadline):
+    from chat_client import ChatClient, HttpError
+    from chat_core import StreamState, generate_push_id
+    client, username = ChatClient(), f"load{index}"
+    try:
+        success, _ = await timed(stats, 'login', client.login(username, LOAD_PASSWORD))
+        if not success:
+            await client.register(username, username, LOAD_PASSWORD)
+            success, _ = await timed(stats, 'login', client.login(username, LOAD_PASSWORD))
+        if not success: stats.count('errors.login'); return
+        await timed(stats, 'history', client.load_history(room_id))
+
+        sent = {}
+        def on_new(key, msg):
+            now = time.perf_counter()
+            stats.count('received')
+            # Eigene Nachricht: Rundlauf vom Senden bis zum Echo; fremde: Verzögerung gegenüber dem Server-Zeitstempel
+            if key in sent: stats.record('echo', (now - sent.pop(key)) * 1000)
+            elif isinstance(msg.get('timestamp'), (int, float)): stats.record('delivery', max(0, time.time() * 1000 - msg['timestamp']))
+        state = StreamState(on_snapshot=lambda messages: stats.count('snapshots'), on_new=on_new)
+        stream = asyncio.create_task(client.stream(room_id, state, start_limit=1, on_error=lambda message: stats.count('errors.stream')))
+
+        while time.monotonic() < deadline:
+            await asyncio.sleep(min(random.expovariate(args.rate), max(0, deadline - time.monotonic())))
+            if time.monotonic() >= deadline: break
+            # Push-ID vorab merken: das Echo kann vor der Antwort auf den PATCH eintreffen
+            key = generate_push_id(); sent[key] = time.perf_counter()
+            try: success, _ = await timed(stats, 'send', client.send_message(room_id, f"Load message from {username}", key))
+            except HttpError: success = False
+            if success: stats.count('sent')
+            else: stats.count('errors.send'); sent.pop(key, None)
+        # Auf die letzten Echos kurz warten, dann den Stream schließen
+        await asyncio.sleep(args.drain)
+        stats.count('echo_missing', len(sent))
+        stream.cancel()
+        try: await stream
+        except asyncio.CancelledError: pass
+    except HttpError: stats.count('errors.connection')
+    finally: client.close()
+
+async def run_load(args, room_ids):
+    stats, tasks = Stats(), []
+    start = time.monotonic()
+    deadline = start + args.ramp + args.duration
+    for i in range(args.users):
+        # Benutzer gleichmäßig über die Anlaufzeit verteilen, damit nicht alle im selben Moment anmelden
+        tasks.append(asyncio.create_task(simulate_user(i, room_ids[i % len(room_ids)], args, stats, deadline)))
+        if args.ramp: await asyncio.sleep(args.ramp / args.users)
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - start
+    result = {"users": args.users, "rooms": len(room_ids), "duration_s": args.duration, "rate_per_user": args.rate, **stats.summary()}
+    result["sends_per_s"] = result.get('sent', 0) / elapsed
+    result["deliveries_per_s"] = result.get('received', 0) / elapsed
+    # ru_maxrss ist unter Linux in KiB, unter macOS in Byte
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return result
+
+def start_fake_server(args):
+    """Startet fake_firebase.py mit Räumen und Benutzern für den Lasttest; gibt (Prozess, URL) zurück."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, os.path.join(here, 'fake_firebase.py'), '--port', '0']
+    for k in range(args.rooms): command += ['--room', f"load-{k}={args.history}"]
+    for i in range(args.users): command += ['--user', f"load{i}:{LOAD_PASSWORD}"]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    return server, server.stdout.readline().strip()
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless load generator: simulates many concurrent Tiwut Chat users.")
+    parser.add_argument('--url', help="Firebase stand-in to use (default: start fake_firebase.py)")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--rooms', type=int, default=10, help="rooms to spread the users over")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of sending after the ramp-up")
+    parser.add_argument('--ramp', type=float, default=5, help="seconds over which users connect")
+    parser.add_argument('--rate', type=float, default=0.2, help="messages per second per user (Poisson)")
+    parser.add_argument('--history', type=int, default=200, help="messages per seeded room (only without --url)")
+    parser.add_argument('--drain', type=float, default=3, help="seconds to wait for outstanding echoes")
+    parser.add_argument('--output', help="write results as JSON to this file (default: stdout)")
+    args = parser.parse_args()
+
+    server = None
+    if not args.url: server, args.url = start_fake_server(args)
+    # Muss vor dem Import von chat_client/config gesetzt sein
+    os.environ['TIWUT_FIREBASE_EMULATOR'] = args.url
+    try:
+        from chat_client import ChatClient
+        async def discover_rooms():
+            client = ChatClient()
+            try: return sorted(await client.get_chat_rooms())[:args.rooms]
+            finally: client.close()
+        room_ids = asyncio.run(discover_rooms())
+        if not room_ids: print("DEBUG: Keine Räume gefunden.", file=sys.stderr); sys.exit(1)
+        print(f"DEBUG: Lasttest mit {args.users} Benutzern in {len(room_ids)} Räumen gegen {args.url}...", file=sys.stderr)
+        result = asyncio.run(run_load(args, room_ids))
+    finally:
+        if server: server.terminate(); server.wait()
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f: f.write(output + "\n")
+    else: print(output)
+
+if __name__ == "__main__":
+    main()
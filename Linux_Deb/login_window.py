@@ -56,12 +56,20 @@ class LoginWindow(QWidget):
         self.login_button.setEnabled(False)
         self.login_button.setText("Logging in...")
 
-        success, data = self.firebase_manager.login(username, password)
-        
+        # Anmeldung im Hintergrund, damit das Fenster bedienbar bleibt
+        task = self.firebase_manager.login_async(username, password)
+        task.succeeded.connect(self.on_login_finished)
+        task.failed.connect(self.on_login_failed)
+
+    def on_login_finished(self, result):
+        success, data = result
         if success:
             # Signal mit Benutzerdaten senden
             self.login_successful.emit(data)
         else:
-            QMessageBox.critical(self, "Login Failed", f"Error: {data}")
-            self.login_button.setEnabled(True)
-            self.login_button.setText("Login")
\ No newline at end of file
+            self.on_login_failed(data)
+
+    def on_login_failed(self, message):
+        QMessageBox.critical(self, "Login Failed", f"Error: {message}")
+        self.login_button.setEnabled(True)
+        self.login_button.setText("Login")
\ No newline at end of file
@@ -2,55 +2,151 @@
 
 # main.py
 
+import time
+STARTED = time.perf_counter() # Bezugspunkt für --profile-startup
+import argparse
 import sys
 import os
-from PyQt6.QtWidgets import QApplication, QMainWindow, QStackedWidget
+import threading
+# requests braucht allein über 100 ms zum Importieren; das läuft in einem eigenen Thread, während Qt startet
+threading.Thread(target=__import__, args=('requests',), daemon=True).start()
+from PyQt6.QtWidgets import QApplication, QMainWindow, QStackedWidget, QLabel
 from PyQt6.QtGui import QPalette, QColor
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QObject, QEvent, QTimer
 
-from firebase_manager import FirebaseManager
-from login_window import LoginWindow
-from register_window import RegisterWindow
-from main_chat_window import MainChatWindow
+import metrics
+IMPORTED = time.perf_counter()
+
+class StartupProfile(QObject):
+    """Zeitpunkte der Startphasen (ms seit Start von main.py); mit --profile-startup als Aufstellung auf der Konsole.
+
+    Die Aufstellung erscheint, sobald alle erwarteten Phasen erreicht sind (beim Autologin: erste Nachricht gezeichnet
+    und Token erneuert), spätestens nach REPORT_AFTER_MS. Als Messwerte 'startup.<phase>' landen die Phasen immer."""
+    REPORT_AFTER_MS = 10000
+
+    def __init__(self, enabled):
+        super().__init__()
+        self.enabled, self.phases, self.reported, self._chat_window = enabled, [], False, None
+        self._expecting, self._waiting = False, set()
+        if enabled: QTimer.singleShot(self.REPORT_AFTER_MS, self.report)
+
+    def mark(self, phase, at=None, settles=()):
+        """Hält eine erreichte Phase fest; `settles` sind erwartete Phasen, die damit nicht mehr kommen (z. B. nach Rückfall zum Login)."""
+        elapsed = ((at or time.perf_counter()) - STARTED) * 1000
+        self.phases.append((phase, elapsed)); metrics.record(f'startup.{phase}', elapsed)
+        self._waiting.discard(phase); self._waiting.difference_update(settles)
+        if self._expecting and not self._waiting: self.report()
+
+    def expect(self, *phases): self._expecting = True; self._waiting.update(phases)
+
+    def watch_first_message(self, chat_window):
+        # Gemessen wird das erste Zeichnen der Nachrichtenliste mit echten Nachrichten (nicht "Loading...")
+        self._chat_window = chat_window; chat_window.message_view.viewport().installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint and self._chat_window.message_model.has_messages():
+            obj.removeEventFilter(self); self._chat_window = None
+            QTimer.singleShot(0, lambda: self.mark('first_message')) # Nach dem Zeichnen
+        return False
+
+    def report(self):
+        if not self.enabled or self.reported: return
+        self.reported = True
+        print("Startup profile (ms since start of main.py):")
+        previous = 0.0
+        for phase, elapsed in sorted(self.phases, key=lambda item: item[1]):
+            print(f"  {phase:<20} {elapsed:8.1f}  (+{elapsed - previous:.1f})"); previous = elapsed
+        if self._waiting: print(f"  still waiting for: {', '.join(sorted(self._waiting))}")
+        sys.stdout.flush()
 
 class AppController(QStackedWidget):
-    def __init__(self, main_window):
+    def __init__(self, main_window, profile):
         super().__init__()
-        self.main_window = main_window
+        self.main_window, self.profile = main_window, profile
+        from firebase_manager import FirebaseManager
+        self.profile.mark('firebase_import')
         self.firebase_manager = FirebaseManager()
-        self.login_win = LoginWindow(self.firebase_manager)
-        self.register_win = RegisterWindow(self.firebase_manager)
-        self.main_chat_win = None
-        self.addWidget(self.login_win); self.addWidget(self.register_win)
-        self.login_win.login_successful.connect(self.show_chat_window)
-        self.login_win.show_register_window.connect(self.show_register)
-        self.register_win.registration_successful.connect(self.show_login)
-        self.register_win.show_login_window.connect(self.show_login)
+        # Login und Registrierung entstehen erst, wenn sie gebraucht werden; beim Autologin gar nicht
+        self.login_win, self.register_win, self.main_chat_win = None, None, None
+        # Platzhalter, der beim Start sofort gezeichnet wird, während das Token im Hintergrund erneuert wird
+        self.connecting_label = QLabel("Connecting..."); self.connecting_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.addWidget(self.connecting_label)
+        # Refresh-Token abgelehnt (z. B. Passwort geändert): zurück zum Login
+        self.firebase_manager.tokens.sessionExpired.connect(self.on_session_expired)
 
     def show_login(self):
         print("DEBUG: Zeige Login-Fenster an...")
+        if self.login_win is None:
+            from login_window import LoginWindow
+            self.login_win = LoginWindow(self.firebase_manager); self.addWidget(self.login_win)
+            self.login_win.login_successful.connect(self.show_chat_window)
+            self.login_win.show_register_window.connect(self.show_register)
         self.setCurrentWidget(self.login_win)
         self.main_window.setWindowTitle("Login - Tiwut Chat"); self.main_window.setFixedSize(400, 300)
 
     def show_register(self):
         print("DEBUG: Zeige Registrierungs-Fenster an...")
+        if self.register_win is None:
+            from register_window import RegisterWindow
+            self.register_win = RegisterWindow(self.firebase_manager); self.addWidget(self.register_win)
+            self.register_win.registration_successful.connect(self.show_login)
+            self.register_win.show_login_window.connect(self.show_login)
         self.setCurrentWidget(self.register_win)
         self.main_window.setWindowTitle("Register - Tiwut Chat"); self.main_window.setFixedSize(400, 450) # Etwas höher
 
-    def show_chat_window(self, user_data):
+    def show_connecting(self):
+        self.setCurrentWidget(self.connecting_label)
+        self.main_window.setWindowTitle("Tiwut Chat"); self.main_window.setFixedSize(400, 300)
+
+    def on_session_refreshed(self, session_data, result):
+        success, token_data = result
+        if success:
+            print("DEBUG: Token-Erneuerung erfolgreich. Automatischer Login...")
+            self.profile.mark('token_refresh')
+            # Kombiniere alte und neue Sitzungsdaten für die Anzeige
+            user_data = {**session_data, **token_data}
+            if self.main_chat_win and not self.main_chat_win.online:
+                # Der Chat zeigt schon den lokalen Stand; jetzt kommt das Netz dazu
+                self.firebase_manager.user_data = self.main_chat_win.user_data = user_data
+                self.main_chat_win.go_online()
+            else: self.show_chat_window(user_data)
+        else:
+            print(f"DEBUG: Token-Erneuerung fehlgeschlagen: {token_data}")
+            self.profile.mark('token_refresh', settles=('first_message',))
+            if self.main_chat_win: self.main_chat_win.close()
+            self.firebase_manager.tokens.clear(); self.show_login()
+
+    def on_session_refresh_failed(self, error_message):
+        # Netzwerkfehler statt Ablehnung: beim lokalen Stand bleiben; Streams und Abrufe erneuern das Token selbst, sobald das Netz zurück ist
+        print(f"DEBUG: Token-Erneuerung nicht möglich ({error_message}), zeige lokalen Stand")
+        self.profile.mark('token_refresh')
+        if self.main_chat_win: self.main_chat_win.go_online()
+
+    def show_chat_window(self, user_data, online=True):
         print(f"DEBUG: Login erfolgreich für {user_data.get('displayName')}. Zeige Chat-Fenster an...")
         if self.main_chat_win: self.removeWidget(self.main_chat_win); self.main_chat_win.deleteLater()
-        
+
         # user_data an den FirebaseManager übergeben
         self.firebase_manager.user_data = user_data
-        self.firebase_manager.user_token = user_data.get('idToken')
+        if online: self.firebase_manager.user_token = user_data.get('idToken')
 
-        self.main_chat_win = MainChatWindow(self.firebase_manager, user_data)
+        from main_chat_window import MainChatWindow
+        self.profile.mark('chat_window_import')
+        self.main_chat_win = MainChatWindow(self.firebase_manager, user_data, online)
         # Logout-Signal verbinden
         self.main_chat_win.logout_requested.connect(self.handle_logout)
-        
+
         self.addWidget(self.main_chat_win); self.setCurrentWidget(self.main_chat_win)
         self.main_window.setFixedSize(900, 600); self.main_window.setWindowTitle("Tiwut Chat")
+        self.profile.mark('chat_window'); self.profile.watch_first_message(self.main_chat_win)
+
+    def show_cached_chat_window(self, session_data):
+        # Autologin: Raumliste und letzter Raum kommen aus dem lokalen Speicher, während das Token noch erneuert wird
+        if self.main_chat_win is None and self.currentWidget() is self.connecting_label: self.show_chat_window(session_data, online=False)
+
+    def on_session_expired(self, reason):
+        print(f"DEBUG: Sitzung abgelaufen: {reason}")
+        if self.main_chat_win and self.currentWidget() is self.main_chat_win: self.handle_logout()
 
     def handle_logout(self):
         """Behandelt den Logout-Prozess."""
@@ -61,8 +157,14 @@ class AppController(QStackedWidget):
         self.show_login() # Zeigt das Login-Fenster an
 
 def main():
-    app = QApplication(sys.argv)
-    
+    parser = argparse.ArgumentParser(description="Tiwut Chat")
+    parser.add_argument('--profile-startup', action='store_true', help="print how long each startup phase took")
+    # Unbekannte Argumente (z. B. -platform) bleiben für Qt
+    args, qt_args = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qt_args)
+    profile = StartupProfile(args.profile_startup)
+    profile.mark('imports', at=IMPORTED)
+
     # (Dark Theme Code bleibt unverändert)
     app.setStyle("Fusion"); dark_palette = QPalette()
     dark_palette.setColor(QPalette.ColorRole.Window, QColor(32, 44, 51))
@@ -75,32 +177,35 @@ def main():
     dark_palette.setColor(QPalette.ColorRole.HighlightedText, Qt.GlobalColor.black)
     dark_palette.setColor(QPalette.ColorRole.Link, QColor(0, 168, 132))
     app.setPalette(dark_palette)
+    metrics.install_stall_detector(app); app.aboutToQuit.connect(metrics.flush)
+    profile.mark('qt_app')
 
     main_window = QMainWindow()
-    controller = AppController(main_window)
+    controller = AppController(main_window, profile)
     main_window.setCentralWidget(controller)
 
     # --- HIER IST DIE NEUE START-LOGIK ---
     session_data = controller.firebase_manager.load_session()
-    auto_login_success = False
+    profile.mark('session')
     if session_data and session_data.get('refreshToken'):
-        print("DEBUG: Gespeicherte Sitzung gefunden, versuche Token zu erneuern...")
-        success, token_data = controller.firebase_manager.refresh_token(session_data['refreshToken'])
-        if success:
-            print("DEBUG: Token-Erneuerung erfolgreich. Automatischer Login...")
-            # Kombiniere alte und neue Sitzungsdaten für die Anzeige
-            full_user_data = {**session_data, **token_data}
-            controller.show_chat_window(full_user_data)
-            auto_login_success = True
-        else:
-            print(f"DEBUG: Token-Erneuerung fehlgeschlagen: {token_data}")
-
-    if not auto_login_success:
+        print("DEBUG: Gespeicherte Sitzung gefunden, erneuere Token im Hintergrund...")
+        profile.expect('first_message', 'token_refresh')
+        controller.show_connecting()
+        # Abrufe, die vor dem Ende der Erneuerung starten (Senden, Verlauf), erneuern bei 401 selbst
+        controller.firebase_manager.tokens.refresh_token = session_data['refreshToken']
+        task = controller.firebase_manager.refresh_token_async(session_data['refreshToken'])
+        task.succeeded.connect(lambda result: controller.on_session_refreshed(session_data, result))
+        task.failed.connect(controller.on_session_refresh_failed)
+        # Startet im selben Event-Loop-Durchlauf direkt nach der Erneuerung: Netzwerk und lokaler Aufbau laufen gleichzeitig
+        QTimer.singleShot(0, lambda: controller.show_cached_chat_window(session_data))
+    else:
         # Wenn kein Auto-Login, zeige das normale Login-Fenster
+        profile.expect('window_shown')
         controller.show_login()
     # --- ENDE DER NEUEN START-LOGIK ---
 
     main_window.show()
+    profile.mark('window_shown')
     sys.exit(app.exec())
 
 if __name__ == '__main__':
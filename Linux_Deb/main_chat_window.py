@@ -1,24 +1,80 @@
 # main_chat_window.py
 
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QSplitter, QListWidget, QVBoxLayout, 
-                             QHBoxLayout, QTextEdit, QLineEdit, QPushButton, QLabel, QListWidgetItem)
-from PyQt6.QtCore import Qt, pyqtSlot, pyqtSignal
-from PyQt6.QtGui import QFont, QTextCursor
-import datetime
+                             QHBoxLayout, QLineEdit, QPushButton, QLabel, QListWidgetItem, QFileDialog, QProgressBar)
+from PyQt6.QtCore import Qt, QTimer, QUrl, pyqtSlot, pyqtSignal
+from PyQt6.QtGui import QFont, QShortcut, QKeySequence, QDesktopServices
 import time
 
+from attachments import AttachmentUploader, ThumbnailCache, ThumbnailLoader
+from firebase_manager import HISTORY_PAGE_SIZE
+from message_list import MessageListModel, MessageListView, MessageRole, attachment_of, format_time
+from message_index import sort_entry
+from prefetch import PrefetchScheduler
+from room_cache import RoomCache, RoomView
+from stream_manager import StreamManager
+from outbox import Outbox
+import metrics
+
 class MainChatWindow(QMainWindow):
     # NEUES Signal für den Logout
     logout_requested = pyqtSignal()
 
-    def __init__(self, firebase_manager, user_data):
+    def __init__(self, firebase_manager, user_data, online=True):
         super().__init__()
         self.firebase_manager = firebase_manager
         self.user_data = user_data
+        # Ohne gültiges Token (Autologin, Erneuerung läuft noch) zeigt das Fenster nur den lokalen Stand; go_online() startet den Rest
+        self.online = False
         self.chat_rooms, self.current_room_id, self.last_timestamp = {}, None, 0
+        # Zustand für das seitenweise Nachladen älterer Nachrichten (welche Nachrichten geladen sind, weiß das Modell)
+        self.oldest_timestamp, self.boundary_keys = None, set()
+        self.history_exhausted, self.loading_older, self.awaiting_first_page = False, False, False
+        # Nach dem Sprung zu einem Suchtreffer fehlen Nachrichten nach dem geladenen Fenster: dann ist newer_exhausted False,
+        # last_timestamp der neueste geladene Zeitstempel und newest_keys die Nachrichten mit genau diesem Zeitstempel
+        self.newer_exhausted, self.newest_keys = True, set()
+        # Jeder Raumwechsel und jeder Verlaufsabruf bekommt eine neue Generation; Antworten älterer Generationen werden verworfen
+        self.load_generation, self.history_request = 0, None
+        # Alle Räume werden im Hintergrund gestreamt; ungelesene Nachrichten zählen wir pro Raum
+        self.room_items, self.unread_counts = {}, {}
+        # Zuletzt angesehene Räume behalten Modell und Scrollposition, damit das Zurückwechseln sofort geht
+        self.room_cache = RoomCache()
+        # Nach dem Laden der Raumliste die neueste Seite der übrigen Räume vorwärmen, damit schon der erste Klick sofort geht
+        self.prefetcher = PrefetchScheduler(firebase_manager.latest_page, self)
+        self.prefetcher.pageReady.connect(self.on_room_prefetched)
+        self.stream_manager = StreamManager(firebase_manager, self)
+        self.stream_manager.snapshotReceived.connect(self.on_stream_snapshot)
+        self.stream_manager.newMessage.connect(self.on_new_message)
+        self.stream_manager.messageUpdated.connect(self.on_message_updated)
+        self.stream_manager.errorOccurred.connect(self.on_stream_error)
+        # Ausgehende Nachrichten erscheinen sofort als "ausstehend" und werden beim Echo bestätigt
+        self.outbox, self.pending_keys = Outbox(firebase_manager, self), set()
+        self.outbox.messageQueued.connect(self.on_message_queued)
+        self.outbox.sendFailed.connect(self.on_send_failed)
+        # Anhänge gehen zuerst nach Storage; erst danach wird die Nachricht mit Pfad und Token über die Outbox gesendet
+        thumbnail_cache = ThumbnailCache()
+        self.uploader = AttachmentUploader(firebase_manager, thumbnail_cache, self)
+        self.uploader.progress.connect(self.on_upload_progress)
+        self.uploader.uploaded.connect(self.on_attachment_uploaded)
+        self.uploader.failed.connect(self.on_upload_failed)
+        self.uploader.finished.connect(self.show_upload_state)
+        self.thumbnails = ThumbnailLoader(self.uploader.storage, thumbnail_cache, self)
         self.setWindowTitle("Tiwut Chat"); self.setGeometry(100, 100, 900, 600)
         self.init_ui()
-        self.load_chat_rooms()
+        self.show_cached_chat_rooms()
+        self.show_upload_state()
+        if online: self.go_online()
+
+    def go_online(self):
+        """Das Token ist gültig: Streams, Abgleich der Raumliste, Vorab-Laden, Outbox und offene Uploads starten."""
+        if self.online: return
+        self.online = True
+        if self.chat_rooms: self.stream_manager.start(self.chat_rooms.keys())
+        if self.current_room_id: self.stream_manager.set_active_room(self.current_room_id)
+        self.fetch_chat_rooms()
+        self.prefetch_rooms(list(self.room_items))
+        self.outbox.flush() # Nachrichten, die vor dem letzten Beenden nicht mehr rausgingen
+        self.uploader.resume_all(); self.show_upload_state()
 
     def init_ui(self):
         splitter = QSplitter(Qt.Orientation.Horizontal)
@@ -31,15 +87,30 @@ class MainChatWindow(QMainWindow):
         user_label.setFont(QFont("Poppins", 10, QFont.Weight.Bold))
         self.logout_button = QPushButton("Logout")
         self.logout_button.clicked.connect(self.logout_requested.emit) # Signal senden
+        # Diagnose-Panel (Latenzen, Reconnects, Hänger) ein-/ausblenden, auch per Strg+Umschalt+D
+        self.diagnostics_button = QPushButton("Diagnostics"); self.diagnostics_button.setCheckable(True)
+        self.diagnostics_button.toggled.connect(self.toggle_diagnostics)
+        QShortcut(QKeySequence("Ctrl+Shift+D"), self, activated=self.diagnostics_button.toggle)
         top_bar_layout.addWidget(user_label)
         top_bar_layout.addStretch()
+        top_bar_layout.addWidget(self.diagnostics_button)
         top_bar_layout.addWidget(self.logout_button)
         # --- ENDE DER ÄNDERUNGEN ---
 
         self.room_list_widget = QListWidget()
         self.room_list_widget.itemClicked.connect(self.on_room_selected)
+        # Volltextsuche im lokalen Cache; Treffer erscheinen statt der Raumliste, solange gesucht wird
+        self.search_input = QLineEdit(); self.search_input.setPlaceholderText("Search messages...")
+        self.search_input.setClearButtonEnabled(True)
+        self.search_timer = QTimer(self); self.search_timer.setSingleShot(True); self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(self.run_search)
+        self.search_input.textChanged.connect(self.search_timer.start)
+        self.search_results = QListWidget(); self.search_results.hide()
+        self.search_results.itemClicked.connect(self.open_search_hit)
         
         sidebar_layout.addLayout(top_bar_layout) # Das neue Layout mit dem Button hinzufügen
+        sidebar_layout.addWidget(self.search_input)
+        sidebar_layout.addWidget(self.search_results)
         sidebar_layout.addWidget(QLabel("Chat Rooms:"))
         sidebar_layout.addWidget(self.room_list_widget)
         sidebar_widget.setLayout(sidebar_layout)
@@ -49,65 +120,440 @@ class MainChatWindow(QMainWindow):
         self.chat_room_title = QLabel("Select a chat to start messaging.")
         self.chat_room_title.setFont(QFont("Poppins", 12, QFont.Weight.Bold))
         self.chat_room_title.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.message_view = QTextEdit(); self.message_view.setReadOnly(True)
+        self.message_model = MessageListModel(self)
+        self.message_view = MessageListView(); self.message_view.setModel(self.message_model)
+        self.message_view.reachedTop.connect(self.load_older_messages)
+        self.message_view.reachedBottom.connect(self.load_newer_messages)
+        self.message_view.set_thumbnail_loader(self.thumbnails)
+        self.message_view.doubleClicked.connect(self.open_attachment)
         input_layout = QHBoxLayout()
         self.message_input = QLineEdit(); self.message_input.setPlaceholderText("Type a message...")
         self.message_input.returnPressed.connect(self.send_message)
         self.send_button = QPushButton("Send"); self.send_button.clicked.connect(self.send_message)
-        input_layout.addWidget(self.message_input); input_layout.addWidget(self.send_button)
+        self.attach_button = QPushButton("Attach"); self.attach_button.clicked.connect(self.attach_file)
+        self.upload_progress = QProgressBar(); self.upload_progress.setMaximumWidth(160); self.upload_progress.hide()
+        self.cancel_upload_button = QPushButton("Cancel upload"); self.cancel_upload_button.hide()
+        self.cancel_upload_button.clicked.connect(self.cancel_uploads)
+        input_layout.addWidget(self.message_input); input_layout.addWidget(self.attach_button); input_layout.addWidget(self.send_button)
+        input_layout.addWidget(self.upload_progress); input_layout.addWidget(self.cancel_upload_button)
         chat_layout.addWidget(self.chat_room_title); chat_layout.addWidget(self.message_view)
+        # Das Diagnose-Panel entsteht erst beim ersten Einblenden
+        self.chat_layout, self.diagnostics_panel = chat_layout, None
         chat_layout.addLayout(input_layout); chat_area_widget.setLayout(chat_layout)
         splitter.addWidget(sidebar_widget); splitter.addWidget(chat_area_widget)
         splitter.setSizes([300, 600]); self.setCentralWidget(splitter)
 
-    # (Alle anderen Methoden wie load_chat_rooms, on_room_selected etc. bleiben unverändert)
-    def load_chat_rooms(self):
-        self.room_list_widget.clear(); self.chat_rooms = self.firebase_manager.get_chat_rooms()
-        if not self.chat_rooms: self.room_list_widget.addItem("No chat rooms found."); return
-        for room_id, room_data in self.chat_rooms.items():
-            item = QListWidgetItem(f"{room_data.get('name', 'Unnamed Room')}")
+    def toggle_diagnostics(self, visible):
+        if self.diagnostics_panel is None:
+            if not visible: return
+            from diagnostics_panel import DiagnosticsPanel
+            self.diagnostics_panel = DiagnosticsPanel(); self.chat_layout.addWidget(self.diagnostics_panel)
+        self.diagnostics_panel.setVisible(visible)
+
+    # (Alle anderen Methoden wie on_room_selected etc. bleiben unverändert)
+    def show_cached_chat_rooms(self):
+        # Die Seitenleiste kommt sofort aus der gespeicherten Liste; der Server liefert sie nur neu, wenn sie sich geändert hat
+        cached = self.firebase_manager.message_store.get_meta('chatRooms') or {}
+        if cached.get('rooms'): self.show_chat_rooms(cached['rooms'])
+        else: self.room_list_widget.clear(); self.room_list_widget.addItem("Loading chat rooms...")
+
+    def fetch_chat_rooms(self):
+        cached = self.firebase_manager.message_store.get_meta('chatRooms') or {}
+        task = self.firebase_manager.fetch_chat_rooms_async(cached.get('etag') if cached.get('rooms') else None)
+        task.succeeded.connect(self.on_chat_rooms_fetched)
+        task.failed.connect(self.on_chat_rooms_error)
+
+    def on_chat_rooms_fetched(self, result):
+        etag, rooms = result
+        if rooms is None: return # Unverändert seit dem letzten Mal
+        self.firebase_manager.message_store.set_meta('chatRooms', {'etag': etag, 'rooms': rooms})
+        self.show_chat_rooms(rooms)
+
+    def on_chat_rooms_error(self, error_message):
+        metrics.count('rooms.fetch_failed', error=error_message)
+        # Offline oder bei einem Fehler mit der gespeicherten Liste (und ihren Namen) einfach bei dieser bleiben
+        if not self.room_items: self.show_chat_rooms({})
+
+    def show_chat_rooms(self, rooms):
+        """Baut die Raumliste auf oder gleicht sie mit einer neueren ab (neue Räume, umbenannte, gelöschte)."""
+        removed, added = self.chat_rooms.keys() - rooms.keys(), [room_id for room_id in rooms if room_id not in self.room_items]
+        self.chat_rooms = rooms
+        if not self.room_items: self.room_list_widget.clear() # Platzhalter entfernen
+        for room_id in removed:
+            self.room_list_widget.takeItem(self.room_list_widget.row(self.room_items.pop(room_id)))
+            self.unread_counts.pop(room_id, None); self.prefetcher.cancel(room_id)
+            room_view = self.room_cache.take(room_id)
+            if room_view: room_view.model.deleteLater()
+            self.stream_manager.stop_room(room_id)
+        if self.current_room_id in removed:
+            self.current_room_id = None; self.chat_room_title.setText("Select a chat to start messaging."); self.message_model.clear()
+        for room_id in rooms:
+            if room_id in self.room_items: self.update_room_label(room_id)
+        if self.current_room_id in rooms: self.chat_room_title.setText(rooms[self.current_room_id].get('name', 'Chat'))
+        if not rooms: self.room_list_widget.clear(); self.room_list_widget.addItem("No chat rooms found."); return
+        if self.online: self.stream_manager.start(rooms.keys())
+        last_room_id = self.firebase_manager.message_store.get_meta('lastRoomId') if self.current_room_id is None else None
+        for room_id in added:
+            item = QListWidgetItem(f"{rooms[room_id].get('name', 'Unnamed Room')}")
             item.setData(Qt.ItemDataRole.UserRole, room_id); self.room_list_widget.addItem(item)
-            
+            self.room_items[room_id] = item
+            # Zuletzt geöffneten Raum beim Start direkt aus dem Cache wiederherstellen
+            if room_id == last_room_id:
+                self.room_list_widget.setCurrentItem(item); self.on_room_selected(item)
+        if self.online: self.prefetch_rooms(added)
+
+    def prefetch_rooms(self, room_ids):
+        # Räume mit Stream wärmt dessen Snapshot vor (on_stream_snapshot); per REST nur die ohne, zuletzt aktive zuerst
+        store = self.firebase_manager.message_store
+        for room_id in room_ids:
+            if room_id == self.current_room_id or room_id in self.room_cache: continue
+            if self.stream_manager.has_snapshot(room_id): self.warm_room(room_id)
+            elif not self.stream_manager.has_stream(room_id): self.prefetcher.schedule(room_id, store.max_timestamp(room_id) or 0)
+
+    def warm_room(self, room_id):
+        """Legt die neueste Seite eines Raums aus dem lokalen Cache in den Raum-Cache, den der Stream gerade gefüllt hat."""
+        if room_id in self.room_cache or len(self.room_cache) >= self.room_cache.max_rooms: return
+        metrics.count('prefetch.from_stream')
+        self.on_room_prefetched(room_id, self.firebase_manager.message_store.get_page(room_id, HISTORY_PAGE_SIZE))
+
+    @pyqtSlot(str, dict)
+    def on_room_prefetched(self, room_id, messages_dict):
+        if room_id == self.current_room_id:
+            # Der Benutzer war schneller: wartet der Raum noch auf seinen Verlauf, kommt er eben von hier
+            if self.awaiting_first_page: self.show_first_page(messages_dict)
+            return
+        if room_id in self.room_cache: return
+        model = MessageListModel(self)
+        items = sorted(messages_dict.items(), key=lambda item: sort_entry(*item))
+        if items: model.set_messages(items)
+        else: model.set_placeholder("No messages in this room yet.")
+        pending_keys = set()
+        for key, msg in self.outbox.pending(room_id):
+            if not model.contains(key): pending_keys.add(key); model.insert_message(key, msg)
+        oldest = items[0][1].get('timestamp', 0) if items else None
+        room_view = RoomView(model, None, items[-1][1].get('timestamp', 0) if items else int(time.time() * 1000), oldest,
+                             {k for k, m in items if m.get('timestamp', 0) == oldest}, False, pending_keys)
+        if self.room_cache.offer(room_id, room_view): metrics.count('prefetch.cached')
+        else: model.deleteLater()
+
+    def run_search(self):
+        query = self.search_input.text().strip()
+        self.search_results.setVisible(bool(query)); self.room_list_widget.setVisible(not query); self.search_results.clear()
+        if not query: return
+        with metrics.timer('search.query'): hits = self.firebase_manager.message_store.search(query)
+        if not hits: self.search_results.addItem("No matches."); return
+        for room_id, key, msg, snippet in hits:
+            room_name = self.chat_rooms.get(room_id, {}).get('name', room_id)
+            item = QListWidgetItem(f"{room_name} · {msg.get('username', 'Unknown')} ({format_time(msg)}): {snippet}")
+            item.setData(Qt.ItemDataRole.UserRole, (room_id, key, msg.get('timestamp', 0))); self.search_results.addItem(item)
+
+    def open_search_hit(self, item):
+        hit = item.data(Qt.ItemDataRole.UserRole)
+        room_item = self.room_items.get(hit[0]) if hit else None
+        if not room_item: return
+        room_id, key, timestamp = hit
+        if room_id != self.current_room_id: self.room_list_widget.setCurrentItem(room_item); self.on_room_selected(room_item)
+        if not self.message_model.contains(key): self.show_search_window(room_id, timestamp)
+        # Liegt der Treffer in einem noch nicht eingefügten älteren Block, hat er noch keine Zeile
+        else: self.message_model.finish_loading()
+        self.message_view.highlight_key(key)
+
+    def show_search_window(self, room_id, timestamp):
+        """Zeigt nur ein Fenster um den Treffer (je eine halbe Seite davor und danach); den Rest laden die Bildlaufränder nach."""
+        store, limit = self.firebase_manager.message_store, HISTORY_PAGE_SIZE // 2 + 1
+        self.cancel_history_request(); self.loading_older = False
+        self.awaiting_first_page, self.oldest_timestamp, self.boundary_keys, self.history_exhausted = False, None, set(), False
+        self.message_model.clear(); self.pending_keys = set()
+        # startAt/endAt sind inklusiv: beide Hälften enthalten den Treffer selbst
+        before, after = store.get_page(room_id, limit, end_at=timestamp), store.get_page_from(room_id, limit, start_at=timestamp)
+        with metrics.timer('history.render', rows=len(before) + len(after)):
+            sorted_items = self.remember_page({**before, **after})
+            self.message_model.set_messages(sorted_items)
+        self.last_timestamp, self.newest_keys = 0, set(); self.remember_newest(sorted_items)
+        # Reicht die zweite Hälfte nicht, ist das Fenster schon beim neuesten Stand angekommen
+        self.newer_exhausted = len(after) < limit
+        if self.newer_exhausted: self.show_pending()
+
+    def update_room_label(self, room_id):
+        item, unread = self.room_items.get(room_id), self.unread_counts.get(room_id, 0)
+        if not item: return
+        name = self.chat_rooms.get(room_id, {}).get('name', 'Unnamed Room')
+        item.setText(f"{name} ({unread})" if unread else name)
+        font = item.font(); font.setBold(bool(unread)); item.setFont(font)
+
     def on_room_selected(self, item):
-        self.current_room_id = item.data(Qt.ItemDataRole.UserRole)
-        if not self.current_room_id: return
-        self.firebase_manager.stop_message_stream()
+        room_id = item.data(Qt.ItemDataRole.UserRole)
+        if not room_id: return
+        # Den bisherigen Raum zurücklegen; ein erneuter Klick auf den aktuellen Raum lädt ihn dagegen frisch
+        switching = room_id != self.current_room_id
+        self.cancel_history_request()
+        stashed = switching and self.current_room_id is not None and self.stash_current_room()
+        self.current_room_id = room_id
+        if self.online: self.stream_manager.set_active_room(self.current_room_id)
+        self.unread_counts[self.current_room_id] = 0; self.update_room_label(self.current_room_id)
         room_data = self.chat_rooms.get(self.current_room_id, {})
         self.chat_room_title.setText(room_data.get('name', 'Chat'))
-        self.message_view.setText("<i>Loading message history...</i>")
-        self.firebase_manager.load_message_history(self.current_room_id, self.on_history_loaded, self.on_stream_error)
+        store = self.firebase_manager.message_store
+        store.set_meta('lastRoomId', self.current_room_id)
+        room_view = self.room_cache.take(room_id) if switching else None
+        metrics.count('room_cache.hit' if room_view else 'room_cache.miss')
+        self.prefetcher.cancel(room_id)
+        if room_view: self.restore_room(room_view); return
+        self.oldest_timestamp, self.boundary_keys, self.pending_keys = None, set(), set()
+        self.history_exhausted, self.loading_older, self.newer_exhausted, self.newest_keys = False, False, True, set()
+        if stashed: self.show_model(MessageListModel(self))
+        else: self.message_model.clear()
+        cached = store.get_page(self.current_room_id, HISTORY_PAGE_SIZE)
+        # Der erste Snapshot des Raum-Streams ersetzt den separaten Verlaufsabruf
+        self.awaiting_first_page = not cached and not self.stream_manager.has_snapshot(self.current_room_id)
+        if self.awaiting_first_page:
+            # Der Benutzer wartet: bis der Verlauf da ist, keine weiteren Vorab-Ladungen starten
+            self.message_model.set_placeholder("Loading message history..."); self.prefetcher.yield_to_user()
+        else:
+            # Der Stream läuft bereits im Hintergrund; alles Bisherige liegt lokal vor
+            self.show_history_page(cached)
+
+    def stash_current_room(self):
+        """Legt den angezeigten Raum in den Raum-Cache; False, wenn er noch auf seinen ersten Verlauf wartet."""
+        if self.awaiting_first_page: return False
+        room_view = RoomView(self.message_model, self.message_view.scroll_state(), self.last_timestamp, self.oldest_timestamp,
+                             self.boundary_keys, self.history_exhausted, self.pending_keys, self.newer_exhausted, self.newest_keys)
+        self.release_evicted(self.room_cache.put(self.current_room_id, room_view))
+        return True
+
+    def apply_to_cached_room(self, room_id, messages_dict):
+        room_view = self.room_cache.peek(room_id)
+        if not room_view: return
+        room_view.apply_messages(messages_dict)
+        self.release_evicted(self.room_cache.resize(room_id))
+
+    def release_evicted(self, evicted_rooms):
+        for _, evicted in evicted_rooms: metrics.count('room_cache.evicted'); evicted.model.deleteLater()
+
+    def restore_room(self, room_view):
+        self.show_model(room_view.model)
+        self.last_timestamp, self.oldest_timestamp, self.boundary_keys = room_view.last_timestamp, room_view.oldest_timestamp, room_view.boundary_keys
+        self.history_exhausted, self.pending_keys = room_view.history_exhausted, room_view.pending_keys
+        self.newer_exhausted, self.newest_keys = room_view.newer_exhausted, room_view.newest_keys
+        self.loading_older, self.awaiting_first_page = False, False
+        self.message_view.restore_scroll_state(room_view.scroll_state)
+
+    def show_model(self, model):
+        self.message_model = model; self.message_view.setModel(model)
+
+    @pyqtSlot(str, dict)
+    def on_stream_snapshot(self, room_id, messages_dict):
+        self.firebase_manager.message_store.add_messages(room_id, messages_dict)
+        if room_id != self.current_room_id:
+            if room_id in self.room_cache: self.apply_to_cached_room(room_id, messages_dict)
+            else: self.warm_room(room_id)
+            return
+        if self.awaiting_first_page: self.show_first_page(messages_dict); return
+        # Fenster um einen Suchtreffer: Neues erscheint erst, wenn der Benutzer bis dorthin blättert
+        if not self.newer_exhausted: return
+        # Seit dem letzten Besuch neu hinzugekommene Nachrichten anhängen
+        self.confirm_pending(messages_dict)
+        new_items = self.remember_page(messages_dict)
+        if len(new_items) > MessageListModel.RENDER_CHUNK:
+            # Nach längerer Abwesenheit (startAt ohne Limit) kann der Snapshot Tausende Zeilen haben: über den blockweisen
+            # Pfad, damit zuerst die neuesten erscheinen und der GUI-Thread nicht auf alle wartet
+            with metrics.timer('history.render', rows=len(new_items)):
+                self.message_model.set_messages(self.message_model.items() + new_items, incremental=True)
+            self.message_view.scroll_to_end()
+        else:
+            self.message_view.prepare_append()
+            self.message_model.insert_messages(new_items)
+        self.last_timestamp = max([self.last_timestamp] + [m.get('timestamp', 0) for m in messages_dict.values()])
+
+    @pyqtSlot(str, str, dict)
+    def on_message_updated(self, room_id, key, fields):
+        self.firebase_manager.message_store.update_message(room_id, key, fields)
+        room_view = self.room_cache.peek(room_id)
+        if room_id == self.current_room_id: self.message_model.update_message(key, fields)
+        elif room_view: room_view.model.update_message(key, fields)
+
+    def show_latest_page(self):
+        self.cancel_history_request(); self.loading_older = False
+        self.oldest_timestamp, self.boundary_keys, self.history_exhausted = None, set(), False
+        self.message_model.clear()
+        self.show_history_page(self.firebase_manager.message_store.get_page(self.current_room_id, HISTORY_PAGE_SIZE))
 
-    @pyqtSlot(dict)
-    def on_history_loaded(self, messages_dict):
-        self.message_view.clear()
-        if not messages_dict: self.message_view.setText("<i>No messages in this room yet.</i>"); self.last_timestamp = int(time.time() * 1000)
+    def show_first_page(self, messages_dict):
+        self.awaiting_first_page = False
+        self.show_history_page(messages_dict)
+        self.history_exhausted = len(messages_dict) < HISTORY_PAGE_SIZE
+        self.prefetcher.resume()
+
+    def show_history_page(self, messages_dict):
+        self.pending_keys, self.newer_exhausted, self.newest_keys = set(), True, set()
+        if not messages_dict: self.message_model.set_placeholder("No messages in this room yet."); self.last_timestamp = int(time.time() * 1000)
         else:
-            sorted_messages = sorted(messages_dict.values(), key=lambda x: x.get('timestamp', 0))
-            self.message_view.setHtml("<br>".join([self.format_message(m) for m in sorted_messages]))
-            if sorted_messages: self.last_timestamp = sorted_messages[-1].get('timestamp', 0)
-        self.message_view.moveCursor(QTextCursor.MoveOperation.End)
-        self.firebase_manager.start_message_stream(self.current_room_id, self.last_timestamp + 1, self.on_new_message, self.on_stream_error)
+            with metrics.timer('history.render', rows=len(messages_dict)):
+                sorted_items = self.remember_page(messages_dict)
+                self.message_model.set_messages(sorted_items, incremental=True)
+            if sorted_items: self.last_timestamp = sorted_items[-1][1].get('timestamp', 0)
+        self.show_pending()
+        self.message_view.scroll_to_end()
+
+    def show_pending(self):
+        """Hängt eigene, noch nicht bestätigte Nachrichten des Raums ans Ende an."""
+        for key, msg in self.outbox.pending(self.current_room_id):
+            if not self.message_model.contains(key):
+                self.pending_keys.add(key); self.message_model.insert_message(key, msg)
+
+    def confirm_pending(self, messages_dict):
+        """Ersetzt ausstehende Nachrichten durch ihr Echo vom Server (gleiche Push-ID)."""
+        for key in self.pending_keys & messages_dict.keys():
+            self.pending_keys.discard(key)
+            self.message_model.update_message(key, {**messages_dict[key], 'pending': False})
+
+    def remember_page(self, messages_dict):
+        """Merkt sich Schlüssel und ältesten Zeitstempel einer Seite und gibt deren neue Nachrichten sortiert zurück."""
+        new_items = sorted(((k, m) for k, m in messages_dict.items() if not self.message_model.contains(k)), key=lambda item: sort_entry(*item))
+        if new_items:
+            oldest = new_items[0][1].get('timestamp', 0)
+            if self.oldest_timestamp is None or oldest < self.oldest_timestamp: self.oldest_timestamp, self.boundary_keys = oldest, set()
+            if oldest == self.oldest_timestamp: self.boundary_keys.update(k for k, m in new_items if m.get('timestamp', 0) == oldest)
+        return new_items
+
+    def remember_newest(self, sorted_items):
+        """Merkt sich Zeitstempel und Schlüssel der neuesten geladenen Nachrichten als Startpunkt für load_newer_messages()."""
+        if not sorted_items: return
+        newest = sorted_items[-1][1].get('timestamp', 0)
+        if newest > self.last_timestamp: self.last_timestamp, self.newest_keys = newest, set()
+        self.newest_keys.update(k for k, m in sorted_items if m.get('timestamp', 0) == newest)
+
+    def load_newer_messages(self):
+        if not self.current_room_id or self.newer_exhausted: return
+        # startAt ist inklusiv wie endAt beim Nachladen älterer Seiten. Das Netzwerk wird nicht gefragt: der Raum-Stream
+        # schreibt jede neue Nachricht in den lokalen Cache, der ab dem Fenster also bis zum neuesten Stand reicht
+        limit = HISTORY_PAGE_SIZE + len(self.newest_keys)
+        page = self.firebase_manager.message_store.get_page_from(self.current_room_id, limit, start_at=self.last_timestamp)
+        new_items = sorted(((k, m) for k, m in page.items() if not self.message_model.contains(k)), key=lambda item: sort_entry(*item))
+        if len(page) < limit or not new_items: self.newer_exhausted = True
+        if new_items:
+            # Neuere Nachrichten unten anhängen, ohne dass die Ansicht ihnen folgt
+            self.message_view.hold_position()
+            with metrics.timer('history.render', rows=len(new_items)): self.message_model.insert_messages(new_items)
+            self.remember_newest(new_items)
+        # Beim neuesten Stand angekommen: ab hier hängen Stream und Outbox wieder direkt an
+        if self.newer_exhausted: self.show_pending()
+
+    def load_older_messages(self):
+        if not self.current_room_id or self.oldest_timestamp is None or self.history_exhausted or self.loading_older: return
+        self.loading_older = True
+        # endAt ist inklusiv: Nachrichten mit gleichem Zeitstempel, die wir schon haben, zusätzlich anfordern
+        limit = HISTORY_PAGE_SIZE + len(self.boundary_keys)
+        cached = self.firebase_manager.message_store.get_page(self.current_room_id, limit, end_at=self.oldest_timestamp)
+        # Der lokale Cache ist lückenlos; nur wenn er nicht reicht, wird das Netzwerk gefragt
+        if len(cached) >= limit: self.on_older_history_loaded(self.current_room_id, cached); return
+        self.prefetcher.yield_to_user()
+        generation = self.cancel_history_request()
+        self.history_request = self.firebase_manager.load_message_history(
+            self.current_room_id, lambda room_id, messages_dict: self.on_older_history_loaded(room_id, messages_dict, generation),
+            lambda error_message: self.on_older_history_error(error_message, generation), end_at=self.oldest_timestamp, limit=limit)
+
+    def cancel_history_request(self):
+        """Verwirft den laufenden Verlaufsabruf und gibt die Generation für den nächsten zurück."""
+        if self.history_request: self.history_request.cancel(); self.history_request = None
+        self.load_generation += 1
+        return self.load_generation
+
+    def on_older_history_loaded(self, room_id, messages_dict, generation=None):
+        # Auch überholte Antworten sind gültige Nachrichten für den Cache, nur anzeigen dürfen wir sie nicht mehr
+        self.firebase_manager.message_store.add_messages(room_id, messages_dict)
+        if generation is not None and generation != self.load_generation: metrics.count('history.stale'); return
+        if room_id != self.current_room_id or not self.loading_older: return
+        self.loading_older, self.history_request = False, None; self.prefetcher.resume()
+        limit = HISTORY_PAGE_SIZE + len(self.boundary_keys)
+        new_items = self.remember_page(messages_dict)
+        if len(messages_dict) < limit or not new_items: self.history_exhausted = True
+        if not new_items: return
+        # Ältere Nachrichten oben einfügen; die Ansicht hält dabei selbst die sichtbare Stelle
+        with metrics.timer('history.render', rows=len(new_items)): self.message_model.insert_messages(new_items)
+
+    def on_older_history_error(self, error_message, generation=None):
+        if generation is not None and generation != self.load_generation: return
+        self.loading_older, self.history_request = False, None; self.prefetcher.resume(); self.on_stream_error(self.current_room_id, error_message)
 
     def send_message(self):
         text = self.message_input.text().strip()
-        if text and self.current_room_id: self.firebase_manager.send_message(self.current_room_id, text); self.message_input.clear()
+        if not text or not self.current_room_id: return
+        self.outbox.enqueue(self.current_room_id, text); self.message_input.clear()
+
+    def attach_file(self):
+        if not self.current_room_id: return
+        file_path, _ = QFileDialog.getOpenFileName(self, "Attach file")
+        if not file_path: return
+        self.uploader.upload(self.current_room_id, file_path)
+        self.upload_progress.setRange(0, 0); self.show_upload_state() # Bis zum ersten Block: unbestimmt
+
+    def show_upload_state(self, key=None):
+        uploading = bool(self.uploader.active)
+        self.upload_progress.setVisible(uploading); self.cancel_upload_button.setVisible(uploading)
+
+    def cancel_uploads(self):
+        for key in list(self.uploader.active): self.uploader.cancel(key)
+
+    @pyqtSlot(str, int, int)
+    def on_upload_progress(self, key, sent, total):
+        self.upload_progress.setRange(0, 1000); self.upload_progress.setValue(int(1000 * sent / total) if total else 1000)
 
-    def format_message(self, msg_data):
-        sender = msg_data.get('username', 'Unknown'); text = msg_data.get('text', '').replace('\n', '<br>')
-        try: time_str = datetime.datetime.fromtimestamp(msg_data.get('timestamp', 0) / 1000).strftime('%H:%M:%S')
-        except (ValueError, TypeError): time_str = "??:??"
-        return f"<small>[{time_str}]</small> <b>{sender}:</b> {text}"
+    @pyqtSlot(str, str, dict)
+    def on_attachment_uploaded(self, room_id, key, attachment):
+        self.outbox.enqueue(room_id, attachment['name'], attachment, key)
 
-    @pyqtSlot(dict)
-    def on_new_message(self, msg_data):
+    @pyqtSlot(str, str, str)
+    def on_upload_failed(self, room_id, key, error_message):
+        self.on_stream_error(room_id, f"Upload failed: {error_message}")
+
+    def open_attachment(self, index):
+        # Die Datei selbst wird erst auf Wunsch geladen, im Standardprogramm für ihren Typ
+        attachment = attachment_of(index.data(MessageRole) or {})
+        if attachment and attachment.get('token'): QDesktopServices.openUrl(QUrl(self.uploader.storage.download_url(attachment['path'], attachment['token'])))
+
+    @pyqtSlot(str, str, dict)
+    def on_message_queued(self, room_id, key, msg_data):
+        # Solange der erste Verlauf noch lädt, zeigt show_history_page() die Nachricht an
+        if room_id != self.current_room_id or self.awaiting_first_page: return
+        # Wer im Fenster um einen Suchtreffer sendet, springt zum neuesten Stand; die Nachricht bringt show_pending() mit
+        if not self.newer_exhausted: self.show_latest_page(); return
+        self.pending_keys.add(key)
+        self.message_view.scroll_to_end(); self.message_model.insert_message(key, msg_data)
+
+    @pyqtSlot(str, str, dict)
+    def on_new_message(self, room_id, key, msg_data):
         if not msg_data.get('timestamp'): return
-        if "<i>" in self.message_view.toHtml(): self.message_view.clear()
-        self.message_view.append(self.format_message(msg_data))
-        self.last_timestamp = msg_data.get('timestamp', self.last_timestamp)
+        # Verzögerung vom Server-Zeitstempel bis hierher (enthält eine eventuelle Uhrabweichung des Clients)
+        if metrics.enabled(): metrics.record('stream.lag', time.time() * 1000 - msg_data['timestamp'])
+        self.firebase_manager.message_store.add_messages(room_id, {key: msg_data})
+        if room_id != self.current_room_id:
+            self.unread_counts[room_id] = self.unread_counts.get(room_id, 0) + 1; self.update_room_label(room_id)
+            self.prefetcher.bump(room_id, msg_data['timestamp'])
+            self.apply_to_cached_room(room_id, {key: msg_data})
+            return
+        self.confirm_pending({key: msg_data})
+        if not self.newer_exhausted or self.message_model.contains(key): return
+        # Verspätete oder doppelt zugestellte Nachrichten sortiert der Index an die richtige Stelle bzw. verwirft sie
+        self.message_view.prepare_append()
+        self.message_model.insert_message(key, msg_data)
+        self.last_timestamp = max(self.last_timestamp, msg_data['timestamp'])
     
-    @pyqtSlot(str)
-    def on_stream_error(self, error_message):
-        if "Index not defined" in error_message: return
-        self.message_view.append(f"<i style='color: red;'>Error: {error_message}</i>")
+    @pyqtSlot(str, list, str)
+    def on_send_failed(self, room_id, keys, error_message):
+        # Abgelehnte Nachrichten bleiben als "not sent" stehen, statt für immer "sending..." zu zeigen
+        if room_id == self.current_room_id: model, pending_keys = self.message_model, self.pending_keys
+        else:
+            room_view = self.room_cache.peek(room_id)
+            model, pending_keys = (room_view.model, room_view.pending_keys) if room_view else (None, set())
+        for key in keys:
+            pending_keys.discard(key)
+            if model: model.update_message(key, {'pending': False, 'failed': True})
+        self.on_stream_error(room_id, error_message)
+
+    @pyqtSlot(str, str)
+    def on_stream_error(self, room_id, error_message):
+        if room_id != self.current_room_id or "Index not defined" in error_message: return
+        self.message_view.prepare_append(); self.message_model.add_notice(f"Error: {error_message}", error=True)
 
-    def closeEvent(self, event): self.firebase_manager.stop_message_stream(); event.accept()
+    def closeEvent(self, event): self.cancel_history_request(); self.prefetcher.cancel_all(); self.stream_manager.stop_all(); event.accept()
@@ -0,0 +1,66 @@
+# message_index.py
+
+import bisect
+
+def sort_timestamp(msg):
+    # Ausstehende Nachrichten tragen ihre lokale Uhrzeit, Server-Platzhalter ({".sv": ...}) zählen als 0
+    ts = msg.get('timestamp') if isinstance(msg, dict) else None
+    return ts if isinstance(ts, (int, float)) else 0
+
+def sort_entry(key, msg): return (sort_timestamp(msg), key)
+
+class MessageIndex:
+    """Nachrichten eines Raums, sortiert nach (timestamp, push_id) und per Push-ID eindeutig.
+
+    Verlauf und Stream schreiben beide hier hinein: Doppelte werden zusammengeführt, verspätete
+    Nachrichten landen per Binärsuche an der richtigen Stelle statt am Ende."""
+    def __init__(self):
+        self._order, self._messages = [], {}
+
+    def __len__(self): return len(self._order)
+    def __contains__(self, key): return key in self._messages
+    def get(self, key): return self._messages.get(key)
+
+    def item(self, position):
+        key = self._order[position][1]
+        return key, self._messages[key]
+
+    def items(self): return [(key, self._messages[key]) for _, key in self._order]
+
+    def first_entry(self): return self._order[0] if self._order else None
+    def last_entry(self): return self._order[-1] if self._order else None
+
+    def position(self, key):
+        msg = self._messages.get(key)
+        return None if msg is None else bisect.bisect_left(self._order, sort_entry(key, msg))
+
+    def insertion_point(self, key, msg):
+        """Zeile, vor der (key, msg) beim aktuellen Stand einsortiert würde."""
+        entry = sort_entry(key, msg)
+        # Der Normalfall (neueste Nachricht) braucht keine Suche
+        if not self._order or entry > self._order[-1]: return len(self._order)
+        return bisect.bisect_left(self._order, entry)
+
+    def reset(self, items=()):
+        self._messages = dict(items)
+        self._order = sorted(sort_entry(key, msg) for key, msg in self._messages.items())
+
+    def insert(self, key, msg):
+        """Fügt ein oder ersetzt (bei geändertem Zeitstempel an neuer Stelle); gibt die neue Position zurück."""
+        old_position = self.position(key)
+        if old_position is not None:
+            if sort_timestamp(self._messages[key]) == sort_timestamp(msg): self._messages[key] = msg; return old_position
+            del self._order[old_position]
+        position = self.insertion_point(key, msg)
+        self._order.insert(position, sort_entry(key, msg)); self._messages[key] = msg
+        return position
+
+    def insert_block(self, position, items):
+        """Fügt bereits sortierte, neue Nachrichten, die zusammen an `position` gehören, in einem Schritt ein."""
+        self._order[position:position] = [sort_entry(key, msg) for key, msg in items]
+        self._messages.update(items)
+
+    def remove(self, key):
+        position = self.position(key)
+        if position is not None: del self._order[position]; del self._messages[key]
+        return position
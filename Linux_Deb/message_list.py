@@ -0,0 +1,358 @@
+# message_list.py
+
+import datetime
+import time
+from PyQt6.QtWidgets import QListView, QStyledItemDelegate, QAbstractItemView
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QPoint, QRect, QSize, QTimer, pyqtSignal
+from PyQt6.QtGui import QFont, QFontMetrics, QColor
+
+from message_index import MessageIndex, sort_entry
+
+# Eigene Rollen für die Rohdaten einer Zeile
+KeyRole = Qt.ItemDataRole.UserRole
+MessageRole = Qt.ItemDataRole.UserRole + 1
+# Fertig formatierte Anzeige (Absender, Uhrzeit, Text); einmal pro Push-ID berechnet
+FormattedRole = Qt.ItemDataRole.UserRole + 2
+
+def format_time(msg_data):
+    try: return datetime.datetime.fromtimestamp(msg_data.get('timestamp', 0) / 1000).strftime('%H:%M:%S')
+    except (ValueError, TypeError, OSError): return "??:??"
+
+def format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024: return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def attachment_of(msg):
+    attachment = msg.get('attachment')
+    return attachment if isinstance(attachment, dict) and isinstance(attachment.get('path'), str) else None
+
+def format_message(msg):
+    # Gezeichnet wird reiner Text (drawText), daher ist kein HTML-Escaping nötig
+    text, attachment = str(msg.get('text', '')), attachment_of(msg)
+    if attachment:
+        name = str(attachment.get('name', 'file'))
+        size = attachment.get('size')
+        label = f"\U0001F4CE {name} ({format_size(size)})" if isinstance(size, (int, float)) else f"\U0001F4CE {name}"
+        text = label if text in ("", name) else f"{text}\n{label}"
+    return f"{msg.get('username', 'Unknown')}:", "not sent" if msg.get('failed') else "sending..." if msg.get('pending') else format_time(msg), text
+
+class MessageListModel(QAbstractListModel):
+    """Nachrichten eines Raums in der Reihenfolge ihres MessageIndex; Hinweise (Laden, Fehler) haben die push_id None."""
+    # Große Verläufe: sofort nur die neuesten Zeilen, ältere blockweise über die folgenden Event-Loop-Durchläufe.
+    # Die Blockgröße passt sich so an, dass ein Block etwa FRAME_BUDGET_MS dauert (mindestens RENDER_CHUNK Zeilen)
+    RENDER_CHUNK, FRAME_BUDGET_MS = 200, 16
+    # Grobe Kosten einer Zeile ohne Text (Nachrichten-Dict, Indexeintrag, formatiertes Tupel), mit tracemalloc ermittelt
+    ROW_OVERHEAD = 700
+    loadingFinished = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._index, self._placeholder, self._notice_count, self._formatted = MessageIndex(), None, 0, {}
+        self._backlog, self._backlog_end, self._backlog_keys, self._chunk_size = [], 0, set(), self.RENDER_CHUNK
+        self._chunk_timer = QTimer(self); self._chunk_timer.setInterval(0)
+        self._chunk_timer.timeout.connect(self._insert_next_chunk)
+
+    def rowCount(self, parent=QModelIndex()): return 0 if parent.isValid() else (1 if self._placeholder else len(self._index))
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid(): return None
+        key, msg = (None, self._placeholder) if self._placeholder else self._index.item(index.row())
+        if 'notice' in msg: key = None
+        if role == KeyRole: return key
+        if role == MessageRole: return msg
+        if role == FormattedRole and key is not None:
+            formatted = self._formatted.get(key)
+            if formatted is None: formatted = self._formatted[key] = format_message(msg)
+            return formatted
+        if role == Qt.ItemDataRole.DisplayRole:
+            if key is None: return msg.get('notice', '')
+            sender, time_str, text = self.data(index, FormattedRole)
+            return f"[{time_str}] {sender} {text}"
+        return None
+
+    def contains(self, key): return key in self._index or key in self._backlog_keys
+    def has_messages(self): return not self._placeholder and len(self._index) > 0
+
+    def approximate_bytes(self):
+        """Geschätzter Speicherbedarf (für den Raum-Cache): Zeilen mal Grundkosten plus mittlere Textlänge einer Stichprobe."""
+        rows = len(self._index) + len(self._backlog_keys)
+        if not rows: return 0
+        step = max(1, len(self._index) // 100)
+        sample = [self._index.item(row)[1] for row in range(0, len(self._index), step)]
+        text = sum(len(str(msg.get('text', ''))) + len(str(msg.get('username', ''))) for msg in sample) / max(len(sample), 1)
+        return int(rows * (self.ROW_OVERHEAD + text))
+    def row_of(self, key): return None if self._placeholder else self._index.position(key)
+
+    def items(self):
+        """Alle Nachrichten als (push_id, msg), auch die noch nicht eingefügten älteren Blöcke."""
+        return [] if self._placeholder else self._backlog[:self._backlog_end] + self._index.items()
+
+    def set_messages(self, items, incremental=False):
+        """Ersetzt den Inhalt; mit incremental=True erscheinen zuerst die neuesten RENDER_CHUNK Nachrichten."""
+        items = sorted(items, key=lambda item: sort_entry(*item))
+        self._drop_backlog()
+        if incremental and len(items) > self.RENDER_CHUNK:
+            self._backlog, self._backlog_end = items, len(items) - self.RENDER_CHUNK
+            self._backlog_keys = {key for key, _ in items[:self._backlog_end]}
+            items = items[self._backlog_end:]
+        self.beginResetModel(); self._index.reset(items); self._placeholder = None; self._formatted = {}; self.endResetModel()
+        if self._backlog_keys: self._chunk_timer.start()
+        else: self.loadingFinished.emit()
+
+    def finish_loading(self):
+        """Fügt noch ausstehende ältere Blöcke sofort ein (z. B. bevor zu einem Suchtreffer gesprungen wird)."""
+        while self._backlog_keys: self._insert_next_chunk()
+
+    def _insert_next_chunk(self):
+        start = max(0, self._backlog_end - self._chunk_size)
+        chunk = self._backlog[start:self._backlog_end]
+        self._backlog_end = start; self._backlog_keys.difference_update(key for key, _ in chunk)
+        started = time.perf_counter()
+        self.insert_messages(chunk)
+        elapsed_ms = max((time.perf_counter() - started) * 1000, 0.1)
+        # Nächsten Block aufs Zeitbudget skalieren, höchstens verdoppeln, damit ein Ausreißer den GUI-Thread nicht blockiert
+        self._chunk_size = max(self.RENDER_CHUNK, min(2 * len(chunk), int(len(chunk) * self.FRAME_BUDGET_MS / elapsed_ms)))
+        if not self._backlog_keys:
+            self._chunk_timer.stop(); self._backlog = []; self.loadingFinished.emit()
+
+    def _drop_backlog(self):
+        self._chunk_timer.stop(); self._backlog, self._backlog_end, self._backlog_keys, self._chunk_size = [], 0, set(), self.RENDER_CHUNK
+
+    def set_placeholder(self, text):
+        self._drop_backlog()
+        self.beginResetModel(); self._index.reset(); self._placeholder = {'notice': text}; self._formatted = {}; self.endResetModel()
+
+    def clear(self): self.set_messages([])
+
+    def insert_message(self, key, msg):
+        """Sortiert eine Nachricht nach (timestamp, push_id) ein; bekannte Push-IDs werden ersetzt. True, wenn neu."""
+        if self._placeholder: self.clear()
+        if key in self._index: self._replace(key, msg); return False
+        row = self._index.insertion_point(key, msg)
+        self.beginInsertRows(QModelIndex(), row, row); self._index.insert(key, msg); self.endInsertRows()
+        return True
+
+    def insert_messages(self, items):
+        """Fügt mehrere Nachrichten ein; liegen alle vor bzw. hinter dem Bestand, geschieht das in einem Schritt."""
+        items = sorted(((k, m) for k, m in items if k not in self._index), key=lambda item: sort_entry(*item))
+        if not items: return
+        if self._placeholder: self.clear()
+        first, last = self._index.first_entry(), self._index.last_entry()
+        if first is None or sort_entry(*items[-1]) < first: row = 0
+        elif sort_entry(*items[0]) > last: row = len(self._index)
+        else:
+            for key, msg in items: self.insert_message(key, msg)
+            return
+        self.beginInsertRows(QModelIndex(), row, row + len(items) - 1); self._index.insert_block(row, items); self.endInsertRows()
+
+    def update_message(self, key, fields):
+        msg = self._index.get(key)
+        if msg is not None: self._replace(key, {**msg, **fields})
+
+    def _replace(self, key, msg):
+        # Ändert sich der Zeitstempel (z. B. Server-Zeit beim Echo), wandert die Zeile an ihre richtige Stelle
+        self._formatted.pop(key, None)
+        old_row, new_row = self._index.position(key), self._index.insertion_point(key, msg)
+        if new_row in (old_row, old_row + 1): self._index.insert(key, msg)
+        else:
+            self.beginMoveRows(QModelIndex(), old_row, old_row, QModelIndex(), new_row); self._index.insert(key, msg); self.endMoveRows()
+        index = self.index(self._index.position(key)); self.dataChanged.emit(index, index)
+
+    def add_notice(self, text, error=False):
+        # Hinweise werden wie Nachrichten zum aktuellen Zeitpunkt einsortiert
+        self._notice_count += 1
+        last = self._index.last_entry()
+        timestamp = max(int(time.time() * 1000), last[0] if last else 0)
+        self.insert_message(f"notice-{self._notice_count}", {'notice': text, 'error': error, 'timestamp': timestamp})
+
+class MessageDelegate(QStyledItemDelegate):
+    """Zeichnet eine Nachricht als Kopfzeile (Zeit, Absender) plus umbrochenen Text, ohne HTML-Layout."""
+    PADDING = 6
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._heights, self._width, self._font_cache = {}, None, {}
+        # Liefert Vorschaubilder von Anhängen (attachments.ThumbnailLoader); ohne Loader nur der Platzhalter
+        self.thumbnails = None
+
+    def _fonts(self, option):
+        # Schriften und Metriken nur einmal pro Basisschrift anlegen, nicht bei jedem paint()/sizeHint()
+        cache_key = option.font.key()
+        fonts = self._font_cache.get(cache_key)
+        if fonts is None:
+            text_font = QFont(option.font)
+            bold_font = QFont(text_font); bold_font.setBold(True)
+            small_font = QFont(text_font); small_font.setPointSizeF(max(text_font.pointSizeF() - 1, 6))
+            fonts = self._font_cache[cache_key] = (text_font, bold_font, small_font, QFontMetrics(text_font), QFontMetrics(bold_font))
+        return fonts
+
+    def forget(self, key): self._heights.pop(key, None)
+
+    @staticmethod
+    def _thumbnail_size(msg, width):
+        # Die Größe steht in der Nachricht: die Zeile ist schon vor dem Laden des Bildes richtig hoch
+        attachment = attachment_of(msg)
+        thumbnail = attachment.get('thumbnail') if attachment else None
+        if not isinstance(thumbnail, dict) or not isinstance(thumbnail.get('width'), int) or not isinstance(thumbnail.get('height'), int): return None
+        if thumbnail['width'] <= 0 or thumbnail['height'] <= 0: return None
+        scale = min(1.0, width / thumbnail['width'])
+        return QSize(int(thumbnail['width'] * scale), int(thumbnail['height'] * scale))
+
+    def _text_width(self, option):
+        view = self.parent()
+        return max((view.viewport().width() if view else option.rect.width()) - 2 * self.PADDING, 50)
+
+    def sizeHint(self, option, index):
+        width = self._text_width(option)
+        if width != self._width: self._heights, self._width = {}, width
+        key = index.data(KeyRole)
+        if key is not None and key in self._heights: return QSize(width, self._heights[key])
+        _, _, _, text_metrics, bold_metrics = self._fonts(option)
+        if key is None: text, header = (index.data(MessageRole) or {}).get('notice', ''), 0
+        else: text, header = index.data(FormattedRole)[2], bold_metrics.height()
+        body = text_metrics.boundingRect(QRect(0, 0, width, 1 << 20), Qt.TextFlag.TextWordWrap, text).height()
+        height = header + body + 2 * self.PADDING
+        thumbnail_size = self._thumbnail_size(index.data(MessageRole) or {}, width) if key is not None else None
+        if thumbnail_size: height += thumbnail_size.height() + self.PADDING
+        if key is not None: self._heights[key] = height
+        return QSize(width, height)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        text_font, bold_font, small_font, _, bold_metrics = self._fonts(option)
+        rect = option.rect.adjusted(self.PADDING, self.PADDING, -self.PADDING, -self.PADDING)
+        key, msg, color = index.data(KeyRole), index.data(MessageRole) or {}, option.palette.text().color()
+        view = self.parent()
+        if view is not None and key is not None and key == getattr(view, 'highlighted_key', None):
+            painter.fillRect(option.rect, option.palette.highlight())
+        if key is None:
+            italic_font = QFont(text_font); italic_font.setItalic(True)
+            painter.setFont(italic_font); painter.setPen(QColor('red') if msg.get('error') else color)
+            painter.drawText(rect, Qt.TextFlag.TextWordWrap, msg.get('notice', ''))
+        else:
+            header_height = bold_metrics.height()
+            sender, time_str, text = index.data(FormattedRole)
+            painter.setFont(bold_font); painter.setPen(color)
+            painter.drawText(rect.left(), rect.top(), rect.width(), header_height, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter, sender)
+            painter.setFont(small_font); painter.setPen(QColor('red') if msg.get('failed') else option.palette.placeholderText().color())
+            sender_width = bold_metrics.horizontalAdvance(sender + " ")
+            painter.drawText(rect.left() + sender_width, rect.top(), rect.width() - sender_width, header_height, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter, time_str)
+            # Noch nicht bestätigte oder abgelehnte Nachrichten werden abgeschwächt gezeichnet
+            painter.setFont(text_font); painter.setPen(option.palette.placeholderText().color() if msg.get('pending') or msg.get('failed') else color)
+            text_rect = painter.boundingRect(rect.adjusted(0, header_height, 0, 0), Qt.TextFlag.TextWordWrap, text)
+            painter.drawText(rect.adjusted(0, header_height, 0, 0), Qt.TextFlag.TextWordWrap, text)
+            thumbnail_size = self._thumbnail_size(msg, rect.width())
+            if thumbnail_size:
+                target = QRect(QPoint(rect.left(), text_rect.bottom() + self.PADDING), thumbnail_size)
+                pixmap = self.thumbnails.pixmap(attachment_of(msg)['thumbnail']) if self.thumbnails else None
+                if pixmap is not None: painter.drawPixmap(target, pixmap)
+                else: painter.fillRect(target, option.palette.alternateBase())
+        painter.restore()
+
+class MessageListView(QListView):
+    """Virtualisierte Nachrichtenliste: nur sichtbare Zeilen werden gezeichnet, Layout erfolgt in Stapeln."""
+    reachedTop = pyqtSignal()
+    # Nur von Bedeutung, solange neuere Nachrichten noch nicht geladen sind (Fenster um einen Suchtreffer)
+    reachedBottom = pyqtSignal()
+    HIGHLIGHT_MS = 2500
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setItemDelegate(MessageDelegate(self))
+        self.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.setLayoutMode(QListView.LayoutMode.Batched); self.setBatchSize(200)
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        # Beim Einfügen oben bleibt der Abstand zum unteren Rand erhalten, sonst folgt die Ansicht dem Ende
+        self._follow_bottom, self._bottom_distance, self._adjusting = True, None, False
+        self.highlighted_key = None
+        self._highlight_timer = QTimer(self); self._highlight_timer.setSingleShot(True)
+        self._highlight_timer.timeout.connect(lambda: self.highlight_key(None))
+        scroll_bar = self.verticalScrollBar()
+        scroll_bar.rangeChanged.connect(self._on_range_changed)
+        scroll_bar.valueChanged.connect(self._on_value_changed)
+
+    def setModel(self, model):
+        # Beim Raumwechsel wird das Modell getauscht; das alte (im Raum-Cache) darf die Ansicht danach nicht mehr bewegen
+        old_model, old_selection = self.model(), self.selectionModel()
+        if old_model is not None:
+            old_model.dataChanged.disconnect(self._on_data_changed)
+            old_model.rowsAboutToBeInserted.disconnect(self._on_rows_about_to_be_inserted)
+        super().setModel(model)
+        if old_selection is not None: old_selection.deleteLater()
+        model.dataChanged.connect(self._on_data_changed)
+        model.rowsAboutToBeInserted.connect(self._on_rows_about_to_be_inserted)
+
+    def _on_rows_about_to_be_inserted(self, parent, first, last):
+        # Oben eingefügte Zeilen (ältere Seiten, nachgereichte Verlaufsblöcke) dürfen die Ansicht nicht verschieben
+        if first == 0 and self.model().rowCount() > 0: self.prepare_prepend()
+
+    def _on_data_changed(self, top_left, bottom_right, roles=()):
+        # Geänderte Zeilen müssen neu vermessen werden
+        for row in range(top_left.row(), bottom_right.row() + 1): self.itemDelegate().forget(self.model().index(row).data(KeyRole))
+
+    def set_thumbnail_loader(self, loader):
+        self.itemDelegate().thumbnails = loader
+        loader.thumbnailReady.connect(lambda path: self.viewport().update())
+
+    def scroll_to_end(self):
+        self._follow_bottom, self._bottom_distance = True, None
+        self._set_scroll_value(self.verticalScrollBar().maximum())
+
+    def highlight_key(self, key):
+        """Scrollt die Nachricht mit dieser Push-ID in die Mitte und hebt sie kurz hervor (z. B. einen Suchtreffer)."""
+        self.highlighted_key = key; self.viewport().update()
+        row = self.model().row_of(key) if key is not None else None
+        if row is None: return
+        self._scroll_to_row(row, QAbstractItemView.ScrollHint.PositionAtCenter)
+        self._highlight_timer.start(self.HIGHLIGHT_MS)
+
+    def _scroll_to_row(self, row, hint):
+        self._follow_bottom, self._bottom_distance = False, None
+        # Im Batched-Modus ist die Zielzeile evtl. noch nicht vermessen; einmal vollständig layouten
+        self.setLayoutMode(QListView.LayoutMode.SinglePass); self.doItemsLayout()
+        self.scrollTo(self.model().index(row), hint)
+        self.setLayoutMode(QListView.LayoutMode.Batched)
+
+    def scroll_state(self):
+        """Position für die Rückkehr in den Raum: None, wenn die Ansicht dem Ende folgt, sonst (oberste sichtbare Push-ID, Versatz)."""
+        if self._follow_bottom: return None
+        index = self.indexAt(QPoint(0, 0))
+        key = index.data(KeyRole) if index.isValid() else None
+        return None if key is None else (key, self.visualRect(index).top())
+
+    def restore_scroll_state(self, state):
+        row = self.model().row_of(state[0]) if state else None
+        if row is None: self.scroll_to_end(); return
+        self._scroll_to_row(row, QAbstractItemView.ScrollHint.PositionAtTop)
+        self._set_scroll_value(self.verticalScrollBar().value() - state[1])
+
+    def prepare_prepend(self):
+        """Vor dem Einfügen älterer Nachrichten aufrufen, damit die sichtbare Stelle nicht springt."""
+        scroll_bar = self.verticalScrollBar()
+        self._bottom_distance = scroll_bar.maximum() - scroll_bar.value()
+
+    def prepare_append(self): self._bottom_distance = None
+
+    def hold_position(self):
+        """Vor dem Anhängen neuerer Seiten aufrufen: die Ansicht bleibt stehen, statt dem neuen Ende zu folgen."""
+        self._follow_bottom, self._bottom_distance = False, None
+
+    def _set_scroll_value(self, value):
+        self._adjusting = True
+        try: self.verticalScrollBar().setValue(value)
+        finally: self._adjusting = False
+
+    def _on_range_changed(self, minimum, maximum):
+        if self._bottom_distance is not None: self._set_scroll_value(maximum - self._bottom_distance)
+        elif self._follow_bottom: self._set_scroll_value(maximum)
+
+    def _on_value_changed(self, value):
+        if self._adjusting: return
+        scroll_bar = self.verticalScrollBar()
+        self._follow_bottom, self._bottom_distance = value == scroll_bar.maximum(), None
+        if value == scroll_bar.minimum(): self.reachedTop.emit()
+        elif value == scroll_bar.maximum(): self.reachedBottom.emit()
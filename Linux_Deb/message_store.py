@@ -0,0 +1,132 @@
+# message_store.py
+
+import os
+import json
+import sqlite3
+import threading
+
+# Die lokale Nachrichten-Datenbank liegt neben der Sitzungsdatei
+MESSAGE_DB_FILE = os.path.join(os.path.expanduser('~'), '.tiwut_chat_messages.db')
+
+class MessageStore:
+    """Lokaler SQLite-Cache für Chatnachrichten, geschlüsselt nach Raum und Push-ID."""
+    def __init__(self, path=MESSAGE_DB_FILE):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # Nur ein Cache: kein fsync pro Transaktion (WAL bleibt trotzdem konsistent), das hält Stream und Suchindex schnell
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS messages (room_id TEXT NOT NULL, push_id TEXT NOT NULL, "
+                               "timestamp INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (room_id, push_id))")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS messages_by_time ON messages (room_id, timestamp)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            # Noch nicht bestätigte, ausgehende Nachrichten (überleben Verbindungsabbrüche und Neustarts)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS outbox (push_id TEXT PRIMARY KEY, room_id TEXT NOT NULL, "
+                               "created INTEGER NOT NULL, data TEXT NOT NULL)")
+            self.search_available = self._create_search_index()
+
+    def _create_search_index(self):
+        # Volltextindex über Text und Absender (rowid = rowid in messages), von Triggern in SQLite selbst gepflegt
+        exists = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'message_search'").fetchone()
+        try:
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(text, username, tokenize='unicode61 remove_diacritics 2')")
+        except sqlite3.OperationalError as e:
+            print(f"DEBUG: Volltextsuche nicht verfügbar (FTS5 fehlt): {e}"); return False
+        indexed = "json_extract(new.data, '$.text'), json_extract(new.data, '$.username')"
+        self._conn.execute(f"CREATE TRIGGER IF NOT EXISTS message_search_insert AFTER INSERT ON messages BEGIN "
+                           f"INSERT INTO message_search (rowid, text, username) VALUES (new.rowid, {indexed}); END")
+        self._conn.execute(f"CREATE TRIGGER IF NOT EXISTS message_search_update AFTER UPDATE OF data ON messages "
+                           f"WHEN json_extract(old.data, '$.text') IS NOT json_extract(new.data, '$.text') "
+                           f"OR json_extract(old.data, '$.username') IS NOT json_extract(new.data, '$.username') BEGIN "
+                           f"DELETE FROM message_search WHERE rowid = old.rowid; INSERT INTO message_search (rowid, text, username) VALUES (new.rowid, {indexed}); END")
+        self._conn.execute("CREATE TRIGGER IF NOT EXISTS message_search_delete AFTER DELETE ON messages BEGIN "
+                           "DELETE FROM message_search WHERE rowid = old.rowid; END")
+        # Ältere Datenbanken ohne Index einmalig nachindizieren
+        if not exists: self._conn.execute("INSERT INTO message_search (rowid, text, username) SELECT rowid, json_extract(data, '$.text'), json_extract(data, '$.username') FROM messages")
+        return True
+
+    def add_messages(self, room_id, messages_dict):
+        """Speichert Nachrichten ({push_id: nachricht}); Nachrichten ohne Zeitstempel werden ignoriert."""
+        valid = [(key, msg) for key, msg in messages_dict.items() if isinstance(msg, dict) and isinstance(msg.get('timestamp'), (int, float))]
+        if not valid: return
+        with self._lock, self._conn:
+            # Upsert statt REPLACE: die rowid (und damit der Suchindex-Eintrag) bleibt, unveränderte Zeilen werden nicht neu geschrieben
+            self._conn.executemany("INSERT INTO messages (room_id, push_id, timestamp, data) VALUES (?, ?, ?, ?) "
+                                   "ON CONFLICT (room_id, push_id) DO UPDATE SET timestamp = excluded.timestamp, data = excluded.data "
+                                   "WHERE messages.data IS NOT excluded.data",
+                                   [(room_id, key, msg['timestamp'], json.dumps(msg)) for key, msg in valid])
+
+    def update_message(self, room_id, push_id, fields):
+        """Übernimmt geänderte Felder in eine bereits gespeicherte Nachricht."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT data FROM messages WHERE room_id = ? AND push_id = ?", (room_id, push_id)).fetchone()
+            if not row: return
+            msg = {**json.loads(row[0]), **fields}
+            timestamp = msg['timestamp'] if isinstance(msg.get('timestamp'), (int, float)) else 0
+            self._conn.execute("UPDATE messages SET timestamp = ?, data = ? WHERE room_id = ? AND push_id = ?", (timestamp, json.dumps(msg), room_id, push_id))
+
+    def get_page(self, room_id, limit, end_at=None):
+        """Liefert die neuesten `limit` Nachrichten (optional bis einschließlich `end_at`), wie limitToLast/endAt."""
+        query, params = "SELECT push_id, data FROM messages WHERE room_id = ?", [room_id]
+        if end_at is not None: query += " AND timestamp <= ?"; params.append(end_at)
+        query += " ORDER BY timestamp DESC, push_id DESC LIMIT ?"; params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return {key: json.loads(data) for key, data in rows}
+
+    def get_page_from(self, room_id, limit, start_at):
+        """Liefert die ältesten `limit` Nachrichten ab einschließlich `start_at`, wie limitToFirst/startAt."""
+        with self._lock:
+            rows = self._conn.execute("SELECT push_id, data FROM messages WHERE room_id = ? AND timestamp >= ? ORDER BY timestamp, push_id LIMIT ?",
+                                      (room_id, start_at, limit)).fetchall()
+        return {key: json.loads(data) for key, data in rows}
+
+    def search(self, query, limit=50):
+        """Volltextsuche über alle Räume; liefert [(room_id, push_id, nachricht, ausschnitt)], beste Treffer zuerst."""
+        terms = query.split()
+        if not self.search_available or not terms: return []
+        # Jedes Wort als Präfix-Phrase: Sonderzeichen der FTS-Syntax bleiben so wirkungslos
+        match = " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+        with self._lock:
+            rows = self._conn.execute("SELECT m.room_id, m.push_id, m.data, snippet(message_search, -1, '[', ']', '...', 10) "
+                                      "FROM message_search JOIN messages m ON m.rowid = message_search.rowid "
+                                      "WHERE message_search MATCH ? ORDER BY rank LIMIT ?", (match, limit)).fetchall()
+        return [(room, key, json.loads(data), snippet) for room, key, data, snippet in rows]
+
+    def max_timestamp(self, room_id):
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(timestamp) FROM messages WHERE room_id = ?", (room_id,)).fetchone()
+        return row[0]
+
+    def add_outgoing(self, room_id, push_id, msg, created):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO outbox (push_id, room_id, created, data) VALUES (?, ?, ?, ?)", (push_id, room_id, created, json.dumps(msg)))
+
+    def get_outgoing(self, room_id=None):
+        """Liefert wartende Nachrichten als Liste von (room_id, push_id, nachricht, erstellt), älteste zuerst."""
+        query, params = "SELECT room_id, push_id, data, created FROM outbox", ()
+        if room_id is not None: query, params = query + " WHERE room_id = ?", (room_id,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY created, push_id", params).fetchall()
+        return [(room, key, json.loads(data), created) for room, key, data, created in rows]
+
+    def remove_outgoing(self, push_ids):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM outbox WHERE push_id = ?", [(key,) for key in push_ids])
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def clear(self):
+        """Löscht alle zwischengespeicherten Daten (für den Logout)."""
+        with self._lock, self._conn:
+            if self.search_available: self._conn.execute("DELETE FROM message_search")
+            for table in ("messages", "meta", "outbox"): self._conn.execute(f"DELETE FROM {table}")
+
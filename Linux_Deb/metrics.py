@@ -0,0 +1,126 @@
+# metrics.py
+
+import collections
+import contextlib
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from PyQt6.QtCore import Qt, QObject, QTimer, QElapsedTimer
+
+# Messwerte (Latenzen in ms, Zähler) für Diagnose-Panel und rotierendes JSON-Log.
+# Abgeschaltet kostet jeder Aufruf nur eine Abfrage von _enabled; einschalten per TIWUT_METRICS=1 oder im Panel.
+METRICS_LOG_FILE = os.path.join(os.path.expanduser('~'), '.tiwut_chat_metrics.log')
+LOG_MAX_BYTES, LOG_BACKUP_COUNT = 1024 * 1024, 3
+# Für Perzentile je Messgröße nur die letzten Werte aufheben
+SAMPLES_PER_METRIC = 512
+# Das Log wird gepuffert und höchstens alle paar Sekunden geschrieben
+FLUSH_INTERVAL = 5.0
+
+_enabled = os.environ.get('TIWUT_METRICS') == '1'
+_lock, _stats, _buffer, _last_flush, _logger = threading.Lock(), {}, [], 0.0, None
+_stall_detector = None
+
+class _Stat:
+    __slots__ = ('count', 'total', 'max', 'last', 'samples')
+    def __init__(self): self.count, self.total, self.max, self.last, self.samples = 0, 0.0, None, None, collections.deque(maxlen=SAMPLES_PER_METRIC)
+
+def enabled(): return _enabled
+
+def set_enabled(value):
+    global _enabled
+    _enabled = bool(value)
+    if _stall_detector is not None: _stall_detector.start() if _enabled else _stall_detector.stop()
+    if not _enabled: flush()
+
+def record(name, value, **fields):
+    """Speichert einen Messwert; zusätzliche Felder landen nur im Log."""
+    if not _enabled: return
+    global _last_flush
+    now = time.time()
+    with _lock:
+        stat = _stats.get(name) or _stats.setdefault(name, _Stat())
+        stat.count += 1; stat.total += value; stat.last = value; stat.samples.append(value)
+        if stat.max is None or value > stat.max: stat.max = value
+        _buffer.append({"t": round(now, 3), "metric": name, "value": round(value, 3), **fields})
+        due = now - _last_flush >= FLUSH_INTERVAL
+        if due: _last_flush = now
+    if due: flush()
+
+def count(name, n=1, **fields): record(name, n, **fields)
+
+class _Timer:
+    __slots__ = ('name', 'fields', 'start')
+    def __init__(self, name, fields): self.name, self.fields = name, fields
+    def __enter__(self): self.start = time.perf_counter(); return self
+    def __exit__(self, *exc_info): record(self.name, (time.perf_counter() - self.start) * 1000, **self.fields)
+
+_NO_TIMER = contextlib.nullcontext()
+
+def timer(name, **fields):
+    """Kontextmanager, der die Dauer des Blocks in ms unter `name` speichert."""
+    return _Timer(name, fields) if _enabled else _NO_TIMER
+
+def timed(name):
+    """Dekorator: misst jede Ausführung der Funktion in ms (auch wenn sie eine Ausnahme wirft)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled: return fn(*args, **kwargs)
+            with _Timer(name, {}): return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def snapshot():
+    """Liefert {name: {count, mean, p50, p95, max, last}} für das Diagnose-Panel."""
+    with _lock: stats = {name: (s.count, s.total, s.max, s.last, sorted(s.samples)) for name, s in _stats.items()}
+    result = {}
+    for name, (n, total, maximum, last, samples) in stats.items():
+        pick = lambda fraction: samples[min(len(samples) - 1, int(fraction * len(samples)))] if samples else None
+        result[name] = {"count": n, "mean": total / n if n else None, "p50": pick(0.5), "p95": pick(0.95), "max": maximum, "last": last}
+    return result
+
+def reset():
+    with _lock: _stats.clear()
+
+def flush():
+    """Schreibt gepufferte Messwerte als JSON-Zeilen ins rotierende Log."""
+    global _logger
+    with _lock:
+        entries = _buffer[:]; _buffer.clear()
+    if not entries: return
+    if _logger is None:
+        _logger = logging.getLogger('tiwut.metrics'); _logger.propagate = False; _logger.setLevel(logging.INFO)
+        try:
+            handler = logging.handlers.RotatingFileHandler(METRICS_LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s')); _logger.addHandler(handler)
+        except OSError as e: print(f"DEBUG: Metrik-Log nicht verfügbar: {e}")
+    _logger.info("\n".join(json.dumps(entry, separators=(',', ':')) for entry in entries))
+
+class StallDetector(QObject):
+    """Erkennt Hänger der GUI-Ereignisschleife: ein kurzer Timer, der zu spät feuert, wurde blockiert."""
+    INTERVAL_MS, THRESHOLD_MS = 50, 100
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._clock, self._timer = QElapsedTimer(), QTimer(self)
+        self._timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self._timer.timeout.connect(self._tick)
+
+    def start(self): self._clock.start(); self._timer.start(self.INTERVAL_MS)
+    def stop(self): self._timer.stop()
+
+    def _tick(self):
+        late = self._clock.restart() - self.INTERVAL_MS
+        if late >= self.THRESHOLD_MS: record('gui.stall', late)
+
+def install_stall_detector(parent=None):
+    """Legt den (einzigen) Hänger-Detektor im GUI-Thread an; er läuft nur, solange Metriken aktiv sind."""
+    global _stall_detector
+    if _stall_detector is None:
+        _stall_detector = StallDetector(parent)
+        if _enabled: _stall_detector.start()
+    return _stall_detector
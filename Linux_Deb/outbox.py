@@ -0,0 +1,95 @@
+# outbox.py
+
+import time
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
+
+import metrics
+from chat_core import generate_push_id, message_payload
+
+class Outbox(QObject):
+    """Persistente Warteschlange für ausgehende Nachrichten mit optimistischer Anzeige und Wiederholung."""
+    # Raum-ID, Push-ID und lokale Nachricht (mit 'pending': True) zur sofortigen Anzeige
+    messageQueued = pyqtSignal(str, str, dict)
+    # Raum-ID, endgültig abgelehnte Push-IDs und Fehlermeldung
+    sendFailed = pyqtSignal(str, list, str)
+    # Kurz warten, damit schnell hintereinander getippte Nachrichten in einem PATCH landen
+    FLUSH_DELAY_MS = 50
+    RETRY_BASE_MS, RETRY_MAX_MS = 2000, 60000
+
+    def __init__(self, firebase_manager, parent=None):
+        super().__init__(parent)
+        self.firebase_manager, self.store = firebase_manager, firebase_manager.message_store
+        self._in_flight, self._retry_attempt = False, 0
+        # Teile eines abgelehnten Stapels, die einzeln nachgeschickt werden, bevor wieder neu gebündelt wird
+        self._parts = []
+        self._flush_timer = QTimer(self); self._flush_timer.setSingleShot(True)
+        self._flush_timer.timeout.connect(self.flush)
+
+    def enqueue(self, room_id, text, attachment=None, key=None):
+        # Anhänge bringen ihre Push-ID mit: sie steckt schon im Storage-Pfad
+        key, created = key or generate_push_id(), int(time.time() * 1000)
+        payload = message_payload((self.firebase_manager.user_data or {}).get('displayName'), text, attachment)
+        self.store.add_outgoing(room_id, key, payload, created)
+        self.messageQueued.emit(room_id, key, self.pending_view(payload, created))
+        if not self._in_flight: self._flush_timer.start(self.FLUSH_DELAY_MS)
+        return key
+
+    def pending(self, room_id):
+        """Wartende Nachrichten eines Raums als [(push_id, lokale Nachricht)], z. B. nach einem Neustart."""
+        return [(key, self.pending_view(msg, created)) for _, key, msg, created in self.store.get_outgoing(room_id)]
+
+    @staticmethod
+    def pending_view(payload, created):
+        # Der Server-Zeitstempel ist noch unbekannt; bis zum Echo zählt die lokale Uhr
+        return {**payload, "timestamp": created, "pending": True}
+
+    def flush(self):
+        if self._in_flight: return
+        is_part = bool(self._parts)
+        if is_part: batch = self._parts.pop(0)
+        else:
+            outgoing = self.store.get_outgoing()
+            if not outgoing: return
+            batch = {}
+            for room_id, key, msg, _ in outgoing: batch.setdefault(room_id, {})[key] = msg
+        self._in_flight = True
+        task = self.firebase_manager.write_messages_async(batch)
+        task.succeeded.connect(lambda result: self._on_written(batch, result, is_part))
+        task.failed.connect(lambda error: self._on_write_error(batch, error, is_part))
+
+    @staticmethod
+    def split(batch):
+        """Teilt einen Stapel erst nach Räumen, dann nach Nachrichten; [] für eine einzelne Nachricht."""
+        if len(batch) > 1: return [{room_id: messages} for room_id, messages in batch.items()]
+        (room_id, messages), = batch.items()
+        return [{room_id: {key: msg}} for key, msg in messages.items()] if len(messages) > 1 else []
+
+    def _on_written(self, batch, result, is_part=False):
+        success, status = result
+        if success:
+            self._in_flight, self._retry_attempt = False, 0
+            self.store.remove_outgoing([key for messages in batch.values() for key in messages])
+            # Restliche Teile oder inzwischen neu Eingereihtes direkt hinterherschicken
+            if self._parts or self.store.get_outgoing(): self._flush_timer.start(self.FLUSH_DELAY_MS)
+        elif status in (400, 403):
+            self._in_flight = False
+            parts = self.split(batch)
+            if parts:
+                # Ein Multi-Path-PATCH scheitert als Ganzes; eine einzelne abgelehnte Nachricht (z. B. Regeln eines Raums) soll
+                # nicht den Rest mitreißen. Die Teile gehen einzeln raus, bis feststeht, welche Nachrichten abgelehnt werden
+                self._parts[:0] = parts; metrics.count('outbox.split', status=status, parts=len(parts))
+                self._flush_timer.start(0); return
+            # Eine einzelne Nachricht vom Server endgültig abgelehnt: nicht endlos wiederholen
+            self.store.remove_outgoing([key for messages in batch.values() for key in messages])
+            for room_id, messages in batch.items(): self.sendFailed.emit(room_id, list(messages), f"Message rejected by server (HTTP {status}).")
+            if self._parts or self.store.get_outgoing(): self._flush_timer.start(self.FLUSH_DELAY_MS)
+        else: self._on_write_error(batch, f"HTTP {status}", is_part)
+
+    def _on_write_error(self, batch, error, is_part=False):
+        self._in_flight = False
+        # Ein Teil eines aufgeteilten Stapels wird als Nächstes wiederholt, nicht wieder mit allem gebündelt
+        if is_part: self._parts.insert(0, batch)
+        delay = min(self.RETRY_MAX_MS, self.RETRY_BASE_MS * 2 ** self._retry_attempt)
+        self._retry_attempt += 1
+        metrics.count('outbox.retry', error=str(error), delay_ms=delay)
+        self._flush_timer.start(delay)
@@ -0,0 +1,63 @@
+# prefetch.py
+
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
+
+import metrics
+from task_runner import run_in_background
+
+class PrefetchScheduler(QObject):
+    """Wärmt die neueste Seite vieler Räume im Hintergrund vor: aktivste Räume zuerst, begrenzt parallel, abbrechbar.
+
+    Vom Benutzer ausgelöste Ladevorgänge haben Vorrang: yield_to_user() hält neue Vorab-Ladungen an, bis resume()
+    kommt (spätestens nach YIELD_MS). Bereits laufende Abrufe lassen sich nicht unterbrechen, ihr Ergebnis bleibt nützlich."""
+    # Raum-ID und Nachrichten ({push_id: nachricht}) der neuesten Seite
+    pageReady = pyqtSignal(str, dict)
+    MAX_CONCURRENT, YIELD_MS = 2, 2000
+
+    def __init__(self, fetch_fn, parent=None):
+        super().__init__(parent)
+        # fetch_fn(room_id) -> {push_id: nachricht}; läuft auf dem Task-Pool
+        self.fetch_fn = fetch_fn
+        self._queued, self._in_flight, self._paused, self._generation = {}, set(), False, 0
+        self._resume_timer = QTimer(self); self._resume_timer.setSingleShot(True)
+        self._resume_timer.timeout.connect(self.resume)
+
+    def schedule(self, room_id, priority=0):
+        """Reiht einen Raum ein; höhere Priorität (z. B. Zeitstempel der letzten Aktivität) kommt früher dran."""
+        if room_id in self._in_flight: return
+        self._queued[room_id] = max(priority, self._queued.get(room_id, priority))
+        self._start_next()
+
+    def bump(self, room_id, priority):
+        # Neue Aktivität in einem noch wartenden Raum zieht ihn nach vorn
+        if room_id in self._queued: self._queued[room_id] = max(self._queued[room_id], priority)
+
+    def cancel(self, room_id): self._queued.pop(room_id, None)
+
+    def cancel_all(self):
+        # Ergebnisse laufender Abrufe werden über die Generation verworfen
+        self._queued.clear(); self._generation += 1; self._in_flight.clear()
+
+    def yield_to_user(self, room_id=None):
+        """Der Benutzer lädt gerade selbst (diesen Raum); bis resume() keine neuen Vorab-Ladungen starten."""
+        if room_id is not None: self.cancel(room_id)
+        self._paused = True; self._resume_timer.start(self.YIELD_MS)
+
+    def resume(self):
+        self._paused = False; self._resume_timer.stop(); self._start_next()
+
+    def _start_next(self):
+        while not self._paused and self._queued and len(self._in_flight) < self.MAX_CONCURRENT:
+            room_id = max(self._queued, key=self._queued.get)
+            del self._queued[room_id]; self._in_flight.add(room_id)
+            generation = self._generation
+            task = run_in_background(self.fetch_fn, room_id)
+            task.succeeded.connect(lambda page, room_id=room_id, generation=generation: self._on_done(room_id, generation, page))
+            task.failed.connect(lambda error, room_id=room_id, generation=generation: self._on_done(room_id, generation, None, error))
+
+    def _on_done(self, room_id, generation, page, error=None):
+        if generation != self._generation: return
+        self._in_flight.discard(room_id)
+        if error is not None: metrics.count('prefetch.failed', room=room_id, error=error)
+        elif page is not None: metrics.count('prefetch.pages'); self.pageReady.emit(room_id, page)
+        self._start_next()
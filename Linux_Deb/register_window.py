@@ -69,10 +69,16 @@ class RegisterWindow(QWidget):
         if len(password) < 6: QMessageBox.warning(self, "Input Error", "Password must be at least 6 characters long."); return
         
         self.register_button.setEnabled(False); self.register_button.setText("Registering...")
-        success, message = self.firebase_manager.register(display_name, username, password)
+        task = self.firebase_manager.register_async(display_name, username, password)
+        task.succeeded.connect(self.on_register_finished); task.failed.connect(self.on_register_failed)
+
+    def on_register_finished(self, result):
+        success, message = result
         if success:
             QMessageBox.information(self, "Success", "Registration successful! Please log in.")
             self.registration_successful.emit()
-        else:
-            QMessageBox.critical(self, "Registration Failed", f"Error: {message}")
-            self.register_button.setEnabled(True); self.register_button.setText("Register")
+        else: self.on_register_failed(message)
+
+    def on_register_failed(self, message):
+        QMessageBox.critical(self, "Registration Failed", f"Error: {message}")
+        self.register_button.setEnabled(True); self.register_button.setText("Register")
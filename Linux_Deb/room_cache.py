@@ -0,0 +1,73 @@
+# room_cache.py
+
+from collections import OrderedDict
+
+from message_index import sort_timestamp
+
+class RoomView:
+    """Zustand eines zuletzt angesehenen Raums: sein Modell, die Scrollposition und der Stand des Nachladens."""
+    def __init__(self, model, scroll_state=None, last_timestamp=0, oldest_timestamp=None, boundary_keys=None, history_exhausted=False, pending_keys=None,
+                 newer_exhausted=True, newest_keys=None):
+        self.model, self.scroll_state = model, scroll_state
+        self.last_timestamp, self.oldest_timestamp, self.boundary_keys = last_timestamp, oldest_timestamp, boundary_keys or set()
+        self.history_exhausted, self.pending_keys = history_exhausted, pending_keys or set()
+        self.newer_exhausted, self.newest_keys = newer_exhausted, newest_keys or set()
+        self.size = model.approximate_bytes()
+
+    def apply_messages(self, messages_dict):
+        """Übernimmt Nachrichten, die im Hintergrund ankommen, damit der Raum beim Zurückwechseln aktuell ist."""
+        for key in self.pending_keys & messages_dict.keys():
+            self.pending_keys.discard(key); self.model.update_message(key, {**messages_dict[key], 'pending': False})
+        # Ein Fenster um einen Suchtreffer bekommt Neues erst beim Weiterblättern (load_newer_messages)
+        if self.newer_exhausted:
+            self.model.insert_messages(messages_dict.items())
+            self.last_timestamp = max([self.last_timestamp] + [sort_timestamp(msg) for msg in messages_dict.values()])
+        # Der Raum wächst im Hintergrund; RoomCache.resize() prüft danach die Speichergrenze erneut
+        self.size = self.model.approximate_bytes()
+
+class RoomCache:
+    """LRU der zuletzt angesehenen Räume (ohne den gerade angezeigten), begrenzt nach Anzahl und geschätztem Speicher."""
+    MAX_ROOMS, MAX_BYTES = 8, 64 * 1024 * 1024
+
+    def __init__(self, max_rooms=MAX_ROOMS, max_bytes=MAX_BYTES):
+        self.max_rooms, self.max_bytes, self._rooms = max_rooms, max_bytes, OrderedDict()
+
+    def __len__(self): return len(self._rooms)
+    def __contains__(self, room_id): return room_id in self._rooms
+
+    def peek(self, room_id):
+        """Liefert den Raum, ohne seine Position im LRU zu ändern (für Hintergrund-Updates)."""
+        return self._rooms.get(room_id)
+
+    def take(self, room_id):
+        """Entnimmt den Raum zur Anzeige; solange er angezeigt wird, zählt er nicht zum Cache."""
+        return self._rooms.pop(room_id, None)
+
+    def put(self, room_id, room_view):
+        """Legt einen Raum als zuletzt benutzt ab; gibt die verdrängten [(room_id, RoomView)] zurück."""
+        self._rooms[room_id] = room_view; self._rooms.move_to_end(room_id)
+        return self._evict()
+
+    def resize(self, room_id):
+        """Nach Änderungen an einem abgelegten Raum (apply_messages): verdrängt, bis die Grenzen wieder eingehalten sind.
+
+        Die LRU-Position des Raums bleibt; gibt die verdrängten [(room_id, RoomView)] zurück."""
+        return self._evict() if room_id in self._rooms else []
+
+    def _evict(self):
+        evicted = []
+        while self._rooms and (len(self._rooms) > self.max_rooms or self.total_bytes() > self.max_bytes):
+            evicted.append(self._rooms.popitem(last=False))
+        return evicted
+
+    def offer(self, room_id, room_view):
+        """Legt einen vorab geladenen Raum als am längsten unbenutzt ab, aber nur, wenn dafür nichts verdrängt werden muss."""
+        if room_id in self._rooms or len(self._rooms) >= self.max_rooms or self.total_bytes() + room_view.size > self.max_bytes: return False
+        self._rooms[room_id] = room_view; self._rooms.move_to_end(room_id, last=False)
+        return True
+
+    def total_bytes(self): return sum(room.size for room in self._rooms.values())
+
+    def clear(self):
+        evicted = list(self._rooms.items()); self._rooms.clear()
+        return evicted
@@ -0,0 +1,141 @@
+# storage.py
+
+import json
+import os
+import time
+from urllib.parse import quote
+import requests
+
+import metrics
+from chat_core import backoff_delay
+from config import firebaseConfig, STORAGE_URL
+from http_session import get_session
+
+# Firebase Storage über REST (dasselbe Protokoll wie das JS-SDK): Dateien gehen als resumable Upload in Blöcken hoch,
+# eine unterbrochene Sitzung wird über ihre Upload-URL an der vom Server bestätigten Stelle fortgesetzt.
+
+# Blockgröße; der Server verlangt ein Vielfaches von 256 KiB (X-Goog-Upload-Chunk-Granularity)
+CHUNK_GRANULARITY = 256 * 1024
+UPLOAD_CHUNK = 4 * CHUNK_GRANULARITY
+# Vorübergehend fehlgeschlagene Blöcke so oft wiederholen, bevor der Upload als fehlgeschlagen gilt (die Sitzung bleibt gültig)
+MAX_CHUNK_RETRIES = 5
+
+class UploadCancelled(Exception):
+    pass
+
+class StorageError(Exception):
+    """Fehlerantwort von Storage; status ist der HTTP-Status."""
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def retryable(self): return self.status is None or self.status >= 500 or self.status in (408, 429)
+
+class UploadSessionLost(StorageError):
+    """Die Upload-Sitzung ist abgelaufen oder verworfen (4xx); weiter geht es nur mit einer neuen Sitzung von vorn."""
+
+def attachment_path(room_id, key, filename):
+    # Ein Ordner pro Nachricht: gleichnamige Dateien verschiedener Nachrichten überschreiben sich nicht
+    return f"chats/{room_id}/{key}/{os.path.basename(filename).replace('/', '_')}"
+
+class StorageClient:
+    """Synchroner Storage-Client für Worker-Threads; authentifiziert mit dem ID-Token des TokenManager."""
+    def __init__(self, token_manager, bucket=None, base_url=STORAGE_URL):
+        self.tokens, self.http = token_manager, get_session()
+        self.bucket_url = f"{base_url}/v0/b/{bucket or firebaseConfig['storageBucket']}/o"
+
+    def _request(self, method, url, headers=None, **kwargs):
+        # Storage erwartet das Token im Header; bei 401 einmal erneuern und wiederholen (wie TokenManager.request)
+        token = self.tokens.id_token
+        response = self.http.request(method, url, headers={**(headers or {}), 'Authorization': f"Firebase {token}"}, **kwargs)
+        if response.status_code == 401:
+            new_token = self.tokens.refresh_if_stale(token)
+            if new_token: response = self.http.request(method, url, headers={**(headers or {}), 'Authorization': f"Firebase {new_token}"}, **kwargs)
+        return response
+
+    def object_url(self, path): return f"{self.bucket_url}/{quote(path, safe='')}"
+
+    def download_url(self, path, token): return f"{self.object_url(path)}?alt=media&token={token}"
+
+    def start_upload(self, path, size, content_type):
+        """Legt eine Upload-Sitzung an und gibt ihre URL zurück (die für die Wiederaufnahme gespeichert wird)."""
+        headers = {'X-Goog-Upload-Protocol': 'resumable', 'X-Goog-Upload-Command': 'start', 'X-Goog-Upload-Header-Content-Length': str(size),
+                   'X-Goog-Upload-Header-Content-Type': content_type, 'Content-Type': 'application/json; charset=utf-8'}
+        response = self._request('POST', self.bucket_url, headers, params={'name': path}, data=json.dumps({"name": path, "contentType": content_type}))
+        if response.status_code != 200 or 'X-Goog-Upload-URL' not in response.headers:
+            raise StorageError(f"Upload rejected (HTTP {response.status_code}).", response.status_code)
+        return response.headers['X-Goog-Upload-URL']
+
+    def query_upload(self, upload_url):
+        """Wie viele Bytes hat der Server schon? Gibt (status, bytes) zurück; status ist 'active' oder 'final'."""
+        response = self._request('POST', upload_url, {'X-Goog-Upload-Command': 'query'})
+        if response.status_code != 200: raise self._chunk_error("Upload session lost", response.status_code)
+        return response.headers.get('X-Goog-Upload-Status', 'active'), int(response.headers.get('X-Goog-Upload-Size-Received') or 0)
+
+    def upload_chunk(self, upload_url, offset, data, final):
+        """Sendet einen Block ab `offset`; der letzte Block schließt den Upload ab und liefert die Objekt-Metadaten."""
+        headers = {'X-Goog-Upload-Command': 'upload, finalize' if final else 'upload', 'X-Goog-Upload-Offset': str(offset)}
+        response = self._request('POST', upload_url, headers, data=data)
+        if response.status_code != 200: raise self._chunk_error("Chunk upload failed", response.status_code)
+        return response.json() if final else None
+
+    @staticmethod
+    def _chunk_error(message, status):
+        # 5xx, 408 und 429 sind vorübergehend; jede andere Ablehnung heißt, dass die Sitzung nicht mehr zu gebrauchen ist
+        error = StorageError(f"{message} (HTTP {status}).", status)
+        return error if error.retryable else UploadSessionLost(str(error), status)
+
+    def cancel_upload(self, upload_url):
+        try: self._request('POST', upload_url, {'X-Goog-Upload-Command': 'cancel'})
+        except requests.RequestException: pass # Die Sitzung verfällt serverseitig ohnehin
+
+    def metadata(self, path):
+        response = self._request('GET', self.object_url(path))
+        if response.status_code != 200: raise StorageError(f"Object not found (HTTP {response.status_code}).", response.status_code)
+        return response.json()
+
+    def upload_file(self, file_path, path, content_type, upload_url=None, on_session=None, on_progress=None, is_cancelled=None):
+        """Lädt eine Datei blockweise hoch, auch als Fortsetzung einer bestehenden Sitzung (`upload_url`).
+
+        Gibt die Objekt-Metadaten zurück. on_session(url) erhält eine neue Sitzungs-URL, on_progress(gesendet, gesamt)
+        den Fortschritt; liefert is_cancelled() True, wird die Sitzung verworfen und UploadCancelled ausgelöst."""
+        with open(file_path, 'rb') as f:
+            def read(offset): f.seek(offset); return f.read(UPLOAD_CHUNK)
+            return self._upload(read, os.path.getsize(file_path), path, content_type, upload_url, on_session, on_progress, is_cancelled)
+
+    def upload_bytes(self, data, path, content_type):
+        """Kleine Daten (z. B. Vorschaubilder), mit denselben Wiederholungen wie upload_file()."""
+        return self._upload(lambda offset: data[offset:offset + UPLOAD_CHUNK], len(data), path, content_type)
+
+    def _upload(self, read, size, path, content_type, upload_url=None, on_session=None, on_progress=None, is_cancelled=None):
+        if upload_url:
+            status, offset = self.query_upload(upload_url)
+            if status == 'final': return self.metadata(path)
+        else:
+            upload_url, offset = self.start_upload(path, size, content_type), 0
+            if on_session: on_session(upload_url)
+        attempt = 0
+        while True:
+            if is_cancelled and is_cancelled(): self.cancel_upload(upload_url); raise UploadCancelled()
+            data = read(offset)
+            final = offset + len(data) >= size
+            try: result = self.upload_chunk(upload_url, offset, data, final)
+            except (requests.RequestException, StorageError) as e:
+                # Nur vorübergehende Fehler wiederholen (Netz, 5xx, 408, 429)
+                attempt += 1
+                if (isinstance(e, StorageError) and not e.retryable) or attempt > MAX_CHUNK_RETRIES: raise
+                metrics.count('storage.chunk_retry', offset=offset, error=str(e))
+                # Der Block kann teilweise angekommen sein: an der vom Server bestätigten Stelle weitermachen
+                time.sleep(backoff_delay(attempt))
+                status, offset = self.query_upload(upload_url)
+                if status == 'final': return self.metadata(path)
+                continue
+            attempt, offset = 0, offset + len(data)
+            if on_progress: on_progress(offset, size)
+            if final: return result
+
+    def download(self, path, token):
+        response = self.http.get(self.download_url(path, token))
+        if response.status_code != 200: raise StorageError(f"Download failed (HTTP {response.status_code}).", response.status_code)
+        return response.content
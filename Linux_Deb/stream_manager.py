@@ -0,0 +1,91 @@
+# stream_manager.py
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+import metrics
+from firebase_manager import MessageStreamer, HISTORY_PAGE_SIZE
+
+# Wie lange stop_all() höchstens wartet, bis alle Streams ihre Verbindungen geschlossen haben (Sekunden)
+STOP_TIMEOUT = 3
+
+class StreamManager(QObject):
+    """Hält für jeden Raum einen Stream offen. Alle Streams teilen sich eine asyncio-Event-Loop in einem einzigen Thread.
+
+    Ein Stream ist dort nur eine Aufgabe, die auf ihren Socket wartet, statt einen Pool-Thread zu blockieren; es gibt
+    also keine Obergrenze für die Zahl der Räume. Welche Streams laufen, wird nur im GUI-Thread verändert."""
+    snapshotReceived = pyqtSignal(str, dict)
+    newMessage = pyqtSignal(str, str, dict)
+    messageUpdated = pyqtSignal(str, str, dict)
+    # Raum-ID und Fehlermeldung
+    errorOccurred = pyqtSignal(str, str)
+    # Intern: die Aufgabe eines Streams ist beendet (Raum-ID, MessageStreamer)
+    _streamFinished = pyqtSignal(str, object)
+
+    def __init__(self, firebase_manager, parent=None):
+        super().__init__(parent)
+        self.firebase_manager = firebase_manager
+        self.room_ids, self.streamers, self.futures, self.active_room_id = [], {}, {}, None
+        self.snapshot_rooms, self._loop, self._client = set(), None, None
+        self._streamFinished.connect(self._on_stream_finished)
+
+    def _ensure_loop(self):
+        if self._loop is not None: return
+        # Erst hier importiert, damit der Programmstart ohne asyncio auskommt
+        from chat_client import ChatClient, LoopThread
+        self._loop = LoopThread('room-streams')
+        # Derselbe TokenManager wie bei den REST-Aufrufen: ein Token, eine Erneuerung
+        self._client = ChatClient(tokens=self.firebase_manager.tokens)
+
+    def start(self, room_ids):
+        self.room_ids = list(room_ids)
+        for room_id in self.room_ids: self.ensure_stream(room_id)
+
+    def ensure_stream(self, room_id):
+        if room_id in self.streamers: return
+        self._ensure_loop()
+        # Mit Cache: alles ab dem neuesten gespeicherten Zeitstempel, sonst die neueste Seite
+        start_timestamp = self.firebase_manager.message_store.max_timestamp(room_id)
+        streamer = MessageStreamer(room_id, start_timestamp, None if start_timestamp is not None else HISTORY_PAGE_SIZE)
+        streamer.snapshotReceived.connect(self._on_snapshot)
+        streamer.newMessage.connect(self.newMessage)
+        streamer.messageUpdated.connect(self.messageUpdated)
+        streamer.errorOccurred.connect(lambda message, room_id=room_id: self.errorOccurred.emit(room_id, message))
+        self.streamers[room_id] = streamer
+        self.futures[room_id] = future = self._loop.submit(streamer.run(self._client))
+        future.add_done_callback(lambda future, room_id=room_id, streamer=streamer: self._on_done(room_id, streamer, future))
+
+    def _on_done(self, room_id, streamer, future):
+        # Läuft im Loop-Thread (bei cancel() im GUI-Thread); den Zustand fasst erst _on_stream_finished im GUI-Thread an
+        if not future.cancelled() and future.exception(): metrics.count('stream.aborted', room=room_id, error=repr(future.exception()))
+        self._streamFinished.emit(room_id, streamer)
+
+    def stop_room(self, room_id):
+        """Beendet den Stream eines Raums, den es nicht mehr gibt."""
+        if room_id in self.room_ids: self.room_ids.remove(room_id)
+        self.snapshot_rooms.discard(room_id)
+        streamer, future = self.streamers.pop(room_id, None), self.futures.pop(room_id, None)
+        # Was der Stream bis zum Abbruch noch meldet, soll nicht mehr ankommen
+        if streamer: streamer.blockSignals(True)
+        if future: future.cancel()
+
+    def set_active_room(self, room_id):
+        self.active_room_id = room_id
+        self.ensure_stream(room_id)
+
+    def has_stream(self, room_id): return room_id in self.streamers
+    def has_snapshot(self, room_id): return room_id in self.snapshot_rooms
+
+    def _on_snapshot(self, room_id, messages_dict):
+        self.snapshot_rooms.add(room_id); self.snapshotReceived.emit(room_id, messages_dict)
+
+    def _on_stream_finished(self, room_id, streamer):
+        # Nur aufräumen, wenn inzwischen kein neuer Stream für den Raum läuft
+        if self.streamers.get(room_id) is streamer: del self.streamers[room_id]; self.futures.pop(room_id, None)
+
+    def stop_all(self):
+        self.room_ids = []
+        for future in list(self.futures.values()): future.cancel()
+        self.streamers.clear(); self.futures.clear()
+        if self._loop is None: return
+        loop, client, self._loop, self._client = self._loop, self._client, None, None
+        loop.call(client.close); loop.stop(STOP_TIMEOUT)
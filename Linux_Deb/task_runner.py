@@ -0,0 +1,45 @@
+# task_runner.py
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+
+# Höchstzahl gleichzeitig laufender Hintergrundaufgaben (Login, Senden, Token-Erneuerung, ...)
+MAX_TASK_THREADS = 4
+
+class Task(QObject):
+    """Ergebnis einer Hintergrundaufgabe; die Signale kommen im GUI-Thread an."""
+    succeeded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    finished = pyqtSignal()
+
+class _TaskRunnable(QRunnable):
+    def __init__(self, task, fn, args, kwargs):
+        super().__init__()
+        self.task, self.fn, self.args, self.kwargs = task, fn, args, kwargs
+    def run(self):
+        try: result = self.fn(*self.args, **self.kwargs)
+        except Exception as e: self.task.failed.emit(str(e) or e.__class__.__name__)
+        else: self.task.succeeded.emit(result)
+        finally: self.task.finished.emit()
+
+_pool, _pending = None, set()
+
+def thread_pool():
+    global _pool
+    if _pool is None:
+        _pool = QThreadPool(); _pool.setMaxThreadCount(MAX_TASK_THREADS)
+    return _pool
+
+def run_in_background(fn, *args, **kwargs):
+    """Führt fn(*args, **kwargs) auf dem Task-Pool aus und gibt sofort ein Task-Objekt zurück."""
+    return run_in_pool(thread_pool, fn, *args, **kwargs)
+
+def run_in_pool(pool, fn, *args, **kwargs):
+    """Wie run_in_background(), aber auf einem eigenen Pool (`pool` liefert den QThreadPool, erst beim Start abgefragt)."""
+    task = Task()
+    # Referenz halten, bis die Aufgabe fertig ist; sonst räumt Python das Task-Objekt zu früh ab
+    _pending.add(task); task.finished.connect(lambda: _pending.discard(task))
+    # Erst im nächsten Event-Loop-Durchlauf starten: der Aufrufer verbindet seine Slots nach der Rückgabe,
+    # eine schnelle Aufgabe würde ihr Ergebnis sonst vorher ins Leere senden
+    runnable = _TaskRunnable(task, fn, args, kwargs)
+    QTimer.singleShot(0, lambda: pool().start(runnable))
+    return task
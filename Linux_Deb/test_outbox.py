@@ -0,0 +1,82 @@
+# test_outbox.py
+
+import time
+import pytest
+import requests
+from PyQt6.QtCore import QCoreApplication, QEventLoop
+
+from chat_core import generate_push_id, multi_path_update
+from fake_firebase import FakeFirebase, FakeFirebaseServer
+from message_store import MessageStore
+from outbox import Outbox
+from task_runner import run_in_background
+
+# Outbox gegen fake_firebase.py: Stapel, die der Server wegen einer einzelnen Nachricht ablehnt.
+# Start: python3 -m pytest -q test_outbox.py
+
+EMAIL, PASSWORD = 'tester@test.local', 'secret'
+
+@pytest.fixture
+def fake():
+    fake = FakeFirebase()
+    fake.create_user(EMAIL, PASSWORD, 'tester')
+    server = FakeFirebaseServer(fake=fake).start_in_background()
+    fake.url = server.url
+    yield fake
+    server.shutdown(); server.server_close()
+
+@pytest.fixture(scope='session')
+def app():
+    # Eine Anwendung für alle Tests; eine zweite QCoreApplication nach dem Abräumen der ersten bricht ab
+    app = QCoreApplication.instance() or QCoreApplication([])
+    yield app
+
+class Manager:
+    """Der Teil des FirebaseManagers, den die Outbox braucht: Anzeigename, lokaler Speicher und der Multi-Path-PATCH."""
+    def __init__(self, fake, store):
+        self.fake, self.message_store, self.user_data, self.writes = fake, store, {'displayName': 'tester'}, []
+        self.id_token, _, _ = fake.sign_in(EMAIL, PASSWORD)
+
+    def write_messages(self, messages_by_room):
+        self.writes.append({room_id: sorted(messages) for room_id, messages in messages_by_room.items()})
+        response = requests.patch(f"{self.fake.url}/.json", params={'auth': self.id_token, 'print': 'silent'}, json=multi_path_update(messages_by_room))
+        return response.status_code in (200, 204), response.status_code
+
+    def write_messages_async(self, messages_by_room): return run_in_background(self.write_messages, messages_by_room)
+
+def wait(app, condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline: raise AssertionError("timed out waiting for the outbox")
+        app.processEvents(QEventLoop.ProcessEventsFlag.AllEvents, 20)
+
+def test_rejected_message_does_not_fail_the_rest_of_its_batch(fake, app, tmp_path):
+    store = MessageStore(str(tmp_path / 'messages.db'))
+    manager = Manager(fake, store)
+    outbox, failed = Outbox(manager), []
+    outbox.sendFailed.connect(lambda room_id, keys, error: failed.append((room_id, keys)))
+    # Die Regeln lehnen genau eine Nachricht in 'general' ab; der ganze Multi-Path-PATCH scheitert damit zunächst
+    bad = generate_push_id()
+    fake.denied_paths.add(f"chats/general/messages/{bad}")
+    good = [outbox.enqueue('general', "first"), outbox.enqueue('general', "bad", key=bad), outbox.enqueue('general', "third"), outbox.enqueue('random', "other room")]
+    wait(app, lambda: not store.get_outgoing())
+    assert failed == [('general', [bad])]
+    written = {**fake.get(['chats', 'general', 'messages']), **fake.get(['chats', 'random', 'messages'])}
+    assert sorted(written) == sorted(key for key in good if key != bad)
+    # Erst alles, dann nach Räumen, dann in 'general' nach Nachrichten
+    assert manager.writes[0] == {'general': sorted(good[:3]), 'random': [good[3]]}
+    assert manager.writes[1] == {'general': sorted(good[:3])}
+    assert sorted(write['general'][0] for write in manager.writes[2:5]) == sorted(good[:3]) and manager.writes[5] == {'random': [good[3]]}
+
+def test_batch_is_bundled_again_after_the_split(fake, app, tmp_path):
+    store = MessageStore(str(tmp_path / 'messages.db'))
+    manager = Manager(fake, store)
+    outbox = Outbox(manager)
+    fake.denied_paths.add("chats/locked")
+    outbox.enqueue('locked', "rejected"); outbox.enqueue('general', "accepted")
+    wait(app, lambda: not store.get_outgoing())
+    # Nach dem Aufteilen gehen neue Nachrichten wieder gebündelt raus
+    writes = len(manager.writes)
+    outbox.enqueue('general', "one"); outbox.enqueue('random', "two")
+    wait(app, lambda: not store.get_outgoing())
+    assert len(manager.writes) == writes + 1
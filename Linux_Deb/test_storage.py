@@ -0,0 +1,115 @@
+# test_storage.py
+
+import threading
+import time
+import pytest
+from PyQt6.QtCore import QCoreApplication, QEventLoop
+
+import storage
+from attachments import AttachmentUploader
+from fake_firebase import FakeFirebase, FakeFirebaseServer
+from message_store import MessageStore
+from storage import CHUNK_GRANULARITY, UPLOAD_CHUNK, StorageClient, UploadSessionLost
+from task_runner import MAX_TASK_THREADS, run_in_background
+
+# Resumable Uploads gegen fake_firebase.py: verlorene Blöcke, verworfene Sitzungen und Abfragen nach dem Abschluss.
+# Start: python3 -m pytest -q test_storage.py
+
+EMAIL, PASSWORD, BUCKET = 'tester@test.local', 'secret', 'test-bucket'
+DATA = bytes(range(256)) * (3 * UPLOAD_CHUNK // 256 + CHUNK_GRANULARITY // 256)
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeFirebase()
+    fake.create_user(EMAIL, PASSWORD, 'tester')
+    server = FakeFirebaseServer(fake=fake).start_in_background()
+    fake.url = server.url
+    # Wiederholungen ohne Wartezeit
+    monkeypatch.setattr(storage, 'backoff_delay', lambda attempt: 0)
+    yield fake
+    server.shutdown(); server.server_close()
+
+@pytest.fixture(scope='session')
+def app():
+    app = QCoreApplication.instance() or QCoreApplication([])
+    yield app
+
+class Tokens:
+    """Der Teil des TokenManagers, den StorageClient braucht."""
+    def __init__(self, fake): self.id_token, _, _ = fake.sign_in(EMAIL, PASSWORD)
+    def refresh_if_stale(self, token): return None
+
+def client(fake): return StorageClient(Tokens(fake), BUCKET, fake.url)
+
+def read(offset, offsets=None):
+    if offsets is not None: offsets.append(offset)
+    return DATA[offset:offset + UPLOAD_CHUNK]
+
+class Crash(Exception):
+    pass
+
+def test_lost_chunks_are_retried_at_the_confirmed_offset(fake):
+    fake.failing_chunks = 3
+    meta = client(fake)._upload(read, len(DATA), 'x/retried.bin', 'application/octet-stream')
+    assert fake.failing_chunks == 0
+    assert fake.objects[meta['name']]['data'] == DATA
+
+def test_upload_resumes_an_existing_session(fake):
+    storage_client, sessions = client(fake), []
+    # Absturz nach dem zweiten Block: die Sitzung bleibt beim Server bestehen
+    def on_progress(sent, total):
+        if sent >= 2 * UPLOAD_CHUNK: raise Crash()
+    with pytest.raises(Crash):
+        storage_client._upload(read, len(DATA), 'x/resumed.bin', 'application/octet-stream', on_session=sessions.append, on_progress=on_progress)
+    offsets = []
+    meta = storage_client._upload(lambda offset: read(offset, offsets), len(DATA), 'x/resumed.bin', 'application/octet-stream', sessions[0])
+    assert offsets[0] == 2 * UPLOAD_CHUNK
+    assert fake.objects[meta['name']]['data'] == DATA
+
+def test_lost_session_raises_upload_session_lost(fake):
+    storage_client, sessions = client(fake), []
+    fake.failing_chunks = 1
+    # Der erste Block scheitert; bevor die Wiederholung ankommt, ist die Sitzung abgelaufen
+    original = storage_client.query_upload
+    def query_after_loss(upload_url): fake.lose_uploads(); return original(upload_url)
+    storage_client.query_upload = query_after_loss
+    with pytest.raises(UploadSessionLost) as error:
+        storage_client._upload(read, len(DATA), 'x/lost.bin', 'application/octet-stream', on_session=sessions.append)
+    assert error.value.status == 404 and not error.value.retryable
+
+def test_query_after_finish_reports_final(fake):
+    storage_client, sessions = client(fake), []
+    meta = storage_client._upload(read, len(DATA), 'x/done.bin', 'application/octet-stream', on_session=sessions.append)
+    # Die Antwort auf den letzten Block ging verloren: die Abfrage meldet den Abschluss statt 404
+    assert storage_client.query_upload(sessions[0]) == ('final', len(DATA))
+    assert storage_client._upload(lambda offset: b'', len(DATA), 'x/done.bin', 'application/octet-stream', sessions[0]) == meta
+
+class Manager:
+    """Der Teil des FirebaseManagers, den der AttachmentUploader braucht."""
+    def __init__(self, fake, store): self.tokens, self.message_store = Tokens(fake), store
+
+def wait(app, condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline: raise AssertionError("timed out waiting for the upload")
+        app.processEvents(QEventLoop.ProcessEventsFlag.AllEvents, 20)
+
+def test_uploader_restarts_a_lost_session_while_the_task_pool_is_busy(fake, app, tmp_path):
+    store = MessageStore(str(tmp_path / 'messages.db'))
+    uploader, uploaded = AttachmentUploader(Manager(fake, store)), []
+    uploader.storage = client(fake)
+    uploader.uploaded.connect(lambda room_id, key, attachment: uploaded.append(attachment))
+    file_path = tmp_path / 'file.bin'; file_path.write_bytes(DATA)
+    # Eine abgelaufene Sitzung aus dem letzten Lauf: resume_all() fängt mit neuer Sitzung von vorn an
+    store.set_meta(AttachmentUploader.UPLOADS_KEY, {'-key': {'room_id': 'general', 'file': str(file_path), 'name': 'file.bin', 'size': len(DATA),
+                                                             'contentType': 'application/octet-stream',
+                                                             'uploadUrl': f"{fake.url}/v0/b/{BUCKET}/o?name=x&upload_id=gone&upload_protocol=resumable"}})
+    # Alle Threads des gemeinsamen Task-Pools belegt: der Upload läuft trotzdem, auf seinem eigenen Pool
+    release = threading.Event()
+    for _ in range(MAX_TASK_THREADS): run_in_background(release.wait, 10)
+    try:
+        uploader.resume_all()
+        wait(app, lambda: uploaded)
+    finally: release.set()
+    assert fake.objects[uploaded[0]['path']]['data'] == DATA
+    assert not store.get_meta(AttachmentUploader.UPLOADS_KEY)
@@ -0,0 +1,192 @@
+# test_stream.py
+
+import asyncio
+import pytest
+
+import chat_client
+from chat_client import ChatClient
+from chat_core import TokenRefreshError, TokenState
+from fake_firebase import AuthError, FakeFirebase, FakeFirebaseServer
+from firebase_manager import MessageStreamer
+from message_index import MessageIndex
+
+# MessageStreamer (über ChatClient.stream) gegen fake_firebase.py: put, patch, keep-alive, cancel, auth_revoked und Reconnect.
+# Start: python3 -m pytest -q test_stream.py
+
+ROOM, EMAIL, PASSWORD = 'general', 'tester@test.local', 'secret'
+SEED_COUNT = 5
+
+@pytest.fixture
+def fake(monkeypatch):
+    # Reconnect ohne Backoff-Wartezeit, damit die Tests nicht von Zufallsverzögerungen abhängen
+    monkeypatch.setattr(chat_client, 'backoff_delay', lambda attempt: 0)
+    fake = FakeFirebase(keepalive_interval=0.05)
+    fake.seed_room(ROOM, SEED_COUNT); fake.create_user(EMAIL, PASSWORD, 'tester')
+    server = FakeFirebaseServer(fake=fake).start_in_background()
+    fake.url = server.url
+    yield fake
+    server.shutdown(); server.server_close()
+
+class StreamRun:
+    """Ein MessageStreamer auf einer Event-Loop im Test-Thread; die Signale kommen direkt an und werden gesammelt."""
+    def __init__(self, fake):
+        self.fake, self.refreshes = fake, 0
+        self.tokens = TokenState(self._refresh)
+        id_token, refresh_token, _ = fake.sign_in(EMAIL, PASSWORD)
+        self.tokens.set_tokens(id_token, refresh_token)
+        self.client = ChatClient(api_key='test', db_url=fake.url, tokens=self.tokens)
+        self.streamer = MessageStreamer(ROOM, None, 50)
+        self.snapshots, self.new, self.updated, self.errors, self.revoked = [], [], [], [], []
+        # Wie das Nachrichtenmodell der App: Snapshot und neue Nachrichten landen sortiert in einem MessageIndex
+        self.index = MessageIndex()
+        self.streamer.snapshotReceived.connect(lambda room_id, messages: (self.snapshots.append(messages), self.index.reset(messages.items())))
+        self.streamer.newMessage.connect(lambda room_id, key, msg: (self.new.append(key), self.index.insert(key, msg)))
+        self.streamer.messageUpdated.connect(lambda room_id, key, fields: self.updated.append((key, fields)))
+        self.streamer.errorOccurred.connect(self.errors.append)
+        self.streamer.authRevoked.connect(self.revoked.append)
+        self.task = None
+
+    def _refresh(self, refresh_token):
+        self.refreshes += 1
+        try: id_token, refresh_token, _ = self.fake.refresh(refresh_token)
+        except AuthError as e: raise TokenRefreshError(str(e)) from None
+        return id_token, refresh_token, self.fake.token_lifetime
+
+    def play(self, scenario):
+        """Startet den Stream, wartet auf den Snapshot und führt dann scenario(self) aus."""
+        async def main():
+            self.task = asyncio.create_task(self.streamer.run(self.client))
+            try:
+                await self.until(lambda: self.snapshots)
+                await scenario(self)
+            finally:
+                if not self.task.done(): self.task.cancel()
+                await asyncio.gather(self.task, return_exceptions=True)
+        asyncio.run(main())
+
+    async def until(self, condition, timeout=5):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not condition():
+            if asyncio.get_running_loop().time() > deadline: raise AssertionError("timed out waiting for the stream")
+            await asyncio.sleep(0.01)
+
+    def streams(self):
+        with self.fake.lock: return len(self.fake.listeners)
+
+def message(text, timestamp): return {"username": "other", "text": text, "timestamp": timestamp}
+
+def keys_in_order(fake):
+    messages = fake.get(['chats', ROOM, 'messages'])
+    return sorted(messages, key=lambda key: messages[key]['timestamp'])
+
+def test_put_delivers_snapshot_then_new_messages(fake):
+    async def scenario(run):
+        fake.inject(ROOM, 2)
+        await run.until(lambda: len(run.new) == 2)
+    run = StreamRun(fake); run.play(scenario)
+    assert len(run.snapshots) == 1 and len(run.snapshots[0]) == SEED_COUNT
+    assert run.new == keys_in_order(fake)[-2:]
+    assert not run.errors
+
+def test_patch_updates_known_messages_and_delivers_new_ones(fake):
+    seed_key = keys_in_order(fake)[0]
+    async def scenario(run):
+        # patch auf Raumebene: ein bekanntes Kind nur mit geänderten Feldern, ein neues vollständig
+        fake.update(['chats', ROOM, 'messages'], {seed_key: {"text": "edited"}, "-new": message("new", fake.server_timestamp())})
+        await run.until(lambda: run.updated and run.new)
+        # patch auf eine einzelne Nachricht
+        fake.update(['chats', ROOM, 'messages', seed_key], {"reactions": {"tester": "+1"}})
+        await run.until(lambda: len(run.updated) == 2)
+    run = StreamRun(fake); run.play(scenario)
+    assert run.updated == [(seed_key, {"text": "edited"}), (seed_key, {"reactions": {"tester": "+1"}})]
+    assert run.new == ["-new"]
+
+def test_late_put_with_an_older_timestamp_is_delivered_in_order(fake):
+    # Ein langsamer Client schreibt eine Nachricht, deren Zeitstempel zwischen zwei schon bekannten liegt
+    first, second = keys_in_order(fake)[-2:]
+    late_timestamp = (fake.get(['chats', ROOM, 'messages', first])['timestamp'] + fake.get(['chats', ROOM, 'messages', second])['timestamp']) // 2
+    async def scenario(run):
+        fake.inject(ROOM, 1)
+        await run.until(lambda: run.new)
+        fake.set(['chats', ROOM, 'messages', '-late'], message("late", late_timestamp))
+        await run.until(lambda: len(run.new) == 2)
+        # Dieselbe Push-ID noch einmal (z. B. ein wiederholter Schreibversuch) kommt nur einmal an
+        fake.set(['chats', ROOM, 'messages', '-late'], message("late", late_timestamp))
+        fake.inject(ROOM, 1)
+        await run.until(lambda: len(run.new) == 3)
+    run = StreamRun(fake); run.play(scenario)
+    assert run.new.count('-late') == 1
+    assert [key for key, _ in run.index.items()] == keys_in_order(fake)
+    assert run.index.position('-late') == run.index.position(second) - 1
+
+def test_keep_alive_holds_the_connection_past_the_read_timeout(fake, monkeypatch):
+    monkeypatch.setattr(chat_client, 'STREAM_READ_TIMEOUT', 0.3)
+    async def scenario(run):
+        await asyncio.sleep(1)
+        assert run.streams() == 1 and not run.errors
+        fake.inject(ROOM, 1)
+        await run.until(lambda: run.new)
+    run = StreamRun(fake); run.play(scenario)
+    assert len(run.snapshots) == 1
+
+def test_silent_connection_is_dropped_and_reconnected(fake, monkeypatch):
+    monkeypatch.setattr(chat_client, 'STREAM_READ_TIMEOUT', 0.3)
+    fake.keepalive_interval = 5
+    async def scenario(run):
+        await run.until(lambda: run.errors)
+        assert "stream read timeout" in run.errors[0]
+    StreamRun(fake).play(scenario)
+
+def test_cancel_ends_the_stream_with_an_error(fake):
+    async def scenario(run):
+        fake.interrupt_streams('cancel')
+        await asyncio.wait_for(run.task, 5)
+    run = StreamRun(fake); run.play(scenario)
+    assert run.errors == ["Stream cancelled by server: \"Permission denied\""]
+    assert not run.revoked and run.refreshes == 0
+
+def test_auth_revoked_refreshes_the_token_and_reconnects(fake):
+    async def scenario(run):
+        stale = run.tokens.id_token
+        fake.interrupt_streams('auth_revoked')
+        await run.until(lambda: run.refreshes == 1 and run.streams() == 1 and run.tokens.id_token != stale)
+        fake.inject(ROOM, 1)
+        await run.until(lambda: run.new)
+    run = StreamRun(fake); run.play(scenario)
+    assert len(run.new) == 1 and not run.errors and not run.revoked
+
+def test_auth_revoked_with_rejected_refresh_token_expires_the_session(fake):
+    async def scenario(run):
+        with fake.lock: fake.refresh_tokens.clear()
+        fake.interrupt_streams('auth_revoked')
+        await asyncio.wait_for(run.task, 5)
+    run = StreamRun(fake); run.play(scenario)
+    assert run.revoked == [ROOM] and run.errors == ["Session expired, please log in again."]
+
+def test_redirected_stream_follows_location_and_reconnects_to_the_new_host(fake):
+    shard = FakeFirebaseServer(fake=fake).start_in_background()
+    fake.stream_redirect = shard.url
+    try:
+        async def scenario(run):
+            fake.interrupt_streams('close')
+            await asyncio.sleep(0.3)
+            await run.until(lambda: run.streams() == 1)
+            fake.inject(ROOM, 1)
+            await run.until(lambda: run.new)
+        run = StreamRun(fake); run.play(scenario)
+    finally: shard.shutdown(); shard.server_close()
+    # Nur die erste Verbindung wurde umgeleitet; der Reconnect ging gleich an den neuen Server
+    assert fake.redirected_streams == 1 and len(run.new) == 1 and not run.errors
+
+def test_reconnect_resumes_without_gaps_or_duplicates(fake):
+    async def scenario(run):
+        fake.inject(ROOM, 2)
+        await run.until(lambda: len(run.new) == 2)
+        fake.interrupt_streams('close')
+        # Was während der Trennung geschrieben wird, kommt nach dem Reconnect genau einmal an
+        fake.inject(ROOM, 3)
+        await run.until(lambda: len(run.new) >= 5)
+        await asyncio.sleep(0.2)
+    run = StreamRun(fake); run.play(scenario)
+    assert run.new == keys_in_order(fake)[SEED_COUNT:]
+    assert len(run.snapshots) == 1 and not run.errors
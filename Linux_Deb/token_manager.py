@@ -0,0 +1,53 @@
+# token_manager.py
+
+import time
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
+
+from chat_core import TokenState, TOKEN_REFRESH_MARGIN
+from http_session import get_session
+from task_runner import run_in_background
+
+class TokenManager(QObject, TokenState):
+    """Hält das ID-Token gültig: erneuert es vor Ablauf im Hintergrund und bündelt gleichzeitige 401-Erneuerungen (über TokenState)."""
+    # Neues ID-Token und Refresh-Token
+    tokenRefreshed = pyqtSignal(str, str)
+    sessionExpired = pyqtSignal(str)
+    _scheduleRequested = pyqtSignal()
+    REFRESH_MARGIN, RETRY_DELAY = TOKEN_REFRESH_MARGIN, 30
+
+    def __init__(self, refresh_fn, parent=None):
+        # refresh_fn(refresh_token) -> (id_token, refresh_token, expires_in); wirft TokenRefreshError bei Ablehnung
+        super().__init__(parent, refresh_fn=refresh_fn)
+        self._timer = QTimer(self); self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._refresh_in_background)
+        # set_tokens() darf aus Worker-Threads kommen; den Timer stellt immer der GUI-Thread
+        self._scheduleRequested.connect(self._schedule)
+
+    def set_tokens(self, id_token, refresh_token=None, expires_in=None):
+        TokenState.set_tokens(self, id_token, refresh_token, expires_in)
+        self._scheduleRequested.emit()
+
+    def clear(self):
+        TokenState.clear(self); self._timer.stop()
+
+    def on_refreshed(self, id_token, refresh_token): self.tokenRefreshed.emit(id_token, refresh_token)
+    def on_expired(self, reason): self.sessionExpired.emit(reason)
+
+    def request(self, method, url, **kwargs):
+        """REST-Aufruf mit ?auth=<token>; bei 401 einmal erneuern und wiederholen."""
+        params, token = dict(kwargs.pop('params', None) or {}), self.id_token
+        response = get_session().request(method, url, params={**params, 'auth': token}, **kwargs)
+        if response.status_code == 401:
+            new_token = self.refresh_if_stale(token)
+            if new_token: response = get_session().request(method, url, params={**params, 'auth': new_token}, **kwargs)
+        return response
+
+    def _schedule(self):
+        if not self.refresh_token: return
+        delay = max(0.0, self.expires_at - self.REFRESH_MARGIN - time.time())
+        self._timer.start(int(delay * 1000))
+
+    def _refresh_in_background(self):
+        task = run_in_background(self.refresh_if_stale, self.id_token)
+        # Offline: später erneut versuchen, das alte Token bleibt bis zum Ablauf gültig
+        task.failed.connect(lambda error: self._timer.start(self.RETRY_DELAY * 1000))